@@ -2,18 +2,36 @@ const axios = require("axios");
 const ModelMetrics = require("../models/ModelMetrics");
 const FormData = require("form-data");
 
-// Proxy retrain to Flask
+// Proxy retrain to Flask (starts a background job and returns its id)
+// mode: "full" (default) or "incremental" (new users only)
 exports.retrainModel = async (req, res) => {
   try {
     const response = await axios.post(
-      "http://localhost:5001/api/retrain_model"
+      "http://localhost:5001/api/retrain_model",
+      { mode: (req.body && req.body.mode) || "full" }
     );
-    res.json(response.data);
+    res.status(response.status).json(response.data);
   } catch (err) {
+    if (err.response) {
+      return res.status(err.response.status).json(err.response.data);
+    }
     res.status(500).json({ error: err.message });
   }
 };
 
+// Proxy retrain job status to Flask
+exports.getRetrainJob = async (req, res) => {
+  try {
+    const response = await axios.get(
+      `http://localhost:5001/api/retrain_jobs/${encodeURIComponent(req.params.id)}`
+    );
+    res.json(response.data);
+  } catch (err) {
+    const status = err.response ? err.response.status : 500;
+    res.status(status).json({ error: err.response?.data?.error || err.message });
+  }
+};
+
 // Fetch latest metrics from MongoDB
 exports.getLatestMetrics = async (req, res) => {
   try {
@@ -41,10 +59,14 @@ exports.uploadCsv = async (req, res) => {
     const response = await axios.post(
       "http://localhost:5001/api/upload_csv",
       form,
-      { headers: form.getHeaders() }
+      { headers: form.getHeaders(), maxBodyLength: Infinity }
     );
     res.json(response.data);
   } catch (err) {
+    // Validation failures carry row-level errors from Flask
+    if (err.response) {
+      return res.status(err.response.status).json(err.response.data);
+    }
     res.status(500).json({ error: err.message });
   }
 };
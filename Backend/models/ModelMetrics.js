@@ -5,6 +5,8 @@ const ModelMetricsSchema = new mongoose.Schema({
   model_versions: { type: Object },
   trained_at: { type: Date, default: Date.now },
   dataset_files: { type: Object },
+  mode: { type: String },
+  stage_timings: { type: Object },
 });
 
 module.exports = mongoose.model(
@@ -29,6 +29,9 @@ const recipeSchema = new mongoose.Schema({
   diet_type: String,
   cooking_difficulty: String,
   prep_time: Number,
+}, {
+  // updated_at lets the ML service pick up recipe edits incrementally
+  timestamps: { createdAt: "created_at", updatedAt: "updated_at" },
 });
 
 // Add text index for searching recipes by name or ingredients
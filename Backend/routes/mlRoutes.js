@@ -7,6 +7,7 @@ router.use(fileUpload()); // Middleware for handling file uploads
 
 router.post("/upload_csv", mlController.uploadCsv);
 router.post("/retrain", mlController.retrainModel);
+router.get("/retrain_jobs/:id", mlController.getRetrainJob);
 router.get("/metrics", mlController.getLatestMetrics);
 
 module.exports = router;
@@ -1,32 +1,108 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-import pickle
 import pandas as pd
 import numpy as np
 import os
+import json
+import logging
+import threading
+import time
+import uuid
 from pymongo import MongoClient
-import traceback
+from bson import ObjectId
 from werkzeug.utils import secure_filename
+from recipe_catalog import RecipeCatalog
+from suitability_index import SuitabilityIndex
+from dietary_rules import DietaryRuleEngine
+from scoring import build_training_set
+from retrain_jobs import RetrainJobManager, MongoJobStore, StageTimer
+from training_cache import PreprocessingCache, dataset_hash
+from transformers import HealthPriorityTransformer
+from model_registry import ModelRegistry, LiveModels
+from incremental_training import FullRetrainRequired, incremental_update, training_state
+from user_features import CATEGORICAL_COLS, NUMERICAL_COLS, fill_user_defaults, prepare_user_frame, assign_clusters
+from meal_optimizer import CandidatePool, MealPlanOptimizer, daily_calorie_target, slot_layout
+from food_index import load_food_table
+from plan_cache import PlanCache, user_key
+from cluster_assigner import compiled_assigner
+from ingestion import IngestionError, ingest_file, load_dataset, has_columnar
+from plan_analytics import PlanArrays, PlanArraysCache, plan_statistics, plan_analysis, summarize
+from model_artifacts import PREFETCH_THREAD
+from service_logging import configure_logging
+from recipe_similarity import RecipeSimilarity
+from instrumentation import MetricsRegistry, StackSampler, count, end_trace, stage, start_trace
 
-# --- Custom transformer class needed for loading the model ---
-class HealthPriorityTransformer:
-    def __init__(self, high_cols=None, medium_cols=None, low_cols=None):
-        self.high_cols = high_cols or []
-        self.medium_cols = medium_cols or []
-        self.low_cols = low_cols or []
-    def fit(self, X, y=None):
-        return self
-    def transform(self, X):
-        return X
+logger = logging.getLogger('ml_service')
 
 # --- Flask app setup ---
+# Routes are registered on this module-level app; create_app() does the
+# loading (Mongo, models, catalog, indexes) that used to happen on import.
+# `python app.py` serves it with the development server; production runs
+# wsgi:app under gunicorn (gunicorn.conf.py), which loads everything once
+# before forking its workers.
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# --- Request timing and instrumentation ---
+# Every request runs under a Trace that the hot paths add stage timings and
+# counts to (instrumentation.stage/count). They are exported on /metrics and,
+# with SERVER_TIMING=1 or an "X-Server-Timing: 1" request header, as a
+# Server-Timing response header. With PROFILING_ENABLED=1 a request sent with
+# ?profile=1 (or "X-Profile: 1") is sampled and the folded stacks written to
+# PROFILE_DIR. Streaming responses are timed to their first result.
+metrics = MetricsRegistry(snapshot_dir=os.environ.get('METRICS_DIR'))
+SERVER_TIMING = os.environ.get('SERVER_TIMING') == '1'
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join('data', 'profiles'))
+
+@app.before_request
+def start_timer():
+    g.started_at = time.perf_counter()
+    g.trace, g.trace_token = start_trace(request.endpoint)
+    if PROFILING_ENABLED and '1' in (request.args.get('profile'), request.headers.get('X-Profile')):
+        g.sampler = StackSampler().start()
+
+@app.after_request
+def log_request(response):
+    started_at = g.pop('started_at', None)
+    trace = g.pop('trace', None)
+    token = g.pop('trace_token', None)
+    sampler = g.pop('sampler', None)
+    if token is not None:
+        try:
+            end_trace(token)
+        except ValueError:
+            pass  # reset from another context; the trace just goes out of scope
+    if sampler is not None:
+        try:
+            response.headers['X-Profile-File'] = sampler.stop().save(PROFILE_DIR, request.endpoint or 'unmatched')
+        except OSError as e:
+            logger.warning('Could not write profile: %s', e)
+    if started_at is not None:
+        duration = time.perf_counter() - started_at
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('ml_request_duration_seconds',
+                        {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)}, duration)
+        extra = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2)
+        }
+        if trace is not None and (trace.stages or trace.counts):
+            metrics.record(trace, duration)
+            extra.update(trace.to_dict())
+            if SERVER_TIMING or request.headers.get('X-Server-Timing') == '1':
+                response.headers['Server-Timing'] = trace.server_timing()
+        logger.info('request', extra=extra)
+        metrics.maybe_flush()
+    return response
+
 # --- File upload config ---
 UPLOAD_FOLDER = 'data'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 ALLOWED_EXTENSIONS = {'csv', 'xlsx'}
+UPLOAD_STAGING = '.uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 def allowed_file(filename):
@@ -42,111 +118,154 @@ def upload_csv():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(save_path)
+        # Validate and convert to columnar form chunk by chunk from a staging
+        # copy; it replaces the raw file only when the upload is usable, so a
+        # bad re-upload leaves the previous dataset in place
+        staging_dir = os.path.join(app.config['UPLOAD_FOLDER'], UPLOAD_STAGING)
+        os.makedirs(staging_dir, exist_ok=True)
+        staging_path = os.path.join(staging_dir, f'{uuid.uuid4().hex}-{filename}')
+        file.save(staging_path)
+        try:
+            report = ingest_file(staging_path, filename, app.config['UPLOAD_FOLDER'], schema=request.form.get('schema'))
+            os.replace(staging_path, save_path)
+        except IngestionError as e:
+            os.remove(staging_path)
+            return jsonify({'success': False, 'error': str(e), 'errors': e.errors}), 400
+        except Exception:
+            os.remove(staging_path)
+            raise
         # Optionally, log to MongoDB
         db.uploads.insert_one({
             'filename': filename,
             'path': save_path,
+            'schema': report['schema'],
+            'rows': report['rows'],
+            'rejected_rows': report['rejected_rows'],
             'uploaded_at': pd.Timestamp.now()
         })
-        return jsonify({'success': True, 'filename': filename})
+        return jsonify({
+            'success': True,
+            'filename': filename,
+            'schema': report['schema'],
+            'rows': report['rows'],
+            'rejected_rows': report['rejected_rows'],
+            'error_count': report['error_count'],
+            'errors': report['errors']
+        })
     return jsonify({'success': False, 'error': 'Invalid file type'}), 400
 
 # --- MongoDB connection ---
-MONGO_URI = "mongodb://localhost:27017/mydietdiary"
-try:
-    client = MongoClient(MONGO_URI)
+# One client per process: pymongo clients are not fork-safe, so every
+# gunicorn worker connects again after the fork (connect_mongo in post_fork).
+# The pool is sized for the worker's request threads plus the catalog refresh.
+MONGO_URI = os.environ.get('MONGO_URI', "mongodb://localhost:27017/mydietdiary")
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 16)),
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 60000,
+    'waitQueueTimeoutMS': 2000,
+    'serverSelectionTimeoutMS': 5000,
+    'connectTimeoutMS': 5000,
+    'socketTimeoutMS': 20000,
+    'retryReads': True
+}
+client = None
+db = None
+recipe_catalog = RecipeCatalog(None)
+
+def connect_mongo():
+    global client, db
+    client = MongoClient(MONGO_URI, connect=False, **MONGO_CLIENT_OPTIONS)
     db = client.get_database()  # Uses the database name from the URI
-    recipes_collection = db.recipes
-    # Verify connection
-    client.admin.command('ping')
-    print("Successfully connected to MongoDB!")
-except Exception as e:
-    print(f"Failed to connect to MongoDB: {e}")
-
-# --- Fetch recipes from MongoDB ---
+    recipe_catalog.rebind(db.recipes)
+    retrain_jobs.store = MongoJobStore(db.retrain_jobs)
+    return client
+
+def mongo_ping():
+    try:
+        client.admin.command('ping')
+        return True
+    except Exception as e:
+        logger.warning('MongoDB ping failed: %s', e)
+        return False
+
+# --- Fetch recipes from the in-memory catalog ---
 def fetch_recipes_from_mongodb():
     try:
-        recipes = list(recipes_collection.find({}))
-        for recipe in recipes:
-            if '_id' in recipe:
-                recipe['_id'] = str(recipe['_id'])
-        recipes_df = pd.DataFrame(recipes)
-        print(f"Fetched {len(recipes_df)} recipes from MongoDB")
-        return recipes_df
+        return recipe_catalog.snapshot()
     except Exception as e:
-        print(f"Error fetching recipes from MongoDB: {e}")
-        return pd.DataFrame()
+        logger.error('Error fetching recipes from MongoDB: %s', e)
+        return None
+
+@app.route('/api/recipes/invalidate', methods=['POST'])
+def invalidate_recipes():
+    recipe_catalog.invalidate()
+    return jsonify({'success': True, 'catalog_version': recipe_catalog.version})
 
 # --- Load all required models ---
+# models/CURRENT names the active version; LiveModels hot-swaps it in place
+model_registry = ModelRegistry('models')
+live_models = LiveModels(model_registry)
+
 def load_models():
-    models = {}
     try:
-        with open('models/kmeans_model.pkl', 'rb') as f:
-            models['kmeans_model'] = pickle.load(f)
-        with open('models/pca.pkl', 'rb') as f:
-            models['pca'] = pickle.load(f)
-        with open('models/rf_model.pkl', 'rb') as f:
-            models['rf_model'] = pickle.load(f)
-        with open('models/preprocessing_pipeline.pkl', 'rb') as f:
-            models['preprocessing_pipeline'] = pickle.load(f)
-        with open('models/cluster_analysis.pkl', 'rb') as f:
-            models['cluster_analysis'] = pickle.load(f)
-        with open('models/categorical_cols.pkl', 'rb') as f:
-            models['categorical_cols'] = pickle.load(f)
-        print("All models loaded successfully!")
-        return models
+        return live_models.get()
     except Exception as e:
-        print(f"Error loading models: {e}")
+        logger.error('Error loading models: %s', e)
         return None
 
-models = load_models()
+# --- Dietary exclusion rules (data/dietary_rules.json) ---
+dietary_rules = DietaryRuleEngine()
+meal_optimizer = MealPlanOptimizer()
+
+# --- Cluster x recipe suitability index ---
+suitability_index = None
+
+def get_suitability_index(rf_model, n_clusters, catalog):
+    global suitability_index
+    if suitability_index is None or suitability_index.rf_model is not rf_model or suitability_index.n_clusters != n_clusters:
+        suitability_index = SuitabilityIndex(rf_model, n_clusters)
+    return suitability_index.sync(catalog)
+
+def build_suitability_index():
+    # Warm the index at model-load and retrain time so the first request is a lookup
+    try:
+        catalog = fetch_recipes_from_mongodb()
+        models = load_models()
+        if models and catalog is not None and len(catalog):
+            get_suitability_index(models['rf_model'], models['kmeans_model'].n_clusters, catalog)
+    except Exception as e:
+        logger.error('Error building suitability index: %s', e)
 
 # --- Retraining pipeline function ---
-def retrain_pipeline(train_user_params_df, recipes_df):
-    import pickle
+preprocessing_cache = PreprocessingCache()
+SILHOUETTE_SAMPLE = 10000
+
+def retrain_pipeline(train_user_params_df, recipes_df, progress=None, dataset_files=None, n_clusters=5):
     import numpy as np
     import pandas as pd
+    import sklearn
     from sklearn.preprocessing import StandardScaler, OneHotEncoder
     from sklearn.compose import ColumnTransformer
     from sklearn.pipeline import Pipeline
     from sklearn.decomposition import PCA
     from sklearn.cluster import KMeans
     from sklearn.ensemble import RandomForestClassifier
-    from sklearn.model_selection import train_test_split, RandomizedSearchCV
+    from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+    from sklearn.model_selection import HalvingRandomSearchCV
     from sklearn.metrics import silhouette_score, accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
+    progress = progress or (lambda stage: None)
 
     # 1. Handle missing values
-    health_cols = ['Diabetes', 'Digestive Disorders', 'Food Allergies', 'Food Intolerances']
-    for col in health_cols:
-        train_user_params_df[col] = train_user_params_df[col].fillna('None')
-    train_user_params_df['Exercise Type'] = train_user_params_df['Exercise Type'].fillna('Unknown')
-    train_user_params_df['Alcohol Consumption'] = train_user_params_df['Alcohol Consumption'].fillna('None')
-    train_user_params_df['Hypertension'] = train_user_params_df['Hypertension'].fillna('No')
-    train_user_params_df['Cardiovascular'] = train_user_params_df['Cardiovascular'].fillna('Absent')
+    progress('preprocessing')
+    fill_user_defaults(train_user_params_df)
 
     # 2. Define columns
     high_priority_cols = ['Diabetes', 'Hypertension', 'Cardiovascular', 'Digestive Disorders', 'Food Allergies']
     medium_priority_cols = ['BMI Category', 'Weight (kg)', 'Target Weight (kg)']
     low_priority_cols = ['Meal Size Preference', 'Diet Type', 'Food Intolerances']
-    # Define columns based on the actual CSV structure
-    categorical_cols = [
-        'Diabetes', 'Hypertension', 'Cardiovascular', 'Digestive Disorders', 
-        'Food Allergies', 'BMI Category', 'Weight Change History', 'Exercise Type', 
-        'Physical Job Activity Level', 'Work Schedule', 'Sleep Quality', 'Stress Level', 
-        'Meal Timing Regularity', 'Cooking Skills', 'Food Budget', 'Alcohol Consumption', 
-        'Smoking Status', 'Snacking Behavior', 'Travel Frequency', 'Diet Type', 
-        'Meal Size Preference', 'Spice Tolerance', 'Cuisine Preferences',
-        'Food Texture Preferences', 'Portion Control Ability', 'Previous Diet Success History',
-        'Food Intolerances', 'Meal Complexity Preference', 'Seasonal Diet Preference'
-    ]
-
-    numerical_cols = [
-        'Height (cm)', 'Weight (kg)', 'Target Weight (kg)', 'Exercise Frequency', 
-        'Exercise Duration (min)', 'Daily Steps Count', 'Sleep Duration (hrs)',
-        'Available Cooking Time (min)', 'Water Intake (cups)', 'Eating Out Frequency',
-        'Food Prep Time Availability (min)'
-    ]
+    categorical_cols = list(CATEGORICAL_COLS)
+    numerical_cols = list(NUMERICAL_COLS)
     # 3. Preprocessing pipeline
     numerical_transformer = Pipeline(steps=[('scaler', StandardScaler())])
     categorical_transformer = Pipeline(steps=[('onehot', OneHotEncoder(handle_unknown='ignore'))])
@@ -163,20 +282,29 @@ def retrain_pipeline(train_user_params_df, recipes_df):
             low_cols=low_priority_cols
         ))
     ])
-    X_train_processed = preprocessing_pipeline.fit_transform(train_user_params_df)
+    # Reused while the model input columns are unchanged
+    cache_key = dataset_hash(train_user_params_df, numerical_cols + categorical_cols,
+                             salt=sklearn.__version__ + repr((high_priority_cols, medium_priority_cols, low_priority_cols)))
+    preprocessing_pipeline, X_train_processed, cache_hit = preprocessing_cache.fit_transform(
+        cache_key, preprocessing_pipeline, train_user_params_df)
 
     # 4. PCA
+    progress('pca')
     pca = PCA(n_components=0.95)
     X_train_reduced = pca.fit_transform(X_train_processed)
 
     # 5. KMeans clustering
-    optimal_k = 5
+    progress('kmeans')
+    optimal_k = n_clusters
     kmeans = KMeans(n_clusters=optimal_k, random_state=42, n_init=10)
     kmeans.fit(X_train_reduced)
     cluster_labels = kmeans.predict(X_train_reduced)
-    silhouette = silhouette_score(X_train_reduced, cluster_labels)
+    # Sampled: the exact score is quadratic in the number of users
+    silhouette = silhouette_score(X_train_reduced, cluster_labels,
+                                  sample_size=min(len(cluster_labels), SILHOUETTE_SAMPLE), random_state=42)
 
     # 6. Cluster profile analysis
+    progress('cluster_profiles')
     train_user_params_df['cluster'] = cluster_labels
     cluster_analysis = train_user_params_df.groupby('cluster').agg({
         'Diabetes': lambda x: x.value_counts().index[0],
@@ -192,95 +320,50 @@ def retrain_pipeline(train_user_params_df, recipes_df):
         cluster_analysis['Diet Type'] = 'Non-spicy'
 
     # 7. Recipe suitability dataset creation
-    def is_recipe_suitable_for_cluster(cluster_profile, recipe):
-        # (Use your suitability logic here)
-        # Diabetes check
-        if 'Diabetes' in cluster_profile and cluster_profile['Diabetes'] in ['Type 1', 'Type 2']:
-            if 'diabetes_friendly' in recipe and not recipe['diabetes_friendly']:
-                return 0
-        if 'Hypertension' in cluster_profile and cluster_profile['Hypertension'] == 'Yes':
-            if 'low_sodium' in recipe and not recipe['low_sodium']:
-                return 0
-        if 'Cardiovascular' in cluster_profile and cluster_profile['Cardiovascular'] == 'Present':
-            if 'heart_healthy' in recipe and not recipe['heart_healthy']:
-                return 0
-        if 'Digestive Disorders' in cluster_profile and cluster_profile['Digestive Disorders'] == 'Celiac':
-            if 'gluten_free' in recipe and not recipe['gluten_free']:
-                return 0
-        if 'Food Allergies' in cluster_profile and 'ingredients' in recipe and isinstance(recipe['ingredients'], str):
-            ingredients_lower = recipe['ingredients'].lower()
-            if cluster_profile['Food Allergies'] == 'Nuts' and any(nut in ingredients_lower for nut in ['nuts', 'peanut', 'almond', 'cashew', 'walnut']):
-                return 0
-            if cluster_profile['Food Allergies'] == 'Dairy' and any(dairy in ingredients_lower for dairy in ['milk', 'cheese', 'yogurt', 'cream', 'butter']):
-                return 0
-            if cluster_profile['Food Allergies'] == 'Shellfish' and any(shellfish in ingredients_lower for shellfish in ['shrimp', 'crab', 'lobster', 'prawn']):
-                return 0
-        if 'Diet Type' in cluster_profile and 'ingredients' in recipe and isinstance(recipe['ingredients'], str):
-            ingredients_lower = recipe['ingredients'].lower()
-            recipe_name_lower = recipe['name'].lower() if 'name' in recipe and isinstance(recipe['name'], str) else ""
-            if cluster_profile['Diet Type'] == 'Vegetarian':
-                non_veg_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'fish', 'salmon', 'tuna', 
-                                      'shrimp', 'meat', 'bacon', 'ham', 'sausage', 'seafood', 'cod', 'tilapia']
-                if any(ingredient in ingredients_lower or ingredient in recipe_name_lower for ingredient in non_veg_ingredients):
-                    return 0
-            elif cluster_profile['Diet Type'] == 'Vegan':
-                non_vegan_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'fish', 'salmon', 'tuna', 
-                                        'shrimp', 'meat', 'bacon', 'ham', 'sausage', 'seafood', 'milk', 'cheese',
-                                        'yogurt', 'cream', 'butter', 'egg', 'honey', 'dairy']
-                if any(ingredient in ingredients_lower or ingredient in recipe_name_lower for ingredient in non_vegan_ingredients):
-                    return 0
-            elif cluster_profile['Diet Type'] == 'Pescatarian':
-                non_pescatarian_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'meat', 'bacon', 'ham', 'sausage']
-                if any(ingredient in ingredients_lower or ingredient in recipe_name_lower for ingredient in non_pescatarian_ingredients):
-                    return 0
-        return 1
-
-    X_train_rf, y_train_rf = [], []
-    for cluster_id, cluster_profile in cluster_analysis.iterrows():
-        for _, recipe in recipes_df.iterrows():
-            recipe_features = recipe[['calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber']].values
-            features_with_cluster = np.append(recipe_features, cluster_id)
-            # Add meal type features
-            is_breakfast = 1 if recipe.get('meal_type', '').lower() == 'breakfast' else 0
-            is_lunch = 1 if recipe.get('meal_type', '').lower() == 'lunch' else 0
-            is_dinner = 1 if recipe.get('meal_type', '').lower() == 'dinner' else 0
-            features_with_cluster = np.append(features_with_cluster, [is_breakfast, is_lunch, is_dinner])
-            suitability = is_recipe_suitable_for_cluster(cluster_profile, recipe)
-            X_train_rf.append(features_with_cluster)
-            y_train_rf.append(suitability)
-    X_train_rf = np.array(X_train_rf)
-    y_train_rf = np.array(y_train_rf)
+    progress('training_set')
+    rule_index = dietary_rules.index_for_dataframe(recipes_df)
+    X_train_rf, y_train_rf = build_training_set(cluster_analysis, recipes_df, rule_index)
 
     # 8. Random Forest training and tuning
+    # Successive halving with the tree count as the budget: every candidate
+    # starts with a few trees and only the best third go on to more
+    progress('rf_search')
     param_grid = {
-        'n_estimators': [100, 200],
         'max_depth': [None, 10],
         'min_samples_split': [2, 5],
         'min_samples_leaf': [1, 2],
         'max_features': ['sqrt', None],
-        'class_weight': [None, 'balanced'],
-        'bootstrap': [True]
+        'class_weight': [None, 'balanced']
     }
-    random_search = RandomizedSearchCV(
-        RandomForestClassifier(random_state=42),
+    search = HalvingRandomSearchCV(
+        RandomForestClassifier(bootstrap=True, random_state=42),
         param_distributions=param_grid,
-        n_iter=5,
+        n_candidates=9,
+        resource='n_estimators',
+        min_resources=22,
+        max_resources=200,
+        factor=3,
         cv=3,
         scoring='f1',
+        refit=False,
         n_jobs=-1,
         verbose=0,
         random_state=42
     )
-    random_search.fit(X_train_rf, y_train_rf)
-    rf_model = random_search.best_estimator_
+    search.fit(X_train_rf, y_train_rf)
+    progress('rf_fit')
+    final_model = RandomForestClassifier(**search.best_params_, bootstrap=True, oob_score=True, random_state=42, n_jobs=-1)
+    final_model.fit(X_train_rf, y_train_rf)
+    final_model.set_params(n_jobs=None)
 
     # 9. Evaluation
-    X_train, X_test, y_train, y_test = train_test_split(
-        X_train_rf, y_train_rf, test_size=0.2, random_state=42, stratify=y_train_rf
-    )
-    final_model = RandomForestClassifier(**random_search.best_params_, random_state=42)
-    final_model.fit(X_train, y_train)
-    y_pred = final_model.predict(X_test)
+    # Out-of-bag predictions of the final forest: every row is scored only by
+    # trees that never saw it, so no second fit on a split is needed
+    progress('evaluation')
+    oob = final_model.oob_decision_function_
+    scored = ~np.isnan(oob).any(axis=1)
+    y_test = y_train_rf[scored]
+    y_pred = final_model.classes_[np.argmax(oob[scored], axis=1)]
     acc = accuracy_score(y_test, y_pred)
     prec = precision_score(y_test, y_pred)
     rec = recall_score(y_test, y_pred)
@@ -288,243 +371,543 @@ def retrain_pipeline(train_user_params_df, recipes_df):
     conf = confusion_matrix(y_test, y_pred).tolist()
 
     # 10. Save models and artifacts
-    os.makedirs('models', exist_ok=True)
-    with open('models/kmeans_model.pkl', 'wb') as f:
-        pickle.dump(kmeans, f)
-    with open('models/pca.pkl', 'wb') as f:
-        pickle.dump(pca, f)
-    with open('models/rf_model.pkl', 'wb') as f:
-        pickle.dump(final_model, f)
-    with open('models/preprocessing_pipeline.pkl', 'wb') as f:
-        pickle.dump(preprocessing_pipeline, f)
-    with open('models/cluster_analysis.pkl', 'wb') as f:
-        pickle.dump(cluster_analysis, f)
-    with open('models/categorical_cols.pkl', 'wb') as f:
-        pickle.dump(categorical_cols, f)
-
-    # 11. Return metrics and model version info
+    progress('save')
     metrics = {
         'accuracy': acc,
         'f1_score': f1,
         'precision': prec,
         'recall': rec,
         'silhouette_score': silhouette,
-        'confusion_matrix': conf
+        'confusion_matrix': conf,
+        'rf_params': search.best_params_,
+        'preprocessing_cache_hit': cache_hit
     }
+    # What a later incremental update starts from
+    state = training_state(train_user_params_df, cluster_labels, kmeans, X_train_reduced, recipes_df, dataset_files)
+    # Published as a new version; serving processes pick it up from models/CURRENT
+    version = model_registry.publish({
+        'kmeans_model': kmeans,
+        'pca': pca,
+        'rf_model': final_model,
+        'preprocessing_pipeline': preprocessing_pipeline,
+        'cluster_analysis': cluster_analysis,
+        'categorical_cols': categorical_cols
+    }, metadata={'metrics': metrics, 'mode': 'full', 'training_state': state})
+
+    # 11. Return metrics and model version info
     model_versions = {
-        'kmeans': 'v2',
-        'pca': 'v2',
-        'rf': 'v2',
+        'version': version,
+        'kmeans': version,
+        'pca': version,
+        'rf': version,
         'timestamp': str(pd.Timestamp.now())
     }
     return metrics, model_versions
 
+# --- Incremental update pipeline function ---
+def incremental_pipeline(new_user_params_df, recipes_df, dataset_files=None, progress=None):
+    # Updates the current version with new users only; raises
+    # FullRetrainRequired when the drift metrics call for a full retrain
+    bundle = model_registry.load(mapped=False)
+    metadata = bundle.manifest.get('metadata', {})
+    rule_index = dietary_rules.index_for_dataframe(recipes_df)
+    artifacts, report = incremental_update(
+        bundle, new_user_params_df, recipes_df, rule_index,
+        state=metadata.get('training_state'), dataset_files=dataset_files, progress=progress
+    )
+    progress = progress or (lambda stage: None)
+    progress('save')
+    # Without an RF refit the previous evaluation still describes the model
+    metrics = dict(metadata.get('metrics', {}))
+    if report['rf_metrics'] is not None:
+        metrics.update(report['rf_metrics'])
+    if report['silhouette_score'] is not None:
+        metrics['silhouette_score'] = report['silhouette_score']
+    version = model_registry.publish(artifacts, metadata={
+        'metrics': metrics,
+        'mode': 'incremental',
+        'base_version': bundle.version,
+        'drift': report['drift'],
+        'affected_clusters': report['affected_clusters'],
+        'training_state': report['training_state']
+    })
+    model_versions = {
+        'version': version,
+        'base_version': bundle.version,
+        'kmeans': version,
+        'pca': version,
+        'rf': version if report['rf_refit'] else bundle.version,
+        'timestamp': str(pd.Timestamp.now())
+    }
+    return metrics, model_versions, report
+
+# --- Retraining jobs ---
+def run_retrain(user_csv, recipe_csv, progress=None, user_csvs=None):
+    # Runs inside the retrain worker process; user_csvs (all user files
+    # trained so far) are concatenated for a full retrain after incremental updates
+    timer = StageTimer(progress)
+    timer('load_data')
+    user_csvs = user_csvs or [user_csv]
+    train_user_params_df = pd.concat([load_dataset('data', f) for f in user_csvs], ignore_index=True)
+    recipes_df = load_dataset('data', recipe_csv)
+    dataset_files = {'user_csv': user_csv, 'recipe_csv': recipe_csv, 'user_csvs': user_csvs}
+    metrics, model_versions = retrain_pipeline(train_user_params_df, recipes_df, progress=timer, dataset_files=dataset_files)
+    return {
+        'mode': 'full',
+        'metrics': metrics,
+        'model_versions': model_versions,
+        'dataset_files': dataset_files,
+        'training_rows': len(train_user_params_df),
+        'stage_timings': timer.timings()
+    }
+
+def run_incremental_retrain(user_csv, recipe_csv, trained_user_csvs=(), progress=None):
+    timer = StageTimer(progress)
+    timer('load_data')
+    new_user_params_df = load_dataset('data', user_csv)
+    recipes_df = load_dataset('data', recipe_csv)
+    dataset_files = {'user_csv': user_csv, 'recipe_csv': recipe_csv}
+    try:
+        metrics, model_versions, report = incremental_pipeline(new_user_params_df, recipes_df, dataset_files, progress=timer)
+    except FullRetrainRequired as e:
+        logger.info('Falling back to a full retrain: %s', e)
+        user_csvs = [f for f in trained_user_csvs if os.path.exists(os.path.join('data', f))] + [user_csv]
+        result = run_retrain(user_csv, recipe_csv, progress=progress, user_csvs=user_csvs)
+        result['full_retrain_reason'] = str(e)
+        result['drift'] = e.drift
+        result['stage_timings'] = {**{f'incremental_{stage}': t for stage, t in timer.timings().items()}, **result['stage_timings']}
+        return result
+    return {
+        'mode': 'incremental',
+        'metrics': metrics,
+        'model_versions': model_versions,
+        'drift': report['drift'],
+        'affected_clusters': report['affected_clusters'],
+        'rf_refit': report['rf_refit'],
+        'new_rows': report['new_rows'],
+        'dataset_files': dataset_files,
+        'stage_timings': timer.timings()
+    }
+
+def on_retrain_success(job, result):
+    # Runs in the serving process once the worker has written the new models
+    live_models.reload()
+    build_suitability_index()
+    rows = result.get('training_rows', result.get('new_rows'))
+    metrics.record_stages(f"retrain_{result['mode']}", result['stage_timings'],
+                          {'training_rows': rows} if rows is not None else None)
+    metrics.observe('ml_operation_duration_seconds', {'operation': f"retrain_{result['mode']}"},
+                    sum(result['stage_timings'].values()))
+    db.model_metrics.insert_one({
+        'metrics': result['metrics'],
+        'model_versions': result['model_versions'],
+        'trained_at': pd.Timestamp.now(),
+        'dataset_files': result['dataset_files'],
+        'mode': result['mode'],
+        'stage_timings': result['stage_timings'],
+        'job_id': job.id
+    })
+    return result
+
+retrain_jobs = RetrainJobManager(on_success=on_retrain_success)
+
 # --- Retrain endpoint ---
 @app.route('/api/retrain_model', methods=['POST'])
 def retrain_model():
-    print("Received retrain request!")
     try:
         # Find latest user and recipe CSVs in data/
-        user_csvs = sorted([f for f in os.listdir('data') if 'user' in f and f.endswith('.csv')])
-        recipe_csvs = sorted([f for f in os.listdir('data') if 'recipe' in f and f.endswith('.csv')])
+        # XLSX uploads qualify once they have been ingested to columnar form
+        def is_dataset(f):
+            return f.endswith('.csv') or (f.endswith('.xlsx') and has_columnar('data', f))
+        user_csvs = sorted([f for f in os.listdir('data') if 'user' in f and is_dataset(f)])
+        recipe_csvs = sorted([f for f in os.listdir('data') if 'recipe' in f and is_dataset(f)])
         if not user_csvs or not recipe_csvs:
             return jsonify({'success': False, 'error': 'User or recipe CSV not found'}), 400
-        user_csv = user_csvs[-1]
         recipe_csv = recipe_csvs[-1]
-        train_user_params_df = pd.read_csv(os.path.join('data', user_csv))
-        recipes_df = pd.read_csv(os.path.join('data', recipe_csv))
-
-        # Call your retraining function
-        metrics, model_versions = retrain_pipeline(train_user_params_df, recipes_df)
-
-        # Log metrics to MongoDB
-        db.model_metrics.insert_one({
-            'metrics': metrics,
-            'model_versions': model_versions,
-            'trained_at': pd.Timestamp.now(),
-            'dataset_files': {
-                'user_csv': user_csv,
-                'recipe_csv': recipe_csv
-            }
-        })
-        return jsonify({'success': True, 'metrics': metrics, 'model_versions': model_versions})
+        # "incremental" trains on the newest user file not yet in the current
+        # version and escalates to a full retrain when the data has drifted
+        mode = (request.get_json(silent=True) or {}).get('mode') or request.args.get('mode', 'full')
+        if mode == 'incremental':
+            try:
+                metadata = model_registry.manifest(model_registry.current_version() or 'legacy').get('metadata', {})
+            except (OSError, ValueError):
+                metadata = {}
+            trained = (metadata.get('training_state') or {}).get('user_files', [])
+            new_csvs = [f for f in user_csvs if f not in trained]
+            if not new_csvs:
+                return jsonify({'success': False, 'error': 'No new user data since the last training run'}), 400
+            user_csv = new_csvs[-1]
+            job, coalesced = retrain_jobs.submit(run_incremental_retrain, (user_csv, recipe_csv, tuple(trained)),
+                                                 key=('incremental', user_csv, recipe_csv))
+        elif mode == 'full':
+            user_csv = user_csvs[-1]
+            job, coalesced = retrain_jobs.submit(run_retrain, (user_csv, recipe_csv), key=(user_csv, recipe_csv))
+        else:
+            return jsonify({'success': False, 'error': f'Unknown retrain mode: {mode}'}), 400
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'mode': mode,
+            'status': job.status,
+            'coalesced': coalesced,
+            'status_url': f'/api/retrain_jobs/{job.id}'
+        }), 202
     except Exception as e:
-        traceback.print_exc()
+        logger.exception('Error starting retrain job')
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# --- Model versions ---
+@app.route('/api/models', methods=['GET'])
+def list_model_versions():
+    models = load_models()
+    return jsonify({
+        'success': True,
+        'current_version': model_registry.current_version(),
+        'serving_version': models.version if models else None,
+        'versions': model_registry.list_versions()
+    })
+
+@app.route('/api/models/rollback', methods=['POST'])
+def rollback_models():
+    try:
+        version = (request.get_json(silent=True) or {}).get('version')
+        version = model_registry.rollback(version)
+        live_models.reload()
+        build_suitability_index()
+        return jsonify({'success': True, 'current_version': version})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/retrain_jobs', methods=['GET'])
+def list_retrain_jobs():
+    return jsonify({'success': True, 'jobs': [job.to_dict() for job in retrain_jobs.list()]})
+
+@app.route('/api/retrain_jobs/<job_id>', methods=['GET'])
+def get_retrain_job(job_id):
+    job = retrain_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job id'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
 # --- Diet plan generation function and helpers ---
-def generate_diet_plan(user_params, kmeans_model, pca, rf_model, cluster_analysis, days=7):
-    recipes_df = fetch_recipes_from_mongodb()
-    if recipes_df.empty:
-        raise Exception("Failed to fetch recipes from database")
-    user_df = pd.DataFrame([user_params])
-    for col in user_df.select_dtypes(include=['object']).columns:
-        user_df[col] = user_df[col].fillna('Unknown')
-    for col in user_df.select_dtypes(include=['object']).columns:
-        user_df[col] = user_df[col].astype(str)
-    categorical_cols = models['categorical_cols']
-    for col in categorical_cols:
-        if col not in user_df.columns:
-            user_df[col] = 'Unknown'
-    user_features = models['preprocessing_pipeline'].transform(user_df)
-    user_reduced = pca.transform(user_features)
-    user_cluster = kmeans_model.predict(user_reduced)[0]
-    cluster_profile = cluster_analysis.loc[user_cluster]
-    suitable_recipes = []
-    diet_type = user_params.get('Diet Type', 'Non-spicy')
-    for _, recipe in recipes_df.iterrows():
-        recipe_features = recipe[['calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber']].values
-        features_with_cluster = np.append(recipe_features, user_cluster)
-        # Add meal type features
-        is_breakfast = 1 if recipe.get('meal_type') == 'breakfast' else 0
-        is_lunch = 1 if recipe.get('meal_type') == 'lunch' else 0
-        is_dinner = 1 if recipe.get('meal_type') == 'dinner' else 0
-        features_with_cluster = np.append(features_with_cluster, [is_breakfast, is_lunch, is_dinner])
-        suitability = models['rf_model'].predict([features_with_cluster])[0]
-
-        suitability = models['rf_model'].predict([features_with_cluster])[0]
-        diet_suitable = True
-        recipe_name = recipe['name'].lower() if 'name' in recipe and isinstance(recipe['name'], str) else ""
-        if 'ingredients' in recipe:
-            if isinstance(recipe['ingredients'], list):
-                recipe_ingredients = ' '.join(recipe['ingredients']).lower()
-            else:
-                recipe_ingredients = str(recipe['ingredients']).lower()
-        else:
-            recipe_ingredients = ""
-        if diet_type == 'Vegetarian':
-            non_veg_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'fish', 'salmon', 'tuna', 
-                                  'shrimp', 'meat', 'bacon', 'ham', 'sausage', 'seafood', 'cod', 'tilapia']
-            if any(ingredient in recipe_name or ingredient in recipe_ingredients for ingredient in non_veg_ingredients):
-                diet_suitable = False
-        elif diet_type == 'Vegan':
-            non_vegan_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'fish', 'salmon', 'tuna', 
-                                    'shrimp', 'meat', 'bacon', 'ham', 'sausage', 'seafood', 'milk', 'cheese',
-                                    'yogurt', 'cream', 'butter', 'egg', 'honey', 'dairy']
-            if any(ingredient in recipe_name or ingredient in recipe_ingredients for ingredient in non_vegan_ingredients):
-                diet_suitable = False
-        elif diet_type == 'Pescatarian':
-            non_pescatarian_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'meat', 'bacon', 'ham', 'sausage']
-            if any(ingredient in recipe_name or ingredient in recipe_ingredients for ingredient in non_pescatarian_ingredients):
-                diet_suitable = False
-        if suitability == 1 and diet_suitable:
-            suitable_recipes.append(recipe)
+# Cluster assignments and candidate pools of repeat requests; PLAN_CACHE_DB
+# points at a SQLite file to share assignments between worker processes
+plan_cache = PlanCache(shared_path=os.environ.get('PLAN_CACHE_DB'))
+
+@app.route('/api/plan_cache', methods=['GET', 'DELETE'])
+def plan_cache_api():
+    if request.method == 'DELETE':
+        plan_cache.clear()
+    return jsonify({'success': True, **plan_cache.stats()})
+
+def candidate_recipes(user_params, user_cluster, catalog, index):
+    # RF suitability for the cluster AND the user's own dietary restrictions
+    suitable = index.suitable[user_cluster]
+    allowed = suitable & dietary_rules.index_for(catalog).allowed_mask(user_params)
+    positions = np.flatnonzero(allowed)
+    count('recipes_scanned', len(suitable))
+    count('candidates_suitable', suitable.sum())
+    count('candidates_allowed', len(positions))
+    return CandidatePool(catalog, positions, index.probabilities[user_cluster, positions])
+
+def build_meal_plan(user_params, pool, days=7, seed=None, repeat_window=None):
+    layout = slot_layout(user_params)
+    count('meal_slots', days * len(layout))
+    plan = meal_optimizer.plan(pool, layout, daily_calorie_target(user_params), days=days, seed=seed,
+                               repeat_window=repeat_window)
     meal_plan = {}
-    meal_preference = user_params.get('Meal Size Preference', 'Regular 3 meals')
-    if meal_preference == 'Small frequent':
-        meal_types = ['Breakfast', 'Morning Snack', 'Lunch', 'Afternoon Snack', 'Dinner']
-    elif meal_preference == 'Regular 3 meals':
-        meal_types = ['Breakfast', 'Lunch', 'Dinner']
-    else:
-        meal_types = ['Brunch', 'Dinner']
-    bmi_category = user_params.get('BMI Category', 'Normal')
-    if bmi_category == 'Underweight':
-        daily_calorie_target = 2500
-    elif bmi_category == 'Normal':
-        daily_calorie_target = 2000
-    elif bmi_category == 'Overweight':
-        daily_calorie_target = 1800
-    else:
-        daily_calorie_target = 1500
-    used_recipes = set()
-    for day in range(1, days+1):
+    for day, chosen in enumerate(plan, start=1):
         meal_plan[f'Day {day}'] = {}
-        for meal_type in meal_types:
-            if 'Breakfast' in meal_type or 'Morning' in meal_type or 'Brunch' in meal_type:
-                meal_recipes = [r for r in suitable_recipes if 'meal_type' in r and r['meal_type'] == 'breakfast']
-            elif 'Lunch' in meal_type or 'Afternoon' in meal_type:
-                meal_recipes = [r for r in suitable_recipes if 'meal_type' in r and r['meal_type'] == 'lunch']
-            else:
-                meal_recipes = [r for r in suitable_recipes if 'meal_type' in r and r['meal_type'] == 'dinner']
-            unused_recipes = [r for r in meal_recipes if r['name'] not in used_recipes]
-            if not unused_recipes and meal_recipes:
-                unused_recipes = meal_recipes
-            if unused_recipes:
-                import random
-                selected_recipe = random.choice(unused_recipes)
-                used_recipes.add(selected_recipe['name'])
-                meal_plan[f'Day {day}'][meal_type] = {
-                    'name': selected_recipe['name'],
-                    'calories': float(selected_recipe['calories']),
-                    'protein': float(selected_recipe['protein']),
-                    'carbs': float(selected_recipe['carbs']),
-                    'fat': float(selected_recipe['fat']),
-                    'sodium': float(selected_recipe['sodium']),
-                    'fiber': float(selected_recipe['fiber']),
-                    'ingredients': selected_recipe['ingredients'],
-                    'instructions': selected_recipe['instructions'] if 'instructions' in selected_recipe else ""
-                }
-            else:
+        for (meal_type, _, _), selection in zip(layout, chosen):
+            if selection is None:
                 meal_plan[f'Day {day}'][meal_type] = "No suitable recipe found"
-    nutritional_analysis = analyze_meal_plan(meal_plan)
-    return meal_plan, user_cluster, nutritional_analysis
+                continue
+            meal_plan[f'Day {day}'][meal_type] = meal_entry(pool, *selection)
+    return meal_plan
 
-def analyze_meal_plan(meal_plan):
-    daily_nutrition = []
-    for day, meals in meal_plan.items():
-        day_nutrition = {
-            'calories': 0, 'protein': 0, 'carbs': 0, 
-            'fat': 0, 'sodium': 0, 'fiber': 0
-        }
-        for meal_type, meal in meals.items():
-            if isinstance(meal, dict):
-                day_nutrition['calories'] += meal.get('calories', 0)
-                day_nutrition['protein'] += meal.get('protein', 0)
-                day_nutrition['carbs'] += meal.get('carbs', 0)
-                day_nutrition['fat'] += meal.get('fat', 0)
-                day_nutrition['sodium'] += meal.get('sodium', 0)
-                day_nutrition['fiber'] += meal.get('fiber', 0)
-        daily_nutrition.append(day_nutrition)
-    avg_nutrition = {
-        'calories': float(np.mean([day['calories'] for day in daily_nutrition])),
-        'protein': float(np.mean([day['protein'] for day in daily_nutrition])),
-        'carbs': float(np.mean([day['carbs'] for day in daily_nutrition])),
-        'fat': float(np.mean([day['fat'] for day in daily_nutrition])),
-        'sodium': float(np.mean([day['sodium'] for day in daily_nutrition])),
-        'fiber': float(np.mean([day['fiber'] for day in daily_nutrition]))
-    }
-    total_calories = avg_nutrition['protein'] * 4 + avg_nutrition['carbs'] * 4 + avg_nutrition['fat'] * 9
-    if total_calories > 0:
-        macro_percentages = {
-            'protein_pct': float((avg_nutrition['protein'] * 4 / total_calories * 100)),
-            'carbs_pct': float((avg_nutrition['carbs'] * 4 / total_calories * 100)),
-            'fat_pct': float((avg_nutrition['fat'] * 9 / total_calories * 100))
-        }
-    else:
-        macro_percentages = {'protein_pct': 0, 'carbs_pct': 0, 'fat_pct': 0}
-    all_recipes = []
-    for day, meals in meal_plan.items():
-        for meal_type, meal in meals.items():
-            if isinstance(meal, dict) and 'name' in meal:
-                all_recipes.append(meal['name'])
-    variety_metrics = {
-        'unique_recipes': len(set(all_recipes)),
-        'total_meals': len(all_recipes),
-        'variety_score': float(len(set(all_recipes)) / len(all_recipes) * 100 if all_recipes else 0)
-    }
-    total_meals = sum(1 for day in meal_plan.values() for meal in day.values())
-    suitable_meals = sum(1 for day in meal_plan.values() for meal in day.values() if isinstance(meal, dict))
-    meal_coverage = float((suitable_meals / total_meals * 100) if total_meals > 0 else 0)
+def meal_entry(pool, i, servings):
+    # One plan slot: pool recipe i scaled to `servings`. Fields come from the
+    # catalog's column arrays; a DataFrame row per slot dominated long plans.
+    columns = pool.catalog.columns
+    position = pool.positions[i]
+    nutrients = pool.nutrients[i] * servings
     return {
-        'avg_nutrition': avg_nutrition,
-        'macro_percentages': macro_percentages,
-        'variety_metrics': variety_metrics,
-        'meal_coverage': meal_coverage
+        'name': columns['name'][position],
+        'servings': servings,
+        'calories': float(nutrients[0]),
+        'protein': float(nutrients[1]),
+        'carbs': float(nutrients[2]),
+        'fat': float(nutrients[3]),
+        'sodium': float(nutrients[4]),
+        'fiber': float(nutrients[5]),
+        'ingredients': columns['ingredients'][position],
+        'instructions': columns['instructions'][position] if 'instructions' in columns else ""
     }
 
+def generate_diet_plan(user_params, kmeans_model, pca, rf_model, cluster_analysis, days=7, models=None, seed=None,
+                       repeat_window=None):
+    models = models or load_models()
+    with stage('catalog_fetch'):
+        catalog = fetch_recipes_from_mongodb()
+    if catalog is None or len(catalog) == 0:
+        raise Exception("Failed to fetch recipes from database")
+    user_cluster, pool = user_candidate_pool(user_params, models, catalog, kmeans_model, pca, rf_model)
+    with stage('meal_selection'):
+        meal_plan = build_meal_plan(user_params, pool, days, seed=seed, repeat_window=repeat_window)
+    with stage('analysis'):
+        nutritional_analysis = analyze_meal_plan(meal_plan, daily_calorie_target(user_params))
+    return meal_plan, user_cluster, nutritional_analysis
+
+def user_candidate_pool(user_params, models, catalog, kmeans_model, pca, rf_model):
+    # (cluster, CandidatePool) for one user, both served from plan_cache when possible.
+    # Unchanged health parameters skip preprocessing, PCA and KMeans; new ones
+    # go through the compiled NumPy path when the bundle supports it
+    assigner = compiled_assigner(models)
+    if assigner is not None:
+        compute = lambda: assigner.assign(user_params)
+    else:
+        compute = lambda: assign_clusters(prepare_user_frame([user_params], models['categorical_cols']),
+                                          models['preprocessing_pipeline'], pca, kmeans_model)[0]
+
+    def assign():
+        count('cluster_cache_misses')
+        return compute()
+
+    with stage('cluster_assignment'):
+        user_cluster = plan_cache.cluster(user_key(user_params, models['categorical_cols']), models.version, assign)
+    with stage('suitability_index'):
+        index = get_suitability_index(rf_model, kmeans_model.n_clusters, catalog)
+    with stage('candidate_filter'):
+        pool = plan_cache.pool(user_cluster, dietary_rules.index_for(catalog).profile_rules(user_params), models.version,
+                               catalog.version, lambda: candidate_recipes(user_params, user_cluster, catalog, index))
+    return user_cluster, pool
+
+def generate_diet_plans_batch(user_records, days=7, models=None, seed=None, repeat_window=None):
+    # Preprocessing, PCA and KMeans run once over the whole cohort; candidate
+    # pools are shared by users with the same cluster and restrictions.
+    # Yields one result dict per user, in input order; with a seed, user i
+    # gets seed + i.
+    models = models or load_models()
+    with stage('catalog_fetch'):
+        catalog = fetch_recipes_from_mongodb()
+    if catalog is None or len(catalog) == 0:
+        raise Exception("Failed to fetch recipes from database")
+    user_records = list(user_records)
+    with stage('cluster_assignment'):
+        keys = [user_key(u, models['categorical_cols']) for u in user_records]
+        clusters = [plan_cache.cached_cluster(key, models.version) for key in keys]
+        misses = [i for i, cluster in enumerate(clusters) if cluster is None]
+        count('users', len(user_records))
+        count('cluster_cache_misses', len(misses))
+        if misses:
+            user_df = prepare_user_frame([user_records[i] for i in misses], models['categorical_cols'])
+            try:
+                assigned = assign_clusters(user_df, models['preprocessing_pipeline'], models['pca'], models['kmeans_model'])
+            except Exception:
+                # Fall back to row by row so one malformed record only fails itself
+                assigned = []
+                for j in range(len(user_df)):
+                    try:
+                        assigned.append(assign_clusters(user_df.iloc[[j]], models['preprocessing_pipeline'], models['pca'], models['kmeans_model'])[0])
+                    except Exception as e:
+                        assigned.append(e)
+            for i, cluster in zip(misses, assigned):
+                clusters[i] = cluster if isinstance(cluster, Exception) else plan_cache.store_cluster(keys[i], models.version, cluster)
+    with stage('suitability_index'):
+        index = get_suitability_index(models['rf_model'], models['kmeans_model'].n_clusters, catalog)
+    rules = dietary_rules.index_for(catalog)
+    for i, (user_params, user_cluster) in enumerate(zip(user_records, clusters)):
+        result = {'index': i}
+        if 'user_id' in user_params:
+            result['user_id'] = user_params['user_id']
+        try:
+            if isinstance(user_cluster, Exception):
+                raise user_cluster
+            pool = plan_cache.pool(user_cluster, rules.profile_rules(user_params), models.version, catalog.version,
+                                   lambda: candidate_recipes(user_params, user_cluster, catalog, index))
+            meal_plan = build_meal_plan(user_params, pool, days, seed=None if seed is None else seed + i,
+                                        repeat_window=repeat_window)
+            result.update({
+                'success': True,
+                'diet_plan': meal_plan,
+                'user_cluster': int(user_cluster),
+                'nutritional_analysis': analyze_meal_plan(meal_plan, daily_calorie_target(user_params)),
+                'model_version': models.version
+            })
+        except Exception as e:
+            result.update({'success': False, 'error': str(e)})
+        yield result
+
+def analyze_meal_plan(meal_plan, calorie_target=None):
+    stats = plan_statistics(PlanArrays.from_plans([meal_plan]), calorie_target)
+    return plan_analysis(stats, 0)
+
+# --- Plan analytics across many plans (dietitian dashboard) ---
+plan_arrays_cache = PlanArraysCache()
+
+@app.route('/api/analytics/plans', methods=['POST'])
+def plan_analytics_api():
+    # Body: {"plans": [meal_plan, ...]} for ad-hoc plans, or
+    # {"user_ids": [...], "status": "review"|"approved"} to read saved diet plans.
+    # "group_by": "user" adds a per-user summary; "include_plans" adds per-plan figures.
+    try:
+        body = request.get_json(silent=True) or {}
+        if 'plans' in body:
+            plans = body['plans']
+            if not isinstance(plans, list):
+                return jsonify({'success': False, 'error': "'plans' must be a list"}), 400
+            owners = [None] * len(plans)
+        else:
+            query = {}
+            if body.get('user_ids'):
+                query['userId'] = {'$in': [ObjectId(u) if ObjectId.is_valid(u) else u for u in body['user_ids']]}
+            if body.get('status'):
+                query['status'] = body['status']
+            plans = list(db.dietplans.find(query, {'days': 1, 'userId': 1, 'updatedAt': 1}))
+            owners = [str(doc.get('userId')) for doc in plans]
+        arrays = PlanArrays.from_plans(plans) if 'plans' in body else plan_arrays_cache.encode(plans)
+        stats = plan_statistics(arrays)
+        response = {'success': True, 'summary': summarize(stats)}
+        if body.get('group_by') == 'user' and 'plans' not in body:
+            response['groups'] = summarize(stats, owners)
+        if body.get('include_plans'):
+            response['plans'] = [dict(plan_analysis(stats, i), user_id=owners[i]) if owners[i] else plan_analysis(stats, i)
+                                 for i in range(len(plans))]
+        return jsonify(response)
+    except Exception as e:
+        logger.exception('Error computing plan analytics')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# --- Food nutrient table (health log autocomplete and nutrient lookups) ---
+food_table = None
+
+def init_food_table():
+    global food_table
+    try:
+        food_table = load_food_table()
+        logger.info('Loaded %d foods into the nutrient table', len(food_table))
+    except Exception as e:
+        logger.error('Failed to load food nutrient table: %s', e)
+
+@app.route('/api/foods/search', methods=['GET'])
+def search_foods():
+    if food_table is None:
+        return jsonify({'success': False, 'error': 'Food table not loaded'}), 500
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify({'success': True, 'results': food_table.search(query, limit)})
+
+def food_item(item):
+    # (food_code, servings, grams) from {"food_code", "servings"?, "grams"?},
+    # [code, servings?, grams?] or a bare code; servings default to 1
+    if isinstance(item, dict):
+        code, servings, grams = item['food_code'], item.get('servings', 1), item.get('grams')
+    elif isinstance(item, (list, tuple)) and 1 <= len(item) <= 3:
+        code, servings, grams = (list(item) + [1, None])[:3]
+    elif isinstance(item, str):
+        code, servings, grams = item, 1, None
+    else:
+        raise ValueError(f'malformed item {item!r}')
+    if not isinstance(code, (str, int)) or isinstance(code, bool):
+        raise ValueError(f'malformed food_code {code!r}')
+    servings = float(servings)
+    grams = None if grams is None else float(grams)
+    if not np.isfinite(servings) or servings < 0 or (grams is not None and (not np.isfinite(grams) or grams < 0)):
+        raise ValueError(f'servings and grams must be non-negative numbers in {item!r}')
+    return code, servings, grams
+
+@app.route('/api/foods/nutrients', methods=['GET', 'POST'])
+def food_nutrients():
+    # GET ?codes=A,B looks foods up. POST {"codes": [...]} does the same, and
+    # {"items": [{"food_code": ..., "servings": n, "grams": g?}, ...]} adds the
+    # nutrient totals across the list.
+    if food_table is None:
+        return jsonify({'success': False, 'error': 'Food table not loaded'}), 500
+    try:
+        if request.method == 'GET':
+            body = {'codes': [c for c in request.args.get('codes', '').split(',') if c]}
+        else:
+            body = request.get_json(silent=True) or {}
+        response = {'success': True}
+        if body.get('codes'):
+            response['foods'], response['missing'] = food_table.lookup(body['codes'])
+        if body.get('items'):
+            if not isinstance(body['items'], list):
+                raise ValueError('items must be a list')
+            items = [food_item(item) for item in body['items']]
+            totals, missing, no_serving = food_table.nutrient_totals(items)
+            response['totals'] = totals
+            response['missing'] = response.get('missing', []) + missing
+            response['no_serving_data'] = no_serving
+        return jsonify(response)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'Invalid request: {e}'}), 400
+
 # --- Simple test route ---
 @app.route('/test', methods=['GET'])
 def test_route():
-    print("Test route accessed!")
     return jsonify({"message": "Test route works!"})
 
+# --- Prometheus metrics ---
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    stats = plan_cache.stats()
+    gauges = [
+        ('ml_model_info', 'Model version served by this worker', {'version': live_models.loaded_version or ''}, 1),
+        ('ml_catalog_recipes', 'Recipes in the in-memory catalog', {}, recipe_catalog.size),
+    ]
+    for cache in ('clusters', 'pools'):
+        for field in ('entries', 'hits', 'misses'):
+            gauges.append((f'ml_plan_cache_{field}', 'Plan cache counters of this worker', {'cache': cache}, stats[cache][field]))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# --- Liveness and readiness ---
+@app.route('/healthz', methods=['GET'])
+def liveness():
+    # The process is up and serving requests
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/readyz', methods=['GET'])
+def readiness():
+    # Ready once models and the recipe catalog are loaded; Mongo and the food
+    # table are reported but only the first two gate traffic
+    checks = {
+        'models_loaded': live_models.loaded_version is not None,
+        'model_version': live_models.loaded_version,
+        'catalog_loaded': recipe_catalog.loaded,
+        'catalog_version': recipe_catalog.version,
+        'food_table_loaded': food_table is not None,
+        # Known server state only; a blocking ping would stall the probe while Mongo is down
+        'mongo': client is not None and client.topology_description.has_readable_server()
+    }
+    ready = checks['models_loaded'] and checks['catalog_loaded']
+    return jsonify({'status': 'ready' if ready else 'not_ready', 'pid': os.getpid(), **checks}), 200 if ready else 503
+
 # --- API endpoint for diet plan generation ---
+# ?days=N (up to MAX_PLAN_DAYS) sets the plan length and ?repeat_window=D keeps
+# a recipe out of the plan for D days after it is used. A "meal_slots" list in
+# the user parameters replaces the Meal Size Preference layouts.
+MAX_PLAN_DAYS = 366
+
+def check_plan_options(days, repeat_window):
+    if not 1 <= days <= MAX_PLAN_DAYS:
+        raise ValueError(f'days must be between 1 and {MAX_PLAN_DAYS}')
+    if repeat_window is not None and repeat_window < 1:
+        raise ValueError('repeat_window must be at least 1 day')
+
 @app.route('/api/generate_diet_plan', methods=['POST'])
 def generate_diet_plan_api():
-    print("Diet plan route accessed!")
     try:
         user_params = request.json
-        print(f"Received parameters: {user_params}")
+        days = request.args.get('days', 7, type=int)
+        repeat_window = request.args.get('repeat_window', type=int)
+        try:
+            check_plan_options(days, repeat_window)
+            slot_layout(user_params)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        # One bundle for the whole request, even if a new version is published meanwhile
+        models = load_models()
         if not models:
             return jsonify({'success': False, 'error': "ML models not loaded"}), 500
         diet_plan, user_cluster, nutritional_analysis = generate_diet_plan(
@@ -532,21 +915,210 @@ def generate_diet_plan_api():
             models['kmeans_model'], 
             models['pca'],
             models['rf_model'],
-            models['cluster_analysis']
+            models['cluster_analysis'],
+            days=days,
+            models=models,
+            seed=request.args.get('seed', type=int),
+            repeat_window=repeat_window
         )
         return jsonify({
             'success': True,
             'diet_plan': diet_plan,
             'user_cluster': int(user_cluster),
-            'nutritional_analysis': nutritional_analysis
+            'nutritional_analysis': nutritional_analysis,
+            'model_version': models.version
+        })
+    except Exception as e:
+        logger.exception('Error generating diet plan')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/generate_diet_plans/batch', methods=['POST'])
+def generate_diet_plans_batch_api():
+    # Accepts a JSON array of user parameter objects, {"users": [...], "days": n},
+    # or a CSV upload ("file") with the test_user_parameters.csv columns.
+    # Streams one JSON object per line, in input order.
+    try:
+        days = request.args.get('days', 7, type=int)
+        seed = request.args.get('seed', type=int)
+        repeat_window = request.args.get('repeat_window', type=int)
+        if 'file' in request.files:
+            file = request.files['file']
+            if file.filename == '' or not allowed_file(file.filename):
+                return jsonify({'success': False, 'error': 'Invalid file type'}), 400
+            users_df = pd.read_csv(file.stream)
+            user_records = users_df.astype(object).where(users_df.notna(), None).to_dict('records')
+        else:
+            body = request.get_json(silent=True)
+            if isinstance(body, dict):
+                days = int(body.get('days', days))
+                if body.get('seed') is not None:
+                    seed = int(body['seed'])
+                if body.get('repeat_window') is not None:
+                    repeat_window = int(body['repeat_window'])
+                body = body.get('users')
+            if not isinstance(body, list):
+                return jsonify({'success': False, 'error': 'Expected a JSON array of users or a CSV file'}), 400
+            user_records = body
+        if not all(isinstance(u, dict) for u in user_records):
+            return jsonify({'success': False, 'error': 'Every user must be a JSON object'}), 400
+        try:
+            check_plan_options(days, repeat_window)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        models = load_models()
+        if not models:
+            return jsonify({'success': False, 'error': "ML models not loaded"}), 500
+        logger.info('Batch diet plan request', extra={'users': len(user_records), 'days': days})
+        results = generate_diet_plans_batch(user_records, days=days, models=models, seed=seed,
+                                            repeat_window=repeat_window)
+        # Pull the first result eagerly so setup errors still get a 500
+        first = next(results, None)
+    except Exception as e:
+        logger.exception('Error generating diet plans')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    def stream():
+        if first is not None:
+            yield json.dumps(first, default=str) + '\n'
+        for result in results:
+            yield json.dumps(result, default=str) + '\n'
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+# --- Meal swaps ---
+# Alternatives for one slot of a plan come from the user's candidate pool
+# (cluster suitability and dietary rules, as in plan generation) for the
+# slot's meal type, ranked by macro profile and ingredient overlap with the
+# meal being replaced. No model runs; it is a lookup in the cached pool and
+# the similarity index of the current catalog.
+recipe_similarity = RecipeSimilarity()
+
+def build_similarity_index():
+    try:
+        catalog = fetch_recipes_from_mongodb()
+        if catalog is not None and len(catalog):
+            recipe_similarity.index_for(catalog)
+    except Exception as e:
+        logger.error('Error building similarity index: %s', e)
+
+def swap_alternatives(user_params, slot, meal, k=5, exclude=(), models=None):
+    # Returns (alternatives as plan slot dicts, user cluster); each is portioned
+    # to the calories of `meal` and carries its similarity scores
+    models = models or load_models()
+    with stage('catalog_fetch'):
+        catalog = fetch_recipes_from_mongodb()
+    if catalog is None or len(catalog) == 0:
+        raise Exception("Failed to fetch recipes from database")
+    with stage('similarity_index'):
+        similarity = recipe_similarity.index_for(catalog)
+    position = similarity.find(meal.get('recipe_id'), meal.get('name'))
+    if position is None:
+        raise LookupError(f"Recipe not found: {meal.get('name') or meal.get('recipe_id')}")
+    user_cluster, pool = user_candidate_pool(user_params, models, catalog, models['kmeans_model'], models['pca'], models['rf_model'])
+    meal_types = {name: meal_type for name, meal_type, _ in slot_layout(user_params)}
+    bucket = pool.bucket(meal_types.get(slot, catalog.meal_types[position]))
+    excluded = {similarity.find(name=name) for name in exclude} - {None}
+    if excluded:
+        bucket = bucket[~np.isin(pool.positions[bucket], list(excluded))]
+    count('candidates_scanned', len(bucket))
+    with stage('similarity_search'):
+        order, scores, macro, ingredients = similarity.similar(position, pool.positions[bucket], k)
+    picks = bucket[order]
+    calories = meal.get('calories')
+    if not isinstance(calories, (int, float)) or calories <= 0:
+        calories = float(recipe_calories(catalog, position)) * float(meal.get('servings') or 1)
+    servings = meal_optimizer.servings(calories, pool.nutrients[picks, 0]) if calories > 0 else np.ones(len(picks))
+    alternatives = []
+    for i, portion, score, macro_score, ingredient_score in zip(picks, servings, scores, macro, ingredients):
+        entry = meal_entry(pool, int(i), float(portion))
+        entry['similarity'] = {'score': round(float(score), 4), 'macro': round(float(macro_score), 4),
+                               'ingredients': round(float(ingredient_score), 4)}
+        alternatives.append(entry)
+    return alternatives, user_cluster
+
+def recipe_calories(catalog, position):
+    # Per-serving calories of a catalog recipe, 0 if unknown
+    if 'calories' not in catalog.columns:
+        return 0.0
+    value = pd.to_numeric(catalog.columns['calories'][position], errors='coerce')
+    return 0.0 if pd.isna(value) else float(value)
+
+@app.route('/api/swap_meal', methods=['POST'])
+def swap_meal_api():
+    # Body: {"user": {...}, "slot": "Lunch", "k": 5} plus either
+    #   "diet_plan": {...}, "day": "Day 3"   (the plan's other recipes are not suggested), or
+    #   "meal": {"name": ... | "recipe_id": ..., "calories": ...}, "exclude": [names]
+    try:
+        body = request.get_json(silent=True) or {}
+        user_params, slot = body.get('user'), body.get('slot')
+        if not isinstance(user_params, dict) or not isinstance(slot, str):
+            return jsonify({'success': False, 'error': 'Expected "user" and "slot"'}), 400
+        k = body.get('k', 5)
+        if isinstance(k, bool) or not isinstance(k, int):
+            return jsonify({'success': False, 'error': '"k" must be an integer'}), 400
+        meal = body.get('meal')
+        exclude = [name for name in body.get('exclude') or [] if isinstance(name, str)]
+        plan = body.get('diet_plan')
+        if isinstance(plan, dict):
+            day = plan.get(body.get('day'))
+            meal = day.get(slot) if isinstance(day, dict) else None
+            exclude += [m['name'] for d in plan.values() if isinstance(d, dict)
+                        for m in d.values() if isinstance(m, dict) and isinstance(m.get('name'), str)]
+        if not isinstance(meal, dict):
+            return jsonify({'success': False, 'error': 'No meal found for the requested day and slot'}), 400
+        k = max(1, min(k, 50))
+        models = load_models()
+        if not models:
+            return jsonify({'success': False, 'error': "ML models not loaded"}), 500
+        alternatives, user_cluster = swap_alternatives(user_params, slot, meal, k=k, exclude=exclude, models=models)
+        return jsonify({
+            'success': True,
+            'slot': slot,
+            'replacing': meal.get('name'),
+            'alternatives': alternatives,
+            'user_cluster': int(user_cluster),
+            'model_version': models.version
         })
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
     except Exception as e:
-        print(f"Error generating diet plan: {str(e)}")
-        traceback.print_exc()
+        logger.exception('Error finding meal alternatives')
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# --- App factory ---
+_initialized = False
+_init_lock = threading.Lock()
+
+def create_app():
+    # Loads everything once per process tree. Under gunicorn this runs in the
+    # master (preload_app), so model arrays, the catalog, the suitability
+    # index and the food table are in memory before the fork and shared
+    # copy-on-write by the workers.
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return app
+        configure_logging()
+        connect_mongo()
+        if mongo_ping():
+            logger.info('Successfully connected to MongoDB')
+        load_models()
+        init_food_table()
+        build_suitability_index()
+        build_similarity_index()
+        # Fault the mapped model arrays in before workers are forked
+        for thread in threading.enumerate():
+            if thread.name == PREFETCH_THREAD:
+                thread.join()
+        _initialized = True
+    return app
+
+def after_fork():
+    # gunicorn post_fork hook: new Mongo connections for this worker
+    connect_mongo()
+
 # --- Main entry point ---
 if __name__ == '__main__':
-    print("Starting Flask server...")
-    print(f"Registered routes: {[str(rule) for rule in app.url_map.iter_rules()]}")
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    create_app()
+    logger.info('Starting Flask development server')
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=5001)
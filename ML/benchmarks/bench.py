@@ -0,0 +1,366 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# --- Load tests and micro-benchmarks for the ML service ---
+# Run from ML/:
+#   python -m benchmarks.bench                       # 10k recipes, 5 clusters, 7- and 90-day plans
+#   python -m benchmarks.bench --recipes 1000,10000 --clusters 5,8 --days 7,28
+#   python -m benchmarks.bench --quick --output bench.json
+#   python -m benchmarks.bench --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.bench --baseline benchmarks/baseline.json   # exit 1 on regressions
+# Recipes come from data/recipes_modified.csv, scaled up with jittered
+# nutrients and served from an in-memory collection; users are sampled from
+# data/test_user_parameters.csv. Models are trained into a temporary registry
+# per (recipes, clusters) combination. Everything is seeded, so two runs on
+# the same machine measure the same work.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings('ignore')
+
+import app as service  # noqa: E402
+from benchmarks.memory_store import memory_database  # noqa: E402
+from meal_optimizer import daily_calorie_target  # noqa: E402
+from model_registry import LiveModels, ModelRegistry  # noqa: E402
+from plan_analytics import PlanArrays, plan_statistics  # noqa: E402
+from plan_cache import PlanCache  # noqa: E402
+from recipe_catalog import RecipeCatalog  # noqa: E402
+from recipe_similarity import RecipeSimilarity  # noqa: E402
+from retrain_jobs import StageTimer  # noqa: E402
+from training_cache import PreprocessingCache  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+NUTRIENT_COLS = ['calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber']
+# metric -> direction; 'lower' means a larger value is a regression
+COMPARED_METRICS = {'p50_ms': 'lower', 'p99_ms': 'lower', 'seconds': 'lower',
+                    'throughput_per_s': 'higher', 'peak_rss_mb': 'lower'}
+
+
+# --- Data ---
+def synthetic_recipes(n, seed):
+    base = pd.read_csv(os.path.join(DATA_DIR, 'recipes_modified.csv'))
+    rng = np.random.default_rng(seed)
+    recipes = base.iloc[np.arange(n) % len(base)].reset_index(drop=True)
+    jitter = rng.uniform(0.85, 1.15, size=(n, len(NUTRIENT_COLS)))
+    recipes[NUTRIENT_COLS] = np.round(recipes[NUTRIENT_COLS].to_numpy(dtype=float) * jitter, 1)
+    copies = np.arange(n) // len(base)
+    recipes['name'] = [name if c == 0 else f'{name} #{c}' for name, c in zip(recipes['name'], copies)]
+    recipes['recipe_id'] = np.arange(1, n + 1)
+    recipes['_id'] = [f'r{i}' for i in range(n)]
+    return recipes
+
+
+def sample_users(n, seed):
+    users = pd.read_csv(os.path.join(DATA_DIR, 'test_user_parameters.csv'))
+    users = users.sample(n=n, replace=n > len(users), random_state=seed).reset_index(drop=True)
+    return users
+
+
+def user_records(users_df):
+    return users_df.astype(object).where(users_df.notna(), None).to_dict('records')
+
+
+# --- Measurement ---
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def latency_stats(latencies, elapsed):
+    ms = np.asarray(latencies) * 1000
+    return {
+        'count': len(ms),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+        'throughput_per_s': round(len(ms) / elapsed, 2) if elapsed > 0 else None,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def measure(fn, iterations, warmup=2):
+    # fn(i) is called warmup + iterations times, one after another
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+    return latency_stats(latencies, time.perf_counter() - start)
+
+
+def measure_concurrent(fn, requests, concurrency):
+    # `requests` calls of fn(i) spread over `concurrency` threads
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            t = time.perf_counter()
+            fn(i)
+            elapsed = time.perf_counter() - t
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = latency_stats(latencies, time.perf_counter() - start)
+    stats['concurrency'] = concurrency
+    return stats
+
+
+# --- Service setup ---
+def install_store(recipes_df, workdir, seed):
+    # Points the service module at in-memory Mongo collections and a
+    # temporary model registry, the way create_app() wires the real ones
+    db = memory_database()
+    for doc in user_records(recipes_df):
+        db.recipes.insert_one(doc)
+    service.db = db
+    service.recipe_catalog = RecipeCatalog(db.recipes, refresh_interval=3600)
+    service.model_registry = ModelRegistry(os.path.join(workdir, 'models'))
+    service.live_models = LiveModels(service.model_registry)
+    service.preprocessing_cache = PreprocessingCache(os.path.join(workdir, 'cache'))
+    service.plan_cache = PlanCache()
+    service.suitability_index = None
+    service.recipe_similarity = RecipeSimilarity()
+    if service.food_table is None:
+        service.init_food_table()
+
+
+def expect_success(response):
+    if response.status_code != 200:
+        raise RuntimeError(f'{response.status_code}: {response.get_data(as_text=True)[:200]}')
+    return response
+
+
+# --- Scenarios ---
+def stage_breakdown(users, models, days, args):
+    # Uncached cost of each step generate_diet_plan takes, in mean ms
+    catalog = service.fetch_recipes_from_mongodb()
+    index = service.get_suitability_index(models['rf_model'], models['kmeans_model'].n_clusters, catalog)
+    assigner = service.compiled_assigner(models)
+    stages = {'cluster_assignment': [], 'candidate_pool': [], 'meal_plan': [], 'nutritional_analysis': []}
+    for i in range(args.iterations):
+        user = users[i % len(users)]
+        t0 = time.perf_counter()
+        if assigner is not None:
+            cluster = assigner.assign(user)
+        else:
+            cluster = service.assign_clusters(service.prepare_user_frame([user], models['categorical_cols']),
+                                              models['preprocessing_pipeline'], models['pca'], models['kmeans_model'])[0]
+        t1 = time.perf_counter()
+        pool = service.candidate_recipes(user, cluster, catalog, index)
+        t2 = time.perf_counter()
+        meal_plan = service.build_meal_plan(user, pool, days, seed=args.seed + i)
+        t3 = time.perf_counter()
+        service.analyze_meal_plan(meal_plan, daily_calorie_target(user))
+        t4 = time.perf_counter()
+        for stage, seconds in zip(stages, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+            stages[stage].append(seconds)
+    return {'stages_mean_ms': {stage: round(float(np.mean(s)) * 1000, 3) for stage, s in stages.items()},
+            'compiled_assignment': assigner is not None,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def run_config(n_recipes, n_clusters, days_list, args, workdir):
+    tag = f'recipes={n_recipes},clusters={n_clusters}'
+    results = {}
+    recipes_df = synthetic_recipes(n_recipes, args.seed)
+    install_store(recipes_df, workdir, args.seed)
+    train_users = sample_users(args.train_users, args.seed)
+    users = user_records(sample_users(args.users, args.seed + 1))
+
+    # Full retrain with its stage breakdown
+    timer = StageTimer()
+    start = time.perf_counter()
+    metrics, _ = service.retrain_pipeline(train_users.copy(), recipes_df.drop(columns=['_id']), progress=timer, n_clusters=n_clusters)
+    results[f'retrain_pipeline[{tag},users={args.train_users}]'] = {
+        'seconds': round(time.perf_counter() - start, 3),
+        'stages': timer.timings(),
+        'f1_score': round(float(metrics['f1_score']), 4),
+        'peak_rss_mb': peak_rss_mb()
+    }
+    models = service.live_models.reload()
+    start = time.perf_counter()
+    service.build_suitability_index()
+    results[f'suitability_index_build[{tag}]'] = {'seconds': round(time.perf_counter() - start, 3), 'peak_rss_mb': peak_rss_mb()}
+
+    def plan(i, days):
+        return service.generate_diet_plan(users[i % len(users)], models['kmeans_model'], models['pca'], models['rf_model'],
+                                          models['cluster_analysis'], days=days, models=models, seed=args.seed + i)
+
+    for days in days_list:
+        dtag = f'{tag},days={days}'
+
+        def cold(i, days=days):
+            service.plan_cache.clear()
+            plan(i, days)
+        results[f'generate_diet_plan_cold[{dtag}]'] = measure(cold, args.iterations)
+        results[f'generate_diet_plan_warm[{dtag}]'] = measure(lambda i, days=days: plan(i % 5, days), args.iterations)
+        results[f'generate_diet_plan_stages[{dtag}]'] = stage_breakdown(users, models, days, args)
+
+        plans = [plan(i, days)[0] for i in range(min(args.iterations, 50))]
+        targets = [daily_calorie_target(users[i % len(users)]) for i in range(len(plans))]
+        results[f'analyze_meal_plan[{dtag}]'] = measure(
+            lambda i: service.analyze_meal_plan(plans[i % len(plans)], targets[i % len(plans)]), args.iterations)
+        many = [plans[i % len(plans)] for i in range(args.analytics_plans)]
+        results[f'plan_statistics[{dtag},plans={args.analytics_plans}]'] = measure(
+            lambda i: plan_statistics(PlanArrays.from_plans(many)), max(3, args.iterations // 10), warmup=1)
+
+        batch = users[:args.batch_users]
+        stats = measure(lambda i: list(service.generate_diet_plans_batch(batch, days=days, models=models, seed=args.seed)),
+                        3, warmup=1)
+        stats['users_per_s'] = round(len(batch) * 1000 / stats['mean_ms'], 1)
+        results[f'generate_diet_plans_batch[{dtag},users={len(batch)}]'] = stats
+
+    # Endpoints through the WSGI app, sequential and concurrent
+    client = service.app.test_client()
+    days = days_list[0]
+    body = [dict(u) for u in users]
+
+    def post_plan(i):
+        service.plan_cache.clear() if i % 2 == 0 else None
+        expect_success(client.post(f'/api/generate_diet_plan?seed={i}', json=body[i % len(body)]))
+    results[f'http_generate_diet_plan[{tag}]'] = measure(post_plan, args.iterations)
+    results[f'http_generate_diet_plan_concurrent[{tag}]'] = measure_concurrent(post_plan, args.iterations * 2, args.concurrency)
+    results[f'http_batch[{tag},users={args.batch_users}]'] = measure(
+        lambda i: expect_success(client.post(f'/api/generate_diet_plans/batch?days={days}&seed={i}', json=body[:args.batch_users])).get_data(),
+        3, warmup=1)
+    plans = [plan(i, days)[0] for i in range(20)]
+    results[f'http_plan_analytics[{tag}]'] = measure(
+        lambda i: expect_success(client.post('/api/analytics/plans', json={'plans': plans, 'include_plans': True})),
+        args.iterations)
+    day = plans[0]['Day 1']
+    slot, meal = next((slot, meal) for slot, meal in day.items() if isinstance(meal, dict))
+    results[f'swap_alternatives[{tag}]'] = measure(
+        lambda i: service.swap_alternatives(users[i % len(users)], slot, meal, k=5, models=models), args.iterations * 5)
+    queries = ['pan', 'panner', 'chicken cur', 'dal', 'rice', 'egg']
+    results['http_food_search'] = measure(
+        lambda i: expect_success(client.get(f'/api/foods/search?q={queries[i % len(queries)]}&limit=10')), args.iterations * 5)
+    return results
+
+
+# --- Baseline comparison ---
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scenario, current in results.items():
+        previous = baseline.get('results', {}).get(scenario)
+        if not previous:
+            continue
+        for metric, direction in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if direction == 'lower' else change < -tolerance
+            if worse:
+                regressions.append({'scenario': scenario, 'metric': metric, 'baseline': old,
+                                    'current': new, 'change': round(change, 3)})
+    return regressions
+
+
+def environment():
+    import sklearn
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'git_commit': commit
+    }
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ML service')
+    parser.add_argument('--recipes', type=parse_ints, default=[10000], help='comma-separated recipe counts')
+    parser.add_argument('--clusters', type=parse_ints, default=[5], help='comma-separated cluster counts')
+    parser.add_argument('--days', type=parse_ints, default=[7, 90], help='comma-separated plan lengths')
+    parser.add_argument('--train-users', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=500, help='distinct user profiles for plan requests')
+    parser.add_argument('--batch-users', type=int, default=200)
+    parser.add_argument('--analytics-plans', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--quick', action='store_true', help='small sizes for a smoke run')
+    parser.add_argument('--output', help='write the JSON report here (default: stdout)')
+    parser.add_argument('--baseline', help='compare against this report and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--save-baseline', help='also write the report here as the new baseline')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.recipes, args.clusters, args.days = [1000], [5], [7]
+        args.train_users, args.users, args.batch_users = 1000, 100, 50
+        args.analytics_plans, args.iterations = 200, 10
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_recipes in args.recipes:
+            for n_clusters in args.clusters:
+                results.update(run_config(n_recipes, n_clusters, args.days, args,
+                                          os.path.join(workdir, f'{n_recipes}-{n_clusters}')))
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'save_baseline')},
+        'environment': environment(),
+        'results': results,
+        'peak_rss_mb': peak_rss_mb()
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text + '\n')
+    if report.get('regressions'):
+        for r in report['regressions']:
+            print(f"REGRESSION {r['scenario']} {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.0%})",
+                  file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
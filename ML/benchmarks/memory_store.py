@@ -0,0 +1,90 @@
+import copy
+import itertools
+
+# --- In-memory stand-in for the Mongo collections the service uses ---
+# mongomock is used when it is installed; otherwise this covers the calls the
+# benchmarks reach (find with equality/$gt/$in filters, count_documents,
+# insert_one, replace_one, find_one). Documents are deep-copied in and out so
+# callers can't mutate the store.
+
+_ids = itertools.count(1)
+
+
+def _matches(doc, query):
+    for field, condition in (query or {}).items():
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            for op, operand in condition.items():
+                if op == '$gt' and not (value is not None and value > operand):
+                    return False
+                if op == '$in' and value not in operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class _Cursor(list):
+    def sort(self, field, direction=1):
+        super().sort(key=lambda doc: doc.get(field), reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        return _Cursor(self[:n])
+
+
+class InMemoryCollection:
+    def __init__(self, docs=()):
+        self.docs = []
+        for doc in docs:
+            self.insert_one(doc)
+
+    def find(self, query=None, projection=None):
+        docs = [copy.deepcopy(doc) for doc in self.docs if _matches(doc, query)]
+        if projection:
+            excluded = {k for k, v in projection.items() if not v}
+            included = {k for k, v in projection.items() if v}
+            docs = [{k: v for k, v in doc.items()
+                     if k not in excluded and (not included or k in included or k == '_id')} for doc in docs]
+        return _Cursor(docs)
+
+    def find_one(self, query=None, projection=None):
+        docs = self.find(query, projection)
+        return docs[0] if docs else None
+
+    def count_documents(self, query):
+        return sum(1 for doc in self.docs if _matches(doc, query))
+
+    def insert_one(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault('_id', str(next(_ids)))
+        self.docs.append(doc)
+        return doc['_id']
+
+    def replace_one(self, query, doc, upsert=False):
+        for i, existing in enumerate(self.docs):
+            if _matches(existing, query):
+                self.docs[i] = dict(copy.deepcopy(doc), _id=existing['_id'])
+                return
+        if upsert:
+            self.insert_one(doc)
+
+
+class InMemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, InMemoryCollection())
+
+    __getitem__ = __getattr__
+
+
+def memory_database():
+    try:
+        import mongomock
+    except ImportError:
+        return InMemoryDatabase()
+    return mongomock.MongoClient().get_database('mydietdiary')
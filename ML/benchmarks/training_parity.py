@@ -0,0 +1,114 @@
+import itertools
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# --- Parity of the vectorized RF training set with the original loop ---
+# Run from ML/:
+#   python -m benchmarks.training_parity [recipes.csv]
+# build_training_set must give the same X and y, row for row, as the per-pair
+# loop retrain_pipeline used before (kept below as the reference). Cluster
+# profiles are every combination of the profile values the rules look at.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dietary_rules import DietaryRuleEngine  # noqa: E402
+from scoring import build_training_set  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+PROFILE_VALUES = {
+    'Diabetes': ['None', 'Type 1', 'Type 2'],
+    'Hypertension': ['No', 'Yes'],
+    'Cardiovascular': ['None', 'Present'],
+    'Digestive Disorders': ['None', 'Celiac'],
+    'Food Allergies': ['None', 'Nuts', 'Dairy', 'Shellfish'],
+    'Diet Type': ['Omnivore', 'Vegetarian', 'Vegan', 'Pescatarian']
+}
+
+
+def is_recipe_suitable_for_cluster(cluster_profile, recipe):
+    # Rules as retrain_pipeline applied them per (cluster, recipe) pair
+    if 'Diabetes' in cluster_profile and cluster_profile['Diabetes'] in ['Type 1', 'Type 2']:
+        if 'diabetes_friendly' in recipe and not recipe['diabetes_friendly']:
+            return 0
+    if 'Hypertension' in cluster_profile and cluster_profile['Hypertension'] == 'Yes':
+        if 'low_sodium' in recipe and not recipe['low_sodium']:
+            return 0
+    if 'Cardiovascular' in cluster_profile and cluster_profile['Cardiovascular'] == 'Present':
+        if 'heart_healthy' in recipe and not recipe['heart_healthy']:
+            return 0
+    if 'Digestive Disorders' in cluster_profile and cluster_profile['Digestive Disorders'] == 'Celiac':
+        if 'gluten_free' in recipe and not recipe['gluten_free']:
+            return 0
+    if 'Food Allergies' in cluster_profile and 'ingredients' in recipe and isinstance(recipe['ingredients'], str):
+        ingredients_lower = recipe['ingredients'].lower()
+        if cluster_profile['Food Allergies'] == 'Nuts' and any(nut in ingredients_lower for nut in ['nuts', 'peanut', 'almond', 'cashew', 'walnut']):
+            return 0
+        if cluster_profile['Food Allergies'] == 'Dairy' and any(dairy in ingredients_lower for dairy in ['milk', 'cheese', 'yogurt', 'cream', 'butter']):
+            return 0
+        if cluster_profile['Food Allergies'] == 'Shellfish' and any(shellfish in ingredients_lower for shellfish in ['shrimp', 'crab', 'lobster', 'prawn']):
+            return 0
+    if 'Diet Type' in cluster_profile and 'ingredients' in recipe and isinstance(recipe['ingredients'], str):
+        ingredients_lower = recipe['ingredients'].lower()
+        recipe_name_lower = recipe['name'].lower() if 'name' in recipe and isinstance(recipe['name'], str) else ""
+        if cluster_profile['Diet Type'] == 'Vegetarian':
+            non_veg_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'fish', 'salmon', 'tuna',
+                                   'shrimp', 'meat', 'bacon', 'ham', 'sausage', 'seafood', 'cod', 'tilapia']
+            if any(ingredient in ingredients_lower or ingredient in recipe_name_lower for ingredient in non_veg_ingredients):
+                return 0
+        elif cluster_profile['Diet Type'] == 'Vegan':
+            non_vegan_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'fish', 'salmon', 'tuna',
+                                     'shrimp', 'meat', 'bacon', 'ham', 'sausage', 'seafood', 'milk', 'cheese',
+                                     'yogurt', 'cream', 'butter', 'egg', 'honey', 'dairy']
+            if any(ingredient in ingredients_lower or ingredient in recipe_name_lower for ingredient in non_vegan_ingredients):
+                return 0
+        elif cluster_profile['Diet Type'] == 'Pescatarian':
+            non_pescatarian_ingredients = ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'meat', 'bacon', 'ham', 'sausage']
+            if any(ingredient in ingredients_lower or ingredient in recipe_name_lower for ingredient in non_pescatarian_ingredients):
+                return 0
+    return 1
+
+
+def legacy_training_set(cluster_analysis, recipes_df):
+    X_train_rf, y_train_rf = [], []
+    for cluster_id, cluster_profile in cluster_analysis.iterrows():
+        for _, recipe in recipes_df.iterrows():
+            recipe_features = recipe[['calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber']].values
+            features_with_cluster = np.append(recipe_features, cluster_id)
+            is_breakfast = 1 if recipe.get('meal_type', '').lower() == 'breakfast' else 0
+            is_lunch = 1 if recipe.get('meal_type', '').lower() == 'lunch' else 0
+            is_dinner = 1 if recipe.get('meal_type', '').lower() == 'dinner' else 0
+            features_with_cluster = np.append(features_with_cluster, [is_breakfast, is_lunch, is_dinner])
+            X_train_rf.append(features_with_cluster)
+            y_train_rf.append(is_recipe_suitable_for_cluster(cluster_profile, recipe))
+    return np.array(X_train_rf), np.array(y_train_rf)
+
+
+def profile_grid():
+    # One cluster profile per combination of PROFILE_VALUES, indexed 0..n-1
+    return pd.DataFrame(list(itertools.product(*PROFILE_VALUES.values())), columns=list(PROFILE_VALUES))
+
+
+def parity_report(cluster_analysis, recipes_df, rule_engine=None):
+    rule_engine = rule_engine or DietaryRuleEngine()
+    X, y = build_training_set(cluster_analysis, recipes_df, rule_engine.index_for_dataframe(recipes_df))
+    X_ref, y_ref = legacy_training_set(cluster_analysis, recipes_df)
+    X_ref = X_ref.astype(float)
+    return {
+        'rows': len(y_ref),
+        'shape_matches': X.shape == X_ref.shape and y.shape == y_ref.shape,
+        'feature_mismatches': int((X != X_ref).any(axis=1).sum()) if X.shape == X_ref.shape else None,
+        'label_mismatches': int((y != y_ref).sum()) if y.shape == y_ref.shape else None
+    }
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(DATA_DIR, 'recipes_modified.csv')
+    recipes = pd.read_csv(path)
+    profiles = profile_grid()
+    report = parity_report(profiles, recipes)
+    print(f"{len(profiles)} cluster profiles x {len(recipes)} recipes: "
+          f"{report['feature_mismatches']} feature rows and {report['label_mismatches']} labels differ")
+    sys.exit(0 if report['shape_matches'] and not report['feature_mismatches'] and not report['label_mismatches'] else 1)
@@ -0,0 +1,134 @@
+import logging
+import threading
+
+import numpy as np
+
+from model_artifacts import MappedPreprocessor, preprocessing_layout
+from transformers import HealthPriorityTransformer
+from user_features import user_model_inputs
+
+logger = logging.getLogger(__name__)
+
+# --- Single-user cluster assignment without pandas or sklearn ---
+# Scaling, one-hot encoding and PCA are all affine, and the nearest centroid
+# only needs ||c||^2 - 2 r.c per cluster, so the whole chain folds into one
+# score per cluster:
+#   score = bias + numericals @ numeric_weights + sum(category_weights[codes])
+# Assigning a user is a dict lookup per categorical column and two small
+# dot products. Bundles whose preprocessing has another layout are not
+# compiled and keep the sklearn path.
+
+
+class CompiledClusterAssigner:
+    def __init__(self, numerical_cols, categorical_cols, categories, mean, scale,
+                 components, pca_mean, centers, whiten_scale=None):
+        n_num = len(numerical_cols)
+        components = np.asarray(components, dtype=np.float64)
+        if whiten_scale is not None:
+            components = components / whiten_scale[:, None]
+        centers = np.asarray(centers, dtype=np.float64)
+        # reduced = x @ components.T - pca_mean @ components.T; scores are
+        # ||c||^2 - 2 reduced @ centers.T
+        to_scores = -2.0 * components.T @ centers.T  # (features, clusters)
+        numeric_scores = to_scores[:n_num]
+        self.numerical_cols = list(numerical_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.numeric_weights = numeric_scores / np.asarray(scale, dtype=np.float64)[:, None]
+        self.bias = ((centers * centers).sum(axis=1)
+                     - np.asarray(pca_mean, dtype=np.float64) @ to_scores
+                     - (np.asarray(mean, dtype=np.float64) / scale) @ numeric_scores)
+        # One row per known category plus a zero row that unknown values map to
+        self.category_codes = []
+        offset = 0
+        for values in categories:
+            self.category_codes.append({str(v): n_num + offset + i for i, v in enumerate(values)})
+            offset += len(values)
+        self.unknown_row = n_num + offset
+        self.category_weights = np.vstack([to_scores, np.zeros((1, centers.shape[0]))])
+
+    @classmethod
+    def from_models(cls, preprocessing_pipeline, pca, kmeans_model):
+        # Returns None when the bundle can't be folded
+        if isinstance(preprocessing_pipeline, MappedPreprocessor):
+            arrays = preprocessing_pipeline.arrays
+            meta = {'numerical_cols': preprocessing_pipeline.numerical_cols,
+                    'categorical_cols': preprocessing_pipeline.categorical_cols,
+                    'categories': preprocessing_pipeline.categories}
+            mean, scale = np.asarray(arrays['pre_mean']), np.asarray(arrays['pre_scale'])
+        else:
+            steps = getattr(preprocessing_pipeline, 'named_steps', {})
+            if any(name != 'preprocessor' and not isinstance(step, HealthPriorityTransformer)
+                   for name, step in steps.items()):
+                return None
+            layout, meta = preprocessing_layout(preprocessing_pipeline)
+            if layout is None:
+                return None
+            mean, scale = layout['pre_mean'], layout['pre_scale']
+        whiten_scale = np.sqrt(np.asarray(pca.explained_variance_)) if getattr(pca, 'whiten', False) else None
+        return cls(meta['numerical_cols'], meta['categorical_cols'], meta['categories'], mean, scale,
+                   pca.components_, pca.mean_, kmeans_model.cluster_centers_, whiten_scale)
+
+    def scores(self, user_params):
+        numericals, categoricals = user_model_inputs(user_params, self.categorical_cols, self.numerical_cols)
+        try:
+            x = np.array(numericals, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError(f'Non-numeric value in {self.numerical_cols}')
+        if np.isnan(x).any():
+            missing = [col for col, v in zip(self.numerical_cols, x) if np.isnan(v)]
+            raise ValueError(f'Missing numerical parameters: {missing}')
+        rows = [codes.get(value, self.unknown_row) for codes, value in zip(self.category_codes, categoricals)]
+        return self.bias + x @ self.numeric_weights + self.category_weights[rows].sum(axis=0)
+
+    def assign(self, user_params):
+        return int(np.argmin(self.scores(user_params)))
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compiled_assigner(models):
+    # One assigner per loaded bundle; None if the bundle can't be compiled
+    key = (models.version, id(models['kmeans_model']))
+    if key not in _compiled:
+        with _compiled_lock:
+            if key not in _compiled:
+                try:
+                    assigner = CompiledClusterAssigner.from_models(
+                        models['preprocessing_pipeline'], models['pca'], models['kmeans_model'])
+                except Exception as e:
+                    logger.warning('Could not compile cluster assignment for version %s: %s', models.version, e)
+                    assigner = None
+                _compiled.clear()
+                _compiled[key] = assigner
+    return _compiled[key]
+
+
+def parity_report(models, users_df, categorical_cols=None):
+    # Compares compiled and sklearn assignments for every row of users_df
+    from user_features import assign_clusters, prepare_user_frame
+    categorical_cols = categorical_cols or models['categorical_cols']
+    assigner = CompiledClusterAssigner.from_models(models['preprocessing_pipeline'], models['pca'], models['kmeans_model'])
+    if assigner is None:
+        raise ValueError('The bundle cannot be compiled')
+    records = users_df.astype(object).where(users_df.notna(), None).to_dict('records')
+    expected = assign_clusters(prepare_user_frame(users_df, categorical_cols), models['preprocessing_pipeline'],
+                               models['pca'], models['kmeans_model'])
+    compiled = np.array([assigner.assign(r) for r in records])
+    mismatches = np.flatnonzero(compiled != expected)
+    return {'rows': len(records), 'mismatches': mismatches.tolist()}
+
+
+if __name__ == '__main__':
+    # python cluster_assigner.py [users.csv]: parity of the compiled path with
+    # the sklearn path for the current model version
+    import sys
+    import pandas as pd
+    from model_registry import ModelRegistry
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/test_user_parameters.csv'
+    models = ModelRegistry('models').load(mapped=False)
+    report = parity_report(models, pd.read_csv(path))
+    print(f"{report['rows'] - len(report['mismatches'])}/{report['rows']} rows agree with the sklearn path")
+    sys.exit(1 if report['mismatches'] else 0)
@@ -0,0 +1,136 @@
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from recipe_catalog import normalize_text
+
+# --- Data-driven dietary exclusion rules ---
+# Rules live in data/dietary_rules.json. A text rule excludes recipes whose
+# fields contain any of its terms (substring match, as before); a flag rule
+# excludes recipes whose boolean column is set and falsy. The "profile" section
+# maps a user/cluster attribute value to the rules it switches on.
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'dietary_rules.json')
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def load_rules(path=RULES_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _is_falsy_flag(value):
+    # Mirrors `'flag' in recipe and not recipe['flag']`: missing values never exclude
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return False
+    return not value
+
+
+class RuleIndex:
+    # Built once per recipe set: tokenizes every text field into an inverted
+    # index and precomputes one exclusion mask per rule
+    def __init__(self, rules, texts, flags, n):
+        self.rules = rules
+        self.n = n
+        self.texts = {field: np.asarray(values, dtype=object) for field, values in texts.items()}
+        self.postings = {field: self._invert(values) for field, values in self.texts.items()}
+        self.flags = flags
+        self.masks = {name: self._rule_mask(rule) for name, rule in rules['rules'].items()}
+
+    @staticmethod
+    def _invert(values):
+        postings = defaultdict(list)
+        for pos, text in enumerate(values):
+            for token in set(TOKEN_RE.findall(text)):
+                postings[token].append(pos)
+        return {token: np.array(positions, dtype=np.int64) for token, positions in postings.items()}
+
+    def _term_mask(self, field, term):
+        mask = np.zeros(self.n, dtype=bool)
+        if TOKEN_RE.fullmatch(term):
+            # An alphanumeric term can only occur inside a single token, so
+            # scanning the (small) vocabulary once is equivalent to scanning every recipe
+            for token, positions in self.postings.get(field, {}).items():
+                if term in token:
+                    mask[positions] = True
+        elif field in self.texts:
+            mask[:] = [term in text for text in self.texts[field]]
+        return mask
+
+    def _rule_mask(self, rule):
+        mask = np.zeros(self.n, dtype=bool)
+        if 'flag' in rule:
+            values = self.flags.get(rule['flag'])
+            if values is not None:
+                mask[:] = [_is_falsy_flag(v) for v in values]
+            return mask
+        for field in rule.get('fields', ['ingredients']):
+            for term in rule.get('terms', []):
+                mask |= self._term_mask(field, term.lower())
+        return mask
+
+    def profile_rules(self, profile, attributes=None):
+        names = []
+        for attribute, values in self.rules['profile'].items():
+            if attributes is not None and attribute not in attributes:
+                continue
+            value = profile.get(attribute) if hasattr(profile, 'get') else None
+            if isinstance(value, str) and ',' in value:
+                value = [v.strip() for v in value.split(',')]
+            for v in value if isinstance(value, (list, tuple)) else [value]:
+                if isinstance(v, str):
+                    names.extend(values.get(v, []))
+        return names
+
+    def exclusion_mask(self, rule_names):
+        mask = np.zeros(self.n, dtype=bool)
+        for name in rule_names:
+            mask |= self.masks[name]
+        return mask
+
+    def allowed_mask(self, profile, attributes=None):
+        return ~self.exclusion_mask(self.profile_rules(profile, attributes))
+
+
+class DietaryRuleEngine:
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else load_rules()
+        self._lock = threading.Lock()
+        self._cached = None
+
+    def build_index(self, texts, flags, n):
+        return RuleIndex(self.rules, texts, flags, n)
+
+    def index_for(self, catalog):
+        # One index per catalog snapshot version
+        cached = self._cached
+        if cached is not None and cached[0] == catalog.version:
+            return cached[1]
+        with self._lock:
+            cached = self._cached
+            if cached is None or cached[0] != catalog.version:
+                flags = {rule['flag']: catalog.columns.get(rule['flag'])
+                         for rule in self.rules['rules'].values() if 'flag' in rule}
+                texts = {'ingredients': catalog.ingredients_text, 'name': catalog.names_text}
+                cached = (catalog.version, self.build_index(texts, flags, len(catalog)))
+                self._cached = cached
+        return cached[1]
+
+    def index_for_dataframe(self, recipes_df):
+        # Training-set semantics: text rules (name included) only look at
+        # recipes that have an ingredient string
+        n = len(recipes_df)
+        ingredients = recipes_df['ingredients'] if 'ingredients' in recipes_df else pd.Series([None] * n)
+        names = recipes_df['name'] if 'name' in recipes_df else pd.Series([None] * n)
+        has_ingredients = ingredients.map(lambda v: isinstance(v, str))
+        texts = {
+            'ingredients': [normalize_text(v) if ok else "" for v, ok in zip(ingredients, has_ingredients)],
+            'name': [normalize_text(v) if ok and isinstance(v, str) else "" for v, ok in zip(names, has_ingredients)]
+        }
+        flags = {col: recipes_df[col].to_numpy() for col in recipes_df.columns}
+        return self.build_index(texts, flags, n)
@@ -0,0 +1,190 @@
+import os
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# --- Food nutrient table and name search ---
+# data/food_snack_values.csv is loaded once into column arrays keyed by
+# food_code. Name search combines a sorted token vocabulary (prefix matches for
+# autocomplete) with a trigram inverted index (typo-tolerant matches), so a
+# keystroke only touches the postings of the query's own tokens and trigrams.
+
+FOODS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'food_snack_values.csv')
+SERVING_PREFIX = 'unit_serving_'
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+SUMMARY_COLUMNS = ['energy_kcal', 'protein_g', 'carb_g', 'fat_g']
+
+
+def normalize_name(name):
+    return ' '.join(TOKEN_RE.findall(str(name).lower()))
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FoodNameIndex:
+    # Each query token scores 1 against names with a token starting with it
+    # (autocomplete) and its trigram similarity against names with a similar
+    # token (typos), e.g. "panner" -> "paneer". A food matches when every query
+    # token does; whole-name similarity and a leading match break ties.
+    def __init__(self, names, token_similarity=0.4):
+        self.names = [normalize_name(n) for n in names]
+        self.token_similarity = token_similarity
+        self.n = len(self.names)
+        tokens = defaultdict(set)
+        name_grams = defaultdict(list)
+        self.name_gram_counts = np.zeros(self.n, dtype=np.float64)
+        for i, name in enumerate(self.names):
+            for token in name.split():
+                tokens[token].add(i)
+            grams = trigrams(name)
+            self.name_gram_counts[i] = len(grams)
+            for gram in grams:
+                name_grams[gram].append(i)
+        self.name_gram_postings = {g: np.array(p, dtype=np.int64) for g, p in name_grams.items()}
+
+        self.vocabulary = sorted(tokens)
+        self.token_postings = [np.array(sorted(tokens[t]), dtype=np.int64) for t in self.vocabulary]
+        token_grams = defaultdict(list)
+        self.token_gram_counts = np.zeros(len(self.vocabulary), dtype=np.float64)
+        for v, token in enumerate(self.vocabulary):
+            grams = trigrams(token)
+            self.token_gram_counts[v] = len(grams)
+            for gram in grams:
+                token_grams[gram].append(v)
+        self.token_gram_postings = {g: np.array(p, dtype=np.int64) for g, p in token_grams.items()}
+
+    @staticmethod
+    def _similarity(query, postings, counts):
+        # Trigram Jaccard similarity of `query` against every indexed entry
+        grams = trigrams(query)
+        hits = [postings[g] for g in grams if g in postings]
+        if not hits:
+            return np.zeros(len(counts))
+        shared = np.bincount(np.concatenate(hits), minlength=len(counts))
+        return shared / (len(grams) + counts - shared)
+
+    def _token_scores(self, token):
+        scores = np.zeros(self.n, dtype=np.float64)
+        similarity = self._similarity(token, self.token_gram_postings, self.token_gram_counts)
+        for v in np.flatnonzero(similarity >= self.token_similarity):
+            np.maximum.at(scores, self.token_postings[v], similarity[v])
+        lo = bisect_left(self.vocabulary, token)
+        hi = bisect_left(self.vocabulary, token + '\uffff', lo)
+        for v in range(lo, hi):
+            scores[self.token_postings[v]] = 1.0
+        return scores
+
+    def search(self, query, limit=10):
+        # Returns [(position, score)] best first
+        query = normalize_name(query)
+        if not query or not self.n:
+            return []
+        token_scores = np.array([self._token_scores(token) for token in query.split()])
+        matched = (token_scores > 0).all(axis=0)
+        candidates = np.flatnonzero(matched)
+        if not len(candidates):
+            return []
+        score = token_scores[:, candidates].mean(axis=0)
+        score += 0.5 * self._similarity(query, self.name_gram_postings, self.name_gram_counts)[candidates]
+        score += [1.0 if self.names[i].startswith(query) else 0.0 for i in candidates]
+        if len(candidates) > limit:
+            top = np.argpartition(-score, limit - 1)[:limit]
+            candidates, score = candidates[top], score[top]
+        order = sorted(range(len(candidates)), key=lambda k: (-score[k], self.names[candidates[k]]))
+        return [(int(candidates[k]), float(score[k])) for k in order]
+
+
+class FoodTable:
+    def __init__(self, foods_df):
+        self.codes = foods_df['food_code'].astype(str).to_numpy(dtype=object)
+        self.names = foods_df['food_name'].astype(str).str.strip().to_numpy(dtype=object)
+        self.servings_unit = foods_df['servings_unit'].where(foods_df['servings_unit'].notna(), None).to_numpy(dtype=object) \
+            if 'servings_unit' in foods_df else np.full(len(foods_df), None, dtype=object)
+        self.positions = {code: i for i, code in enumerate(self.codes)}
+        numeric = [c for c in foods_df.columns if pd.api.types.is_numeric_dtype(foods_df[c])]
+        # per 100 g and per unit serving, same nutrient order
+        self.nutrients = [c for c in numeric if not c.startswith(SERVING_PREFIX)]
+        self.per_100g = foods_df[self.nutrients].to_numpy(dtype=np.float64)
+        self.per_serving = np.column_stack([
+            foods_df[SERVING_PREFIX + c].to_numpy(dtype=np.float64) if SERVING_PREFIX + c in foods_df else np.full(len(foods_df), np.nan)
+            for c in self.nutrients
+        ]) if self.nutrients else np.zeros((len(foods_df), 0))
+        self.name_index = FoodNameIndex(self.names)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _values(self, row):
+        return {c: (None if np.isnan(v) else float(v)) for c, v in zip(self.nutrients, row)}
+
+    def summary(self, i):
+        serving = dict(zip(self.nutrients, self.per_serving[i]))
+        return {
+            'food_code': self.codes[i],
+            'food_name': self.names[i],
+            'servings_unit': self.servings_unit[i],
+            **{c: (None if np.isnan(serving[c]) else float(serving[c])) for c in SUMMARY_COLUMNS if c in serving}
+        }
+
+    def search(self, query, limit=10):
+        return [dict(self.summary(i), score=round(score, 4)) for i, score in self.name_index.search(query, limit)]
+
+    def lookup(self, codes):
+        # Returns (found foods, unknown codes)
+        foods, missing = [], []
+        for code in codes:
+            i = self.positions.get(str(code))
+            if i is None:
+                missing.append(code)
+                continue
+            foods.append({
+                'food_code': self.codes[i],
+                'food_name': self.names[i],
+                'servings_unit': self.servings_unit[i],
+                'per_100g': self._values(self.per_100g[i]),
+                'per_serving': self._values(self.per_serving[i])
+            })
+        return foods, missing
+
+    def nutrient_totals(self, items):
+        # items: [(food_code,)], [(food_code, servings)] or [(food_code,
+        # servings, grams)]; servings default to 1, and grams (when given) use
+        # the per 100 g values instead of unit servings. Foods without unit
+        # serving values are reported rather than counted as 0.
+        rows, weights, basis = [], [], []
+        missing, no_serving = [], []
+        for item in items:
+            code = item[0]
+            servings = item[1] if len(item) > 1 else 1
+            grams = item[2] if len(item) > 2 else None
+            i = self.positions.get(str(code))
+            if i is None:
+                missing.append(code)
+                continue
+            if grams is not None:
+                rows.append(i)
+                weights.append(float(grams) / 100.0)
+                basis.append(0)
+            elif np.isnan(self.per_serving[i]).all():
+                no_serving.append(code)
+            else:
+                rows.append(i)
+                weights.append(float(servings))
+                basis.append(1)
+        rows = np.array(rows, dtype=np.int64)
+        weights = np.array(weights, dtype=np.float64)
+        basis = np.array(basis, dtype=bool)
+        values = np.where(basis[:, None], self.per_serving[rows], self.per_100g[rows])
+        totals = np.nansum(values * weights[:, None], axis=0) if len(rows) else np.zeros(len(self.nutrients))
+        return {c: float(v) for c, v in zip(self.nutrients, totals)}, missing, no_serving
+
+
+def load_food_table(path=FOODS_PATH):
+    # The CSV is not UTF-8 (Windows-1252 accents and non-breaking spaces)
+    return FoodTable(pd.read_csv(path, encoding='cp1252'))
@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+
+# --- Production serving for the ML service ---
+# gunicorn -c gunicorn.conf.py wsgi:app
+# The app is created in the master before the fork (preload_app), so every
+# worker shares the loaded models, catalog and indexes copy-on-write; each
+# worker then opens its own Mongo connection pool in post_fork. Plan
+# generation is CPU-bound NumPy work, so the default is one worker process
+# per core with a few threads each to overlap Mongo round trips.
+
+wsgi_app = 'wsgi:app'
+# Workers write metric snapshots here so /metrics on any worker reports all of them
+os.environ.setdefault('METRICS_DIR', os.path.join('data', 'metrics'))
+bind = os.environ.get('ML_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('ML_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('ML_THREADS', 4))
+preload_app = True
+# Batch plan requests stream for a while; retraining runs in a background job
+timeout = int(os.environ.get('ML_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so copy-on-write pages written by one don't pile up
+max_requests = int(os.environ.get('ML_MAX_REQUESTS', 5000))
+max_requests_jitter = 500
+accesslog = None  # requests are logged by the app as structured records
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+
+def on_starting(server):
+    # Snapshots from a previous run would be summed into this one's counters
+    import glob
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    import app as service
+    service.after_fork()
+
+
+def when_ready(server):
+    server.log.info('ML service ready with %d workers x %d threads', workers, threads)
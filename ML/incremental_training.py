@@ -0,0 +1,333 @@
+import copy
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from scoring import build_training_set
+from user_features import fill_user_defaults
+
+# --- Incremental model updates from newly uploaded users ---
+# A full retrain refits the scaler, PCA, KMeans and the RF search from zero.
+# Here only the new rows are used: the scaler statistics are merged, the PCA
+# is continued as an IncrementalPCA, the clusters as a MiniBatchKMeans
+# warm-started from the current centroids (cluster ids stay stable), and the
+# RF is refit with its current parameters only when a cluster profile or the
+# recipe set changed. Drift metrics on the new rows decide when the result
+# can't be trusted and a full retrain has to run instead.
+
+# Columns that make up a cluster profile (cluster_analysis)
+PROFILE_COLS = ['Diabetes', 'Hypertension', 'Cardiovascular', 'Digestive Disorders',
+                'Food Allergies', 'BMI Category', 'Meal Size Preference']
+
+# metric -> largest value an incremental update accepts
+DRIFT_THRESHOLDS = {
+    # max |mean(new) - mean(train)| / std(train) over the numerical columns
+    'numeric_shift': 0.5,
+    # share of new rows with a category the encoder has never seen
+    'unknown_category_rate': 0.2,
+    # PCA residual per row on the new data / residual of the training data
+    'reconstruction_error_ratio': 1.5,
+    # mean squared distance to the nearest centroid, new data / training data
+    'inertia_ratio': 1.5,
+    # largest centroid move / smallest distance between two centroids
+    'centroid_shift': 0.25,
+    # rows added incrementally since the last full retrain / rows it was trained on
+    'incremental_fraction': 0.5
+}
+
+
+class FullRetrainRequired(Exception):
+    def __init__(self, message, drift=None):
+        super().__init__(message)
+        self.drift = drift or {}
+
+
+def recipes_fingerprint(recipes_df):
+    hashed = pd.util.hash_pandas_object(recipes_df.astype(str), index=False).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+
+def profile_counts(user_df, labels, counts=None):
+    # {column: {cluster: {value: count}}}, optionally added onto existing counts
+    counts = copy.deepcopy(counts) if counts else {}
+    labels = np.asarray(labels)
+    for col in PROFILE_COLS:
+        col_counts = counts.setdefault(col, {})
+        values = user_df[col].astype(str).to_numpy() if col in user_df else np.full(len(labels), 'Unknown', dtype=object)
+        frame = pd.DataFrame({'cluster': labels, 'value': values})
+        for (cluster, value), n in frame.groupby(['cluster', 'value'], sort=False).size().items():
+            cluster_counts = col_counts.setdefault(str(int(cluster)), {})
+            cluster_counts[value] = cluster_counts.get(value, 0) + int(n)
+    return counts
+
+
+def cluster_profiles(counts, n_clusters, previous=None):
+    # Most frequent value per cluster and column, same shape as the
+    # groupby(...).agg(...) cluster_analysis of a full retrain
+    rows = {}
+    for cluster in range(n_clusters):
+        row = {}
+        for col in PROFILE_COLS:
+            cluster_counts = counts.get(col, {}).get(str(cluster))
+            if cluster_counts:
+                row[col] = max(cluster_counts, key=cluster_counts.get)
+            elif previous is not None and cluster in previous.index:
+                row[col] = previous.loc[cluster, col]
+        rows[cluster] = row
+    profiles = pd.DataFrame.from_dict(rows, orient='index')
+    profiles.index.name = 'cluster'
+    if previous is not None:
+        for col in previous.columns:
+            if col not in profiles.columns:
+                profiles[col] = previous[col].reindex(profiles.index)
+    if 'Diet Type' not in profiles.columns:
+        profiles['Diet Type'] = 'Non-spicy'
+    return profiles
+
+
+def training_state(user_df, labels, kmeans, reduced, recipes_df, dataset_files=None):
+    # Statistics an incremental update needs and the sklearn objects don't keep
+    labels = np.asarray(labels)
+    distances = ((reduced - kmeans.cluster_centers_[labels]) ** 2).sum(axis=1)
+    return {
+        'cluster_sizes': np.bincount(labels, minlength=kmeans.n_clusters).tolist(),
+        'profile_counts': profile_counts(user_df, labels),
+        'mean_inertia': float(distances.mean()) if len(distances) else None,
+        'full_retrain_rows': int(len(labels)),
+        'incremental_rows': 0,
+        'user_files': list(dataset_files.get('user_csvs') or [dataset_files['user_csv']]) if dataset_files else [],
+        'recipes_fingerprint': recipes_fingerprint(recipes_df)
+    }
+
+
+def _preprocessing_parts(pipeline):
+    try:
+        preprocessor = pipeline.named_steps['preprocessor']
+        scaler = preprocessor.named_transformers_['num'].named_steps['scaler']
+        encoder = preprocessor.named_transformers_['cat'].named_steps['onehot']
+        columns = {name: list(cols) for name, _, cols in preprocessor.transformers_}
+    except (AttributeError, KeyError):
+        raise FullRetrainRequired('The current preprocessing pipeline does not support incremental updates')
+    return scaler, encoder, columns['num'], columns['cat']
+
+
+def _dense(X):
+    return X.toarray() if hasattr(X, 'toarray') else np.asarray(X, dtype=np.float64)
+
+
+def _scaler_moments(scaler, n_features):
+    mean = np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(n_features), dtype=np.float64).copy()
+    scale = np.asarray(scaler.scale_ if scaler.with_std else np.ones(n_features), dtype=np.float64).copy()
+    return mean, scale
+
+
+def _continue_pca(pca, n_num, a, b, n_seen):
+    # Seed an IncrementalPCA with the current model, moved into the feature
+    # space of the updated scaler (x_new = a * x_old + b per feature)
+    from sklearn.decomposition import IncrementalPCA
+    if isinstance(pca, IncrementalPCA):
+        ipca = copy.deepcopy(pca)
+        old_var = ipca.var_
+    else:
+        ipca = IncrementalPCA(n_components=pca.n_components_, whiten=pca.whiten)
+        # Scaled numericals have unit variance on the training data and a
+        # one-hot column with frequency p has variance p(1 - p)
+        old_var = np.concatenate([np.ones(n_num), pca.mean_[n_num:] * (1 - pca.mean_[n_num:])])
+    basis = (pca.singular_values_[:, None] * pca.components_) * a[None, :]
+    _, singular_values, components = np.linalg.svd(basis, full_matrices=False)
+    ipca.components_ = components
+    ipca.singular_values_ = singular_values
+    ipca.mean_ = a * pca.mean_ + b
+    ipca.var_ = a * a * old_var
+    ipca.n_samples_seen_ = int(getattr(pca, 'n_samples_seen_', getattr(pca, 'n_samples_', n_seen)))
+    ipca.n_components_ = pca.n_components_
+    ipca.n_features_in_ = pca.components_.shape[1]
+    ipca.explained_variance_ = singular_values ** 2 / max(ipca.n_samples_seen_ - 1, 1)
+    ipca.explained_variance_ratio_ = ipca.explained_variance_ / ipca.var_.sum()
+    return ipca
+
+
+def _to_features(pca, centers):
+    if pca.whiten:
+        centers = centers * np.sqrt(pca.explained_variance_)
+    return centers @ pca.components_ + pca.mean_
+
+
+def _residual(pca, X):
+    reduced = pca.transform(X)
+    return ((X - _to_features(pca, reduced)) ** 2).sum(axis=1)
+
+
+def _min_center_distance(centers):
+    d = np.sqrt(((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2))
+    d[np.diag_indices_from(d)] = np.inf
+    return float(d.min()) if len(centers) > 1 else np.inf
+
+
+def _check(drift, thresholds):
+    exceeded = [f'{name}={drift[name]:.3f} > {limit}' for name, limit in thresholds.items()
+                if drift.get(name) is not None and drift[name] > limit]
+    if exceeded:
+        raise FullRetrainRequired('Drift too large for an incremental update: ' + ', '.join(exceeded), drift)
+
+
+def incremental_update(bundle, new_users_df, recipes_df, rule_index, state=None, thresholds=None,
+                       dataset_files=None, progress=None):
+    # bundle: unmapped artifacts of the serving version; new_users_df: only the
+    # users that were not part of any previous training run; state: the
+    # training_state recorded with that version.
+    # Returns (artifacts, report); raises FullRetrainRequired when the drift
+    # metrics or the current bundle rule the update out.
+    thresholds = {**DRIFT_THRESHOLDS, **(thresholds or {})}
+    progress = progress or (lambda stage: None)
+    state = state or {}
+    if len(new_users_df) == 0:
+        raise ValueError('No new users to train on')
+
+    progress('drift')
+    new_users_df = fill_user_defaults(new_users_df.copy())
+    pipeline = copy.deepcopy(bundle['preprocessing_pipeline'])
+    scaler, encoder, numerical_cols, categorical_cols = _preprocessing_parts(pipeline)
+    for col in categorical_cols:
+        new_users_df[col] = new_users_df[col].fillna('Unknown').astype(str)
+    pca, kmeans = bundle['pca'], bundle['kmeans_model']
+    n_clusters = kmeans.n_clusters
+    n_num = len(numerical_cols)
+
+    # Drift of the new rows against the current models
+    old_mean, old_scale = _scaler_moments(scaler, n_num)
+    numerics = new_users_df[numerical_cols].to_numpy(dtype=np.float64)
+    unknown = np.zeros(len(new_users_df), dtype=bool)
+    for col, categories in zip(categorical_cols, encoder.categories_):
+        unknown |= ~new_users_df[col].isin(categories.astype(str)).to_numpy()
+    X_old = _dense(pipeline.transform(new_users_df))
+    reduced_old = pca.transform(X_old)
+    centers = np.asarray(kmeans.cluster_centers_, dtype=np.float64)
+    nearest = ((reduced_old[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+    n_seen = int(scaler.n_samples_seen_ if np.ndim(scaler.n_samples_seen_) == 0 else np.max(scaler.n_samples_seen_))
+    if hasattr(pca, 'var_'):
+        total_variance = float(pca.var_.sum())
+    else:
+        total_variance = n_num + float((pca.mean_[n_num:] * (1 - pca.mean_[n_num:])).sum())
+    baseline_residual = max(total_variance - float(pca.explained_variance_.sum()), 1e-9)
+    full_rows = state.get('full_retrain_rows') or n_seen
+    drift = {
+        'numeric_shift': float(np.max(np.abs(np.nanmean(numerics, axis=0) - old_mean) / old_scale)) if n_num else 0.0,
+        'unknown_category_rate': float(unknown.mean()),
+        'reconstruction_error_ratio': float(_residual(pca, X_old).mean() / baseline_residual),
+        'inertia_ratio': float(nearest.mean() / state['mean_inertia']) if state.get('mean_inertia') else None,
+        'incremental_fraction': (int(state.get('incremental_rows', 0)) + len(new_users_df)) / max(full_rows, 1)
+    }
+    _check(drift, thresholds)
+
+    # Scaler: merge the new rows into mean/variance
+    progress('scaler')
+    scaler.partial_fit(numerics)
+    new_mean, new_scale = _scaler_moments(scaler, n_num)
+    n_features = pca.components_.shape[1]
+    a = np.ones(n_features)
+    b = np.zeros(n_features)
+    a[:n_num] = old_scale / new_scale
+    b[:n_num] = (old_mean - new_mean) / new_scale
+
+    # PCA: continue from the current components
+    progress('pca')
+    ipca = _continue_pca(pca, n_num, a, b, n_seen)
+    X_new = _dense(pipeline.transform(new_users_df))
+    ipca.partial_fit(X_new)
+
+    # KMeans: current centroids in the new PCA space, weighted by cluster size
+    progress('kmeans')
+    from sklearn.cluster import MiniBatchKMeans
+    center_features = a * _to_features(pca, centers) + b
+    start_centers = ipca.transform(center_features)
+    sizes = np.asarray(state.get('cluster_sizes') or np.full(n_clusters, n_seen / n_clusters), dtype=np.float64)
+    minibatch = MiniBatchKMeans(n_clusters=n_clusters, init=start_centers, n_init=1,
+                                reassignment_ratio=0.0, random_state=42)
+    # Replaying the centroids with their sizes as weights restores the counts,
+    # so the new rows move each centroid in proportion to how many users it has
+    minibatch.partial_fit(start_centers, sample_weight=np.maximum(sizes, 1.0))
+    reduced_new = ipca.transform(X_new)
+    minibatch.partial_fit(reduced_new)
+    labels = minibatch.predict(reduced_new)
+    moved = np.sqrt(((minibatch.cluster_centers_ - start_centers) ** 2).sum(axis=1)).max()
+    drift['centroid_shift'] = float(moved / _min_center_distance(minibatch.cluster_centers_))
+    _check(drift, thresholds)
+
+    # Cluster profiles: a cluster is affected when its profile changed
+    progress('cluster_profiles')
+    previous_profiles = bundle['cluster_analysis']
+    base_counts = state.get('profile_counts')
+    if not base_counts:
+        # Versions trained before the counts were kept: count each profile as
+        # all of its cluster's users
+        base_counts = {col: {str(c): {str(previous_profiles.loc[c, col]): float(sizes[c])} for c in previous_profiles.index}
+                       for col in PROFILE_COLS if col in previous_profiles.columns}
+    counts = profile_counts(new_users_df, labels, base_counts)
+    cluster_analysis = cluster_profiles(counts, n_clusters, previous_profiles)
+    common = [col for col in PROFILE_COLS if col in previous_profiles.columns]
+    old_rows = previous_profiles.reindex(cluster_analysis.index)[common].astype(str)
+    changed = (old_rows != cluster_analysis[common].astype(str)).any(axis=1)
+    affected = sorted(int(c) for c in cluster_analysis.index[changed.to_numpy()])
+    recipes_changed = state.get('recipes_fingerprint') != recipes_fingerprint(recipes_df)
+
+    # RF: refit with its current parameters only if its labels changed
+    rf_model = bundle['rf_model']
+    rf_refit = bool(affected) or recipes_changed
+    rf_metrics = None
+    if rf_refit:
+        progress('rf_refit')
+        from sklearn.base import clone
+        from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
+        X_rf, y_rf = build_training_set(cluster_analysis, recipes_df, rule_index)
+        # Fit on every row and evaluate out-of-bag, as retrain_pipeline does
+        rf_model = clone(rf_model).set_params(bootstrap=True, oob_score=True, n_jobs=-1).fit(X_rf, y_rf)
+        rf_model.set_params(n_jobs=None)
+        oob = rf_model.oob_decision_function_
+        scored = ~np.isnan(oob).any(axis=1)
+        y_test = y_rf[scored]
+        y_pred = rf_model.classes_[np.argmax(oob[scored], axis=1)]
+        rf_metrics = {
+            'accuracy': accuracy_score(y_test, y_pred),
+            'f1_score': f1_score(y_test, y_pred),
+            'precision': precision_score(y_test, y_pred),
+            'recall': recall_score(y_test, y_pred),
+            'confusion_matrix': confusion_matrix(y_test, y_pred).tolist()
+        }
+
+    silhouette = None
+    if 1 < len(np.unique(labels)) < len(labels):
+        from sklearn.metrics import silhouette_score
+        silhouette = float(silhouette_score(reduced_new, labels, sample_size=min(len(labels), 10000), random_state=42))
+
+    next_state = dict(state)
+    next_state.update({
+        'cluster_sizes': (sizes + np.bincount(labels, minlength=n_clusters)).tolist(),
+        'profile_counts': counts,
+        'full_retrain_rows': int(full_rows),
+        'incremental_rows': int(state.get('incremental_rows', 0)) + len(new_users_df),
+        'user_files': list(state.get('user_files', [])) + ([dataset_files['user_csv']] if dataset_files else []),
+        'recipes_fingerprint': recipes_fingerprint(recipes_df)
+    })
+    next_state.setdefault('mean_inertia', float(nearest.mean()))
+
+    artifacts = {
+        'kmeans_model': minibatch,
+        'pca': ipca,
+        'rf_model': rf_model,
+        'preprocessing_pipeline': pipeline,
+        'cluster_analysis': cluster_analysis,
+        'categorical_cols': bundle['categorical_cols']
+    }
+    report = {
+        'drift': drift,
+        'affected_clusters': affected,
+        'recipes_changed': recipes_changed,
+        'rf_refit': rf_refit,
+        'rf_metrics': rf_metrics,
+        'silhouette_score': silhouette,
+        'new_rows': int(len(new_users_df)),
+        'training_state': next_state
+    }
+    return artifacts, report
@@ -0,0 +1,322 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from user_features import CATEGORICAL_COLS, NUMERICAL_COLS, USER_DEFAULTS
+
+# --- Streaming, schema-validated dataset ingestion ---
+# Uploads are parsed chunk by chunk and checked against the user or recipe
+# schema. Good rows are appended column by column to raw binary files
+# (categoricals as integer codes + a category list, numbers as float32), so
+# memory stays bounded by the chunk size and retrain loads the data without
+# parsing text. Bad rows are skipped and reported with their row number.
+
+COLUMNAR_DIR = 'columnar'
+MANIFEST = 'manifest.json'
+CHUNK_ROWS = 50000
+MAX_REPORTED_ERRORS = 100
+
+# column -> (kind, nullable); kinds: 'category', 'float', 'bool'
+USER_SCHEMA = {
+    **{col: ('category', col in USER_DEFAULTS) for col in CATEGORICAL_COLS},
+    **{col: ('float', False) for col in NUMERICAL_COLS}
+}
+RECIPE_SCHEMA = {
+    'name': ('category', False),
+    'meal_type': ('category', False),
+    'calories': ('float', False),
+    'protein': ('float', False),
+    'carbs': ('float', False),
+    'fat': ('float', False),
+    'sodium': ('float', False),
+    'fiber': ('float', False),
+    'ingredients': ('category', False)
+}
+# Known optional recipe columns; anything else is stored as a category
+RECIPE_OPTIONAL = {
+    'vegetarian': 'bool', 'vegan': 'bool', 'gluten_free': 'bool', 'diabetes_friendly': 'bool',
+    'heart_healthy': 'bool', 'low_sodium': 'bool', 'prep_time': 'float'
+}
+SCHEMAS = {'user': USER_SCHEMA, 'recipe': RECIPE_SCHEMA}
+OPTIONAL = {'user': {}, 'recipe': RECIPE_OPTIONAL}
+# Cells pd.read_csv reads as missing ('', 'NA', 'None', 'null', ...), so an
+# ingested file loads the same as the raw one
+NA_VALUES = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+})
+TRUE_VALUES = {'true', '1', 'yes', 't', 'y'}
+FALSE_VALUES = {'false', '0', 'no', 'f', 'n'}
+
+
+class IngestionError(Exception):
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def detect_schema(filename, columns):
+    # Same naming convention retrain uses to pick files, then column overlap
+    lower = filename.lower()
+    for name in ('user', 'recipe'):
+        if name in lower:
+            return name
+    coverage = {name: len(set(schema) & set(columns)) / len(schema) for name, schema in SCHEMAS.items()}
+    return max(coverage, key=coverage.get)
+
+
+def columnar_path(data_dir, filename):
+    return os.path.join(data_dir, COLUMNAR_DIR, filename)
+
+
+def has_columnar(data_dir, filename):
+    return os.path.exists(os.path.join(columnar_path(data_dir, filename), MANIFEST))
+
+
+def _read_chunks(path, chunk_rows):
+    # DataFrames of raw strings; nothing is type-inferred before validation
+    if path.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise IngestionError('XLSX uploads need the openpyxl package')
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(c) if c is not None else '' for c in next(rows, [])]
+            batch = []
+            for row in rows:
+                batch.append(['' if v is None else str(v) for v in row])
+                if len(batch) == chunk_rows:
+                    yield pd.DataFrame(batch, columns=header)
+                    batch = []
+            if batch or not header:
+                yield pd.DataFrame(batch, columns=header)
+        finally:
+            workbook.close()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False, encoding_errors='replace')
+
+
+class _ColumnWriter:
+    def __init__(self, directory, index, column, kind):
+        self.column = column
+        self.kind = kind
+        self.file = f'{index:03d}.bin'
+        self.handle = open(os.path.join(directory, self.file), 'wb')
+        self.categories = {}
+        self.dtype = {'category': np.int32, 'float': np.float32, 'bool': np.int8}[kind]
+
+    def append(self, values):
+        # values: parsed column of the accepted rows (NaN/None = missing)
+        if self.kind == 'category':
+            # Chunk-local codes are remapped onto the file-wide category list
+            codes, uniques = pd.factorize(values)
+            remap = np.array([self.categories.setdefault(u, len(self.categories)) for u in uniques] + [-1], dtype=np.int32)
+            remap[codes].tofile(self.handle)
+        elif self.kind == 'bool':
+            np.where(pd.isna(values), -1, values.astype(float)).astype(np.int8).tofile(self.handle)
+        else:
+            values.astype(np.float32).tofile(self.handle)
+
+    def close(self):
+        self.handle.close()
+        meta = {'kind': self.kind, 'dtype': np.dtype(self.dtype).name, 'file': self.file}
+        if self.kind == 'category':
+            meta['categories'] = list(self.categories)
+        return meta
+
+
+def _parse_column(raw, kind):
+    # Returns (parsed values, invalid mask, missing mask) for a column of strings
+    missing = raw.isin(NA_VALUES)
+    text = raw.str.strip()
+    missing |= text.eq('')
+    if kind == 'float':
+        values = pd.to_numeric(text.where(~missing), errors='coerce').to_numpy(dtype=np.float64)
+        return values, np.isnan(values) & ~missing.to_numpy(), missing.to_numpy()
+    if kind == 'bool':
+        lower = text.str.lower()
+        values = pd.Series(np.nan, index=text.index, dtype=object)
+        values[lower.isin(TRUE_VALUES)] = True
+        values[lower.isin(FALSE_VALUES)] = False
+        invalid = values.isna() & ~missing
+        return values.to_numpy(), invalid.to_numpy(), missing.to_numpy()
+    values = text.where(~missing, None).to_numpy(dtype=object)
+    return values, np.zeros(len(text), dtype=bool), missing.to_numpy()
+
+
+def ingest_file(path, filename, data_dir, schema=None, chunk_rows=CHUNK_ROWS):
+    # Validates `path` and writes data_dir/columnar/<filename>/. Returns a
+    # summary dict; raises IngestionError when the header is unusable or no
+    # row is valid.
+    target = columnar_path(data_dir, filename)
+    staging = os.path.join(data_dir, COLUMNAR_DIR, f'.{filename}-{uuid.uuid4().hex}')
+    os.makedirs(staging)
+    writers = None
+    errors = []
+    error_count = 0
+    rejected = 0
+    rows = 0
+    row_offset = 0
+    try:
+        for chunk in _read_chunks(path, chunk_rows):
+            if writers is None:
+                schema = schema or detect_schema(filename, chunk.columns)
+                expected = SCHEMAS[schema]
+                missing_columns = [col for col in expected if col not in chunk.columns]
+                if missing_columns:
+                    raise IngestionError(
+                        f'Missing required {schema} columns: {", ".join(missing_columns)}',
+                        [{'row': None, 'column': col, 'error': 'missing column'} for col in missing_columns])
+                kinds = {col: expected[col][0] if col in expected else OPTIONAL[schema].get(col, 'category')
+                         for col in chunk.columns}
+                writers = {col: _ColumnWriter(staging, i, col, kind) for i, (col, kind) in enumerate(kinds.items())}
+
+            parsed = {}
+            bad = np.zeros(len(chunk), dtype=bool)
+            for col, writer in writers.items():
+                values, invalid, missing = _parse_column(chunk[col].astype(str), writer.kind)
+                required = col in expected and not expected[col][1]
+                problems = invalid | (missing & required)
+                error_count += int(problems.sum())
+                for i in np.flatnonzero(problems)[:MAX_REPORTED_ERRORS - len(errors)]:
+                    errors.append({
+                        'row': row_offset + int(i) + 1,
+                        'column': col,
+                        'value': str(chunk[col].iloc[i]),
+                        'error': f'expected {writer.kind}' if invalid[i] else 'required value is missing'
+                    })
+                bad |= problems
+                parsed[col] = values
+            good = ~bad
+            for col, writer in writers.items():
+                writer.append(parsed[col][good])
+            rows += int(good.sum())
+            rejected += int(bad.sum())
+            row_offset += len(chunk)
+
+        if writers is None:
+            raise IngestionError('The file has no header row')
+        if rows == 0:
+            raise IngestionError('No valid rows in the file', errors)
+        manifest = {
+            'source': filename,
+            'schema': schema,
+            'rows': rows,
+            'rejected_rows': rejected,
+            'columns': {col: writer.close() for col, writer in writers.items()}
+        }
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.rename(staging, target)
+    except pd.errors.ParserError as e:
+        for writer in (writers or {}).values():
+            writer.handle.close()
+        shutil.rmtree(staging, ignore_errors=True)
+        raise IngestionError(f'Could not parse the file: {e}')
+    except Exception:
+        for writer in (writers or {}).values():
+            writer.handle.close()
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return {
+        'schema': schema,
+        'rows': rows,
+        'rejected_rows': rejected,
+        'error_count': error_count,
+        'errors': errors,
+        'columnar_path': target
+    }
+
+
+def load_columnar(directory, categorical='object'):
+    # Returns the dataset as a DataFrame; categoricals decode to object values
+    # (as read_csv would give) or to pandas Categoricals with categorical='category'
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    data = {}
+    for col, meta in manifest['columns'].items():
+        values = np.fromfile(os.path.join(directory, meta['file']), dtype=meta['dtype'])
+        if meta['kind'] == 'category':
+            categories = meta['categories']
+            if categorical == 'category':
+                data[col] = pd.Categorical.from_codes(values, categories=pd.Index(categories, dtype=object))
+            else:
+                lookup = np.empty(len(categories) + 1, dtype=object)
+                lookup[:-1] = categories
+                lookup[-1] = np.nan
+                data[col] = lookup[values]
+        elif meta['kind'] == 'bool':
+            if (values >= 0).all():
+                data[col] = values == 1
+            else:
+                flags = np.empty(len(values), dtype=object)
+                flags[:] = values == 1
+                flags[values < 0] = np.nan
+                data[col] = flags
+        else:
+            data[col] = values
+    return pd.DataFrame(data, columns=list(manifest['columns']))
+
+
+def load_dataset(data_dir, filename):
+    # Columnar copy when the file went through ingestion, the raw file otherwise
+    if has_columnar(data_dir, filename):
+        return load_columnar(columnar_path(data_dir, filename))
+    path = os.path.join(data_dir, filename)
+    if filename.lower().endswith('.xlsx'):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+
+def parity_report(path, filename=None, schema=None):
+    # Ingests `path` into a scratch directory and compares load_dataset with
+    # pd.read_csv of the same file. Numbers are compared after the float32
+    # rounding of the columnar store. Returns {'rows', 'rejected_rows',
+    # 'mismatches': {column: differing row count or reason}}.
+    import tempfile
+
+    filename = filename or os.path.basename(path)
+    expected = pd.read_csv(path)
+    with tempfile.TemporaryDirectory() as data_dir:
+        report = ingest_file(path, filename, data_dir, schema=schema)
+        loaded = load_dataset(data_dir, filename)
+    mismatches = {}
+    if report['rejected_rows']:
+        mismatches['*'] = f"{report['rejected_rows']} rows rejected"
+    elif list(loaded.columns) != list(expected.columns):
+        mismatches['*'] = 'columns differ'
+    else:
+        for col in expected.columns:
+            want, got = expected[col], loaded[col]
+            if pd.api.types.is_numeric_dtype(want) and not pd.api.types.is_bool_dtype(want):
+                want = want.astype(np.float32)
+                got = pd.to_numeric(got, errors='coerce').astype(np.float32)
+                same = (want.to_numpy() == got.to_numpy()) | (want.isna().to_numpy() & got.isna().to_numpy())
+            else:
+                same = (want.astype(object).to_numpy() == got.astype(object).to_numpy()) | \
+                       (want.isna().to_numpy() & got.isna().to_numpy())
+            if not same.all():
+                mismatches[col] = int((~same).sum())
+    return {'rows': len(expected), 'rejected_rows': report['rejected_rows'], 'mismatches': mismatches}
+
+
+if __name__ == '__main__':
+    # python ingestion.py [file.csv ...]: load_dataset of an ingested file
+    # must equal pd.read_csv of the same file
+    import sys
+
+    paths = sys.argv[1:] or ['data/test_user_parameters.csv', 'data/recipes_modified.csv']
+    failed = False
+    for path in paths:
+        report = parity_report(path)
+        failed |= bool(report['mismatches'])
+        print(f"{path}: {report['rows']} rows, mismatches: {report['mismatches'] or 'none'}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,296 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# --- Stage timings and counters for the hot paths ---
+# A Trace collects wall-clock seconds per stage and item counts (recipes
+# scanned, candidates left after each filter, RF rows scored) for one request
+# or job. Code on the hot path calls stage()/count(), which do nothing when
+# no trace is active, so the same functions run untraced from scripts and
+# benchmarks. Finished traces are folded into a MetricsRegistry that /metrics
+# renders in the Prometheus text format.
+
+_active = contextvars.ContextVar('instrumentation_trace', default=None)
+
+
+class Trace:
+    def __init__(self, operation):
+        self.operation = operation
+        self.started_at = time.perf_counter()
+        self.stages = collections.OrderedDict()
+        self.counts = collections.OrderedDict()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + int(value)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def server_timing(self):
+        # Server-Timing header value; durations in milliseconds
+        entries = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in self.stages.items()]
+        entries.append(f'total;dur={self.elapsed() * 1000:.2f}')
+        return ', '.join(entries)
+
+    def to_dict(self):
+        return {'operation': self.operation,
+                'stages_ms': {stage: round(s * 1000, 3) for stage, s in self.stages.items()},
+                'counts': dict(self.counts)}
+
+
+def current_trace():
+    return _active.get()
+
+
+def start_trace(operation):
+    # Returns (trace, token); pass the token to end_trace()
+    trace = Trace(operation)
+    return trace, _active.set(trace)
+
+
+def end_trace(token):
+    _active.reset(token)
+
+
+@contextlib.contextmanager
+def trace(operation, registry=None):
+    # Traces the block and records it in registry (if given) on exit
+    active, token = start_trace(operation)
+    try:
+        yield active
+    finally:
+        end_trace(token)
+        if registry is not None:
+            registry.record(active)
+
+
+@contextlib.contextmanager
+def stage(name):
+    active = _active.get()
+    if active is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.add(name, time.perf_counter() - started)
+
+
+def count(name, value=1):
+    active = _active.get()
+    if active is not None:
+        active.count(name, value)
+
+
+# --- Prometheus metrics ---
+# Each process keeps its own counters and histograms. Under gunicorn every
+# worker also writes a snapshot to METRICS_DIR (at most every flush_interval
+# seconds), and /metrics sums the snapshots of all workers so a scrape that
+# lands on any worker sees the whole service.
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+HELP = {
+    'ml_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint and status'),
+    'ml_operation_duration_seconds': ('histogram', 'Total duration of a traced request or job'),
+    'ml_stage_duration_seconds': ('histogram', 'Duration of one stage of a traced request or job'),
+    'ml_stage_items_total': ('counter', 'Items counted by traced stages (recipes scanned, candidates kept, RF rows)'),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self, snapshot_dir=None, flush_interval=5.0, buckets=DURATION_BUCKETS):
+        self.snapshot_dir = snapshot_dir
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self.counters = {}  # (name, labels key) -> value
+        self.histograms = {}  # (name, labels key) -> [bucket counts..., +Inf count, sum]
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            entry = self.histograms.get(key)
+            if entry is None:
+                entry = self.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[bisect.bisect_left(self.buckets, seconds)] += 1
+            entry[-1] += seconds
+
+    def record(self, trace, total=None):
+        operation = trace.operation or 'unknown'
+        self.observe('ml_operation_duration_seconds', {'operation': operation},
+                     trace.elapsed() if total is None else total)
+        self.record_stages(operation, trace.stages, trace.counts)
+
+    def record_stages(self, operation, stages, counts=None):
+        for stage_name, seconds in stages.items():
+            self.observe('ml_stage_duration_seconds', {'operation': operation, 'stage': stage_name}, seconds)
+        for name, value in (counts or {}).items():
+            self.inc('ml_stage_items_total', {'operation': operation, 'item': name}, value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'counters': [[name, list(map(list, key)), value] for (name, key), value in self.counters.items()],
+                'histograms': [[name, list(map(list, key)), list(entry)] for (name, key), entry in self.histograms.items()]
+            }
+
+    def maybe_flush(self):
+        if self.snapshot_dir is None or time.monotonic() - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = time.monotonic()
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            path = os.path.join(self.snapshot_dir, f'{os.getpid()}.json')
+            tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning('Could not write metrics snapshot: %s', e)
+
+    def _merged(self):
+        # This process's live values plus the latest snapshot of every other worker
+        snapshots = [self.snapshot()]
+        if self.snapshot_dir is not None:
+            own = os.path.join(self.snapshot_dir, f'{os.getpid()}.json')
+            for path in glob.glob(os.path.join(self.snapshot_dir, '*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        counters, histograms = {}, {}
+        for snap in snapshots:
+            if tuple(snap['buckets']) != self.buckets:
+                continue
+            for name, key, value in snap['counters']:
+                k = (name, tuple(map(tuple, key)))
+                counters[k] = counters.get(k, 0) + value
+            for name, key, entry in snap['histograms']:
+                k = (name, tuple(map(tuple, key)))
+                merged = histograms.setdefault(k, [0] * len(entry))
+                for i, v in enumerate(entry):
+                    merged[i] += v
+        return counters, histograms
+
+    def render(self, gauges=()):
+        # gauges: (name, help, labels, value) tuples describing this process at scrape time
+        counters, histograms = self._merged()
+        lines = []
+        for name, (kind, text) in HELP.items():
+            if kind == 'counter':
+                series = sorted((k, v) for k, v in counters.items() if k[0] == name)
+                if not series:
+                    continue
+                lines += [f'# HELP {name} {text}', f'# TYPE {name} counter']
+                lines += [f'{name}{_format_labels(key)} {value}' for (_, key), value in series]
+            else:
+                series = sorted((k, v) for k, v in histograms.items() if k[0] == name)
+                if not series:
+                    continue
+                lines += [f'# HELP {name} {text}', f'# TYPE {name} histogram']
+                for (_, key), entry in series:
+                    cumulative = 0
+                    for bound, n in zip(self.buckets, entry):
+                        cumulative += n
+                        lines.append(f'{name}_bucket{_format_labels(key, [("le", repr(bound))])} {cumulative}')
+                    cumulative += entry[len(self.buckets)]
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {entry[-1]:.6f}')
+                    lines.append(f'{name}_count{_format_labels(key)} {cumulative}')
+        grouped = collections.OrderedDict()
+        for name, text, labels, value in gauges:
+            grouped.setdefault((name, text), []).append((labels, value))
+        for (name, text), series in grouped.items():
+            lines += [f'# HELP {name} {text}', f'# TYPE {name} gauge']
+            lines += [f'{name}{_format_labels(_labels_key(labels))} {value}' for labels, value in series]
+        return '\n'.join(lines) + '\n'
+
+
+# --- Sampling profiler ---
+# Samples one thread's stack from a helper thread every `interval` seconds and
+# aggregates the samples as folded stacks ("outer;inner;leaf count"), which
+# flamegraph.pl and speedscope read directly. Cost to the sampled thread is
+# the GIL hand-off per sample, so it is only turned on for single requests.
+
+class StackSampler:
+    def __init__(self, thread_id=None, interval=0.001, max_depth=64):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _frame_label(self, frame):
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(self._frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def folded(self):
+        return '\n'.join(f'{stack} {n}' for stack, n in self.samples.most_common()) + '\n'
+
+    def save(self, directory, name):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{time.strftime("%Y%m%dT%H%M%S")}-{name}-{os.getpid()}-{uuid.uuid4().hex[:6]}.folded')
+        with open(path, 'w') as f:
+            f.write(self.folded())
+        return path
@@ -0,0 +1,306 @@
+import numpy as np
+
+from scoring import MEAL_TYPES
+
+# --- Constraint-aware meal plan optimizer ---
+# Candidates are bucketed by meal type once per (cluster, restrictions) pool.
+# Each day is filled greedily (one recipe + portion per slot, aiming at the
+# slot's share of the calorie target) and then repaired slot by slot until the
+# day total is within tolerance of the target and the macro split is inside
+# the configured ranges. A slot evaluates a fixed-size draw from its meal
+# type's shuffled rotation (vectorized), so the cost of a day does not grow
+# with the bucket size and a plan's cost is linear in its length.
+
+NUTRIENTS = ['calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber']
+
+CALORIE_TARGETS = {'Underweight': 2500, 'Normal': 2000, 'Overweight': 1800}
+DEFAULT_CALORIE_TARGET = 1500
+
+# (slot name, recipe meal type, share of daily calories)
+SLOT_LAYOUTS = {
+    'Small frequent': [
+        ('Breakfast', 'breakfast', 0.25),
+        ('Morning Snack', 'breakfast', 0.10),
+        ('Lunch', 'lunch', 0.30),
+        ('Afternoon Snack', 'lunch', 0.10),
+        ('Dinner', 'dinner', 0.25)
+    ],
+    'Regular 3 meals': [
+        ('Breakfast', 'breakfast', 0.30),
+        ('Lunch', 'lunch', 0.35),
+        ('Dinner', 'dinner', 0.35)
+    ],
+    'Other': [
+        ('Brunch', 'breakfast', 0.45),
+        ('Dinner', 'dinner', 0.55)
+    ]
+}
+
+# Share of energy from each macro (percent of protein*4 + carbs*4 + fat*9)
+MACRO_RANGES = {'protein': (10.0, 35.0), 'carbs': (45.0, 65.0), 'fat': (20.0, 35.0)}
+MACRO_ENERGY = np.array([4.0, 4.0, 9.0])
+
+
+def daily_calorie_target(user_params):
+    return CALORIE_TARGETS.get(user_params.get('BMI Category', 'Normal'), DEFAULT_CALORIE_TARGET)
+
+
+MAX_SLOTS = 12
+DEFAULT_REPEAT_WINDOW = 7
+
+
+def parse_slot_layout(slots):
+    # Custom layout: [{"name": ..., "meal_type": ..., "share": ...}, ...] or
+    # [name, meal_type, share] triples; shares are normalized to sum to 1
+    if not isinstance(slots, (list, tuple)) or not 0 < len(slots) <= MAX_SLOTS:
+        raise ValueError(f'meal_slots must be a list of 1 to {MAX_SLOTS} slots')
+    layout = []
+    for slot in slots:
+        if isinstance(slot, dict):
+            slot = (slot.get('name'), slot.get('meal_type'), slot.get('share', 1.0))
+        try:
+            name, meal_type, share = slot
+            share = float(share)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid meal slot: {slot!r}')
+        meal_type = str(meal_type).lower()
+        if not isinstance(name, str) or not name or meal_type not in MEAL_TYPES or not share > 0:
+            raise ValueError(f'Invalid meal slot: {slot!r} (meal_type must be one of {MEAL_TYPES}, share > 0)')
+        layout.append((name, meal_type, share))
+    if len({name for name, _, _ in layout}) != len(layout):
+        raise ValueError('Meal slot names must be unique')
+    total = sum(share for _, _, share in layout)
+    return [(name, meal_type, share / total) for name, meal_type, share in layout]
+
+
+def slot_layout(user_params):
+    if user_params.get('meal_slots') is not None:
+        return parse_slot_layout(user_params['meal_slots'])
+    meal_preference = user_params.get('Meal Size Preference', 'Regular 3 meals')
+    return SLOT_LAYOUTS.get(meal_preference, SLOT_LAYOUTS['Other'])
+
+
+class CandidatePool:
+    # Suitable recipes for one (cluster, restrictions) group as arrays,
+    # bucketed by meal type; `positions` index into the catalog snapshot
+    def __init__(self, catalog, positions, scores):
+        self.catalog = catalog
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        nutrients = np.zeros((len(self.positions), len(NUTRIENTS)), dtype=np.float64)
+        for j, col in enumerate(NUTRIENTS):
+            if col in catalog.columns:
+                nutrients[:, j] = catalog.columns[col][self.positions]
+        self.nutrients = np.nan_to_num(nutrients)
+        self.energy = self.nutrients[:, 1:4] * MACRO_ENERGY
+        meal_types = catalog.meal_types[self.positions]
+        self.buckets = {mt: np.flatnonzero(meal_types == mt) for mt in np.unique(meal_types)}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def bucket(self, meal_type):
+        return self.buckets.get(meal_type, np.zeros(0, dtype=np.int64))
+
+
+class RecipeRotation:
+    # One meal type's pool indices in shuffled order. draw() walks the order
+    # from a cursor and hands out recipes last used at least `window` days
+    # ago; last_used (day per pool index) is shared by all rotations of a plan
+    # and updated by the planner.
+    NEVER = -(1 << 30)
+
+    def __init__(self, bucket, last_used, window, size, rng):
+        self.order = bucket[rng.permutation(len(bucket))]
+        self.last_used = last_used
+        self.window = window
+        self.size = size
+        self.rng = rng
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.order)
+
+    def draw(self, day, rows, strict=False):
+        # (rows, k) candidate matrix, k <= size, with no recipe in two rows.
+        # With strict, None when there are fewer available recipes than rows.
+        n = len(self.order)
+        want = rows * self.size
+        found, total, scanned = [], 0, 0
+        while scanned < n and total < want:
+            take = min(want, n - scanned)
+            idx = self.order[(self.cursor + np.arange(take)) % n]
+            self.cursor = (self.cursor + take) % n
+            scanned += take
+            idx = idx[day - self.last_used[idx] >= self.window]
+            found.append(idx)
+            total += len(idx)
+        available = np.concatenate(found)[:want]
+        k = len(available) // rows
+        if k:
+            return available[:rows * k].reshape(rows, k)
+        if strict:
+            return None
+        # Too few recipes outside the window to give every row its own: rows
+        # share the least recently used half of the bucket, repeats allowed
+        last = self.last_used[self.order]
+        shared = np.union1d(available, self.order[last <= np.median(last)])
+        k = min(self.size, len(shared))
+        return np.stack([self.rng.choice(shared, k, replace=False) for _ in range(rows)])
+
+
+class MealPlanOptimizer:
+    def __init__(self, calorie_tolerance=0.05, macro_ranges=None, macro_tolerance=5.0,
+                 servings_range=(0.5, 4.0), servings_step=0.25, repair_passes=3,
+                 score_weight=0.02, variety_noise=0.05, draw_size=256, repeat_window=DEFAULT_REPEAT_WINDOW,
+                 max_block_days=7):
+        self.calorie_tolerance = calorie_tolerance
+        ranges = macro_ranges or MACRO_RANGES
+        self.macro_low = np.array([ranges[m][0] for m in ('protein', 'carbs', 'fat')]) - macro_tolerance
+        self.macro_high = np.array([ranges[m][1] for m in ('protein', 'carbs', 'fat')]) + macro_tolerance
+        self.servings_range = servings_range
+        self.servings_step = servings_step
+        self.repair_passes = repair_passes
+        self.score_weight = score_weight
+        self.variety_noise = variety_noise
+        self.draw_size = draw_size
+        self.repeat_window = repeat_window
+        self.max_block_days = max_block_days
+
+    def servings(self, need, calories):
+        # Portions (on the servings grid) that bring each recipe closest to `need` calories
+        servings = need / np.where(calories > 0, calories, np.inf)
+        servings = np.round(servings / self.servings_step) * self.servings_step
+        return np.clip(servings, *self.servings_range)
+
+    def _violation(self, calories, energy, target):
+        # Zero when calories are within tolerance and every macro share is in range
+        calorie_error = np.maximum(np.abs(calories - target) / target - self.calorie_tolerance, 0.0)
+        total = energy.sum(axis=-1, keepdims=True)
+        shares = 100.0 * energy / np.where(total > 0, total, 1.0)
+        macro_error = (np.maximum(self.macro_low - shares, 0.0) + np.maximum(shares - self.macro_high, 0.0)).sum(axis=-1) / 100.0
+        return 10.0 * calorie_error + macro_error
+
+    def _best(self, pool, candidates, need, base_calories, base_energy, target, rng):
+        # Evaluates one slot for several days at once, the rest of each day
+        # fixed. candidates: (days, k) pool indices; need, base_calories and
+        # target: (days,); base_energy: (days, 3). Returns per-day arrays of
+        # (pool index, servings, violation) for the best candidate.
+        calories_each = pool.nutrients[candidates, 0]
+        servings = self.servings(need[:, None], calories_each)
+        calories = base_calories[:, None] + servings * calories_each
+        energy = base_energy[:, None, :] + servings[..., None] * pool.energy[candidates]
+        violation = self._violation(calories, energy, target[:, None])
+        cost = (violation
+                + 0.01 * np.abs(servings - 1.0)
+                - self.score_weight * pool.scores[candidates]
+                + self.variety_noise * rng.random(candidates.shape))
+        best = np.argmin(cost, axis=1)
+        rows = np.arange(len(candidates))
+        return candidates[rows, best], servings[rows, best], violation[rows, best]
+
+    def repeat_windows(self, pool, layout, repeat_window=None):
+        # Days before a recipe may come back, per meal type. An explicit window
+        # is kept as asked (a bucket too small for it falls back to its least
+        # recently used recipes); the default is shortened so at least half of
+        # a bucket stays available each day.
+        uses = {}
+        for _, mt, _ in layout:
+            uses[mt] = uses.get(mt, 0) + 1
+        if repeat_window is not None:
+            return {mt: max(1, int(repeat_window)) for mt in uses}
+        return {mt: max(1, min(self.repeat_window, len(pool.bucket(mt)) // n // 2)) for mt, n in uses.items()}
+
+    def plan(self, pool, layout, calorie_target, days=7, seed=None, repeat_window=None):
+        # Returns one list per day of (pool index, servings) per slot, or None
+        # where the slot's bucket is empty. A recipe is not planned again
+        # within repeat_window days of its last use (see repeat_windows).
+        # Days are planned in blocks no longer than the shortest window: the
+        # days of a block may not share recipes anyway, so each (slot, day)
+        # gets its own disjoint candidates and every step of the greedy and
+        # repair passes is evaluated for the whole block at once.
+        rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+        last_used = np.full(len(pool), RecipeRotation.NEVER, dtype=np.int64)
+        windows = self.repeat_windows(pool, layout, repeat_window)
+        rotations = {mt: RecipeRotation(pool.bucket(mt), last_used, windows[mt], self.draw_size, rng) for mt in windows}
+        slots_by_type = {mt: [s for s, (_, m, _) in enumerate(layout) if m == mt] for mt in rotations}
+        # Share of the day still to fill from each slot on (slots with recipes only)
+        shares = [share if len(rotations[mt]) else 0.0 for _, mt, share in layout]
+        remaining_shares = np.cumsum(shares[::-1])[::-1]
+        block = max(1, min(self.max_block_days, *windows.values()))
+
+        plan = []
+        start = 0
+        while start < days:
+            # Shorter blocks when a bucket can't give every day its own recipes;
+            # a single day only repeats recipes when nothing else is left
+            n = min(block, days - start)
+            candidates = self._draw(rotations, slots_by_type, len(layout), start, n)
+            while candidates is None:
+                n = max(1, n // 2)
+                candidates = self._draw(rotations, slots_by_type, len(layout), start, n)
+            picks, servings = self._plan_block(pool, layout, candidates, n, float(calorie_target), remaining_shares, rng)
+            for s, slot_candidates in enumerate(candidates):
+                if slot_candidates is not None:
+                    last_used[picks[:, s]] = start + np.arange(n)
+            for d in range(n):
+                plan.append([(int(picks[d, s]), float(servings[d, s])) if candidates[s] is not None else None
+                             for s in range(len(layout))])
+            start += n
+        return plan
+
+    def _draw(self, rotations, slots_by_type, n_slots, start, n):
+        # Candidates per slot for days start..start+n-1: (n, k) arrays, None
+        # for slots with an empty bucket; None overall if a block of n days
+        # can't be drawn without repeats
+        candidates = [None] * n_slots
+        for mt, slots in slots_by_type.items():
+            if len(rotations[mt]):
+                drawn = rotations[mt].draw(start, n * len(slots), strict=n > 1)
+                if drawn is None:
+                    return None
+                for j, s in enumerate(slots):
+                    candidates[s] = drawn[j * n:(j + 1) * n]
+        return candidates
+
+    def _plan_block(self, pool, layout, candidates, n, calorie_target, remaining_shares, rng):
+        # Greedy then repair passes for n days; returns (picks, servings), (n, slots)
+        picks = np.zeros((n, len(layout)), dtype=np.int64)
+        servings = np.zeros((n, len(layout)))
+        calories = np.zeros(n)
+        energy = np.zeros((n, 3))
+        target = np.full(n, calorie_target)
+        for s, (_, _, share) in enumerate(layout):
+            if candidates[s] is None:
+                continue
+            # Greedy pass: the slot's own share of the target; the rest of
+            # the day so far counts towards the macro split
+            remaining = remaining_shares[s]
+            need = share / remaining * (target - calories) if remaining else np.zeros(n)
+            slot_target = np.where(calories + need > 0, calories + need, target)
+            i, portion, _ = self._best(pool, candidates[s], need, calories, energy, slot_target, rng)
+            picks[:, s], servings[:, s] = i, portion
+            calories = calories + portion * pool.nutrients[i, 0]
+            energy = energy + portion[:, None] * pool.energy[i]
+
+        violation = self._violation(calories, energy, target)
+        for _ in range(self.repair_passes):
+            if not (violation > 0.0).any():
+                break
+            for s in rng.permutation(len(layout)):
+                open_days = violation > 0.0
+                if candidates[s] is None or not open_days.any():
+                    continue
+                i, portion = picks[:, s], servings[:, s]
+                base_calories = calories - portion * pool.nutrients[i, 0]
+                base_energy = energy - portion[:, None] * pool.energy[i]
+                new_i, new_portion, new_violation = self._best(
+                    pool, candidates[s], target - base_calories, base_calories, base_energy, target, rng)
+                better = open_days & (new_violation < violation)
+                picks[better, s] = new_i[better]
+                servings[better, s] = new_portion[better]
+                violation = np.where(better, new_violation, violation)
+                i, portion = picks[:, s], servings[:, s]
+                calories = base_calories + portion * pool.nutrients[i, 0]
+                energy = base_energy + portion[:, None] * pool.energy[i]
+        return picks, servings
@@ -0,0 +1,288 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# --- Memory-mappable model artifacts ---
+# The large numeric parts of a bundle (random forest node arrays, PCA
+# components, KMeans centroids, scaler statistics) are stored as .npy files next to a small JSON
+# manifest. They are opened with mmap_mode='r', so every worker process on a
+# node shares the same page-cache copy and nothing is read until it is used.
+
+ARRAYS_DIR = 'arrays'
+MANIFEST = 'manifest.json'
+PAGE_SIZE = 4096
+PREFETCH_THREAD = 'model-array-prefetch'
+
+
+def arrays_path(directory):
+    return os.path.join(directory, ARRAYS_DIR)
+
+
+def has_arrays(directory):
+    return os.path.exists(os.path.join(arrays_path(directory), MANIFEST))
+
+
+# --- Export ---
+def _export_forest(rf_model):
+    lefts, rights, features, thresholds, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in rf_model.estimators_:
+        tree = estimator.tree_
+        left = tree.children_left.astype(np.int64)
+        right = tree.children_right.astype(np.int64)
+        leaf = left == -1
+        lefts.append(np.where(leaf, -1, left + offset))
+        rights.append(np.where(leaf, -1, right + offset))
+        features.append(tree.feature.astype(np.int64))
+        thresholds.append(tree.threshold.astype(np.float64))
+        value = tree.value[:, 0, :].astype(np.float64)
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        values.append(value / normalizer)
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+    arrays = {
+        'rf_children_left': np.concatenate(lefts),
+        'rf_children_right': np.concatenate(rights),
+        'rf_feature': np.concatenate(features),
+        'rf_threshold': np.concatenate(thresholds),
+        'rf_value': np.concatenate(values),
+        'rf_roots': np.array(roots, dtype=np.int64)
+    }
+    meta = {
+        'classes': rf_model.classes_.tolist(),
+        'n_features_in': int(rf_model.n_features_in_),
+        'max_depth': int(max_depth),
+        'params': {k: v for k, v in rf_model.get_params().items() if isinstance(v, (int, float, str, bool, type(None)))}
+    }
+    return arrays, meta
+
+
+def preprocessing_layout(pipeline):
+    # Only the layout retrain_pipeline builds (scaled numericals + one-hot
+    # categoricals, identity priority weighting) is exported; anything else
+    # keeps loading from its pickle
+    try:
+        preprocessor = pipeline.named_steps['preprocessor']
+        scaler = preprocessor.named_transformers_['num'].named_steps['scaler']
+        encoder = preprocessor.named_transformers_['cat'].named_steps['onehot']
+        columns = {name: cols for name, _, cols in preprocessor.transformers_}
+    except (AttributeError, KeyError):
+        return None, None
+    if (set(columns) - {'remainder'} != {'num', 'cat'} or encoder.drop is not None
+            or encoder.handle_unknown != 'ignore' or getattr(encoder, 'infrequent_categories_', None)):
+        return None, None
+    n_num = len(columns['num'])
+    arrays = {
+        'pre_mean': np.asarray(scaler.mean_ if scaler.with_mean else np.zeros(n_num), dtype=np.float64),
+        'pre_scale': np.asarray(scaler.scale_ if scaler.with_std else np.ones(n_num), dtype=np.float64)
+    }
+    meta = {
+        'numerical_cols': list(columns['num']),
+        'categorical_cols': list(columns['cat']),
+        'categories': [c.tolist() for c in encoder.categories_]
+    }
+    return arrays, meta
+
+
+def export_arrays(artifacts, directory):
+    # Writes <directory>/arrays/ atomically; returns its path
+    arrays = {}
+    manifest = {}
+    if 'rf_model' in artifacts:
+        forest_arrays, manifest['rf_model'] = _export_forest(artifacts['rf_model'])
+        arrays.update(forest_arrays)
+    if 'pca' in artifacts:
+        pca = artifacts['pca']
+        arrays['pca_components'] = np.asarray(pca.components_, dtype=np.float64)
+        arrays['pca_mean'] = np.asarray(pca.mean_, dtype=np.float64)
+        arrays['pca_explained_variance'] = np.asarray(pca.explained_variance_, dtype=np.float64)
+        manifest['pca'] = {'whiten': bool(getattr(pca, 'whiten', False)), 'n_components': int(pca.n_components_)}
+    if 'kmeans_model' in artifacts:
+        kmeans = artifacts['kmeans_model']
+        arrays['kmeans_centers'] = np.asarray(kmeans.cluster_centers_, dtype=np.float64)
+        manifest['kmeans_model'] = {'n_clusters': int(kmeans.n_clusters)}
+    if 'preprocessing_pipeline' in artifacts:
+        pre_arrays, pre_meta = preprocessing_layout(artifacts['preprocessing_pipeline'])
+        if pre_arrays is not None:
+            arrays.update(pre_arrays)
+            manifest['preprocessing_pipeline'] = pre_meta
+    manifest['arrays'] = {name: {'dtype': str(a.dtype), 'shape': list(a.shape)} for name, a in arrays.items()}
+
+    target = arrays_path(directory)
+    staging = os.path.join(directory, f'.{ARRAYS_DIR}-{uuid.uuid4().hex}')
+    os.makedirs(staging)
+    try:
+        for name, a in arrays.items():
+            np.save(os.path.join(staging, f'{name}.npy'), a)
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging, target)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return target
+
+
+# --- Loading ---
+class MappedArrays:
+    # Opens each array on first access; prefetch() faults pages in from a
+    # background thread so the first requests don't pay for it
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        array = self._arrays.get(name)
+        if array is None:
+            with self._lock:
+                array = self._arrays.get(name)
+                if array is None:
+                    array = np.load(os.path.join(self.directory, f'{name}.npy'), mmap_mode='r')
+                    self._arrays[name] = array
+        return array
+
+    def prefetch(self, names=None):
+        def touch():
+            for name in names or self.manifest['arrays']:
+                flat = self[name].reshape(-1).view(np.uint8)
+                int(flat[::PAGE_SIZE].sum())
+        thread = threading.Thread(target=touch, name=PREFETCH_THREAD, daemon=True)
+        thread.start()
+        return thread
+
+
+def _dense(X):
+    if hasattr(X, 'toarray'):
+        X = X.toarray()
+    return np.asarray(X, dtype=np.float64)
+
+
+class MappedPreprocessor:
+    # transform() of the fitted ColumnTransformer: standardized numericals
+    # followed by one-hot categoricals, unknown categories encoded as zeros
+    def __init__(self, arrays):
+        meta = arrays.manifest['preprocessing_pipeline']
+        self.arrays = arrays
+        self.numerical_cols = meta['numerical_cols']
+        self.categorical_cols = meta['categorical_cols']
+        self.categories = meta['categories']
+        self.offsets = np.cumsum([0] + [len(c) for c in self.categories])
+        self.n_features_out = len(self.numerical_cols) + int(self.offsets[-1])
+
+    def transform(self, X):
+        out = np.zeros((len(X), self.n_features_out), dtype=np.float64)
+        n_num = len(self.numerical_cols)
+        out[:, :n_num] = (X[self.numerical_cols].to_numpy(dtype=np.float64) - self.arrays['pre_mean']) / self.arrays['pre_scale']
+        rows = np.arange(len(X))
+        for col, categories, offset in zip(self.categorical_cols, self.categories, self.offsets):
+            codes = pd.Categorical(X[col], categories=categories).codes
+            known = codes >= 0
+            out[rows[known], n_num + offset + codes[known]] = 1.0
+        return out
+
+
+class MappedForest:
+    # predict/predict_proba of a fitted RandomForestClassifier over all trees at once
+    def __init__(self, arrays):
+        meta = arrays.manifest['rf_model']
+        self.arrays = arrays
+        self.classes_ = np.array(meta['classes'])
+        self.n_features_in_ = meta['n_features_in']
+        self.max_depth = meta['max_depth']
+        self.params = meta['params']
+
+    def get_params(self, deep=True):
+        return dict(self.params)
+
+    def predict_proba(self, X, batch_size=4096):
+        X = np.asarray(X, dtype=np.float64)
+        # Trees compare float32 inputs against float64 thresholds
+        X = X.astype(np.float32).astype(np.float64)
+        if len(X) > batch_size:
+            return np.concatenate([self.predict_proba(X[i:i + batch_size], batch_size) for i in range(0, len(X), batch_size)])
+        a = self.arrays
+        left, right = a['rf_children_left'], a['rf_children_right']
+        feature, threshold, value, roots = a['rf_feature'], a['rf_threshold'], a['rf_value'], a['rf_roots']
+        rows = np.arange(len(X))[:, None]
+        node = np.repeat(roots[None, :], len(X), axis=0)
+        for _ in range(self.max_depth + 1):
+            children = left[node]
+            internal = children != -1
+            if not internal.any():
+                break
+            go_left = X[rows, np.where(internal, feature[node], 0)] <= threshold[node]
+            node = np.where(internal, np.where(go_left, children, right[node]), node)
+        return value[node].mean(axis=1)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class MappedPCA:
+    def __init__(self, arrays):
+        meta = arrays.manifest['pca']
+        self.arrays = arrays
+        self.whiten = meta['whiten']
+        self.n_components_ = meta['n_components']
+
+    @property
+    def components_(self):
+        return self.arrays['pca_components']
+
+    @property
+    def mean_(self):
+        return self.arrays['pca_mean']
+
+    @property
+    def explained_variance_(self):
+        return self.arrays['pca_explained_variance']
+
+    def transform(self, X):
+        X_transformed = (_dense(X) - self.mean_) @ self.components_.T
+        if self.whiten:
+            X_transformed /= np.sqrt(self.explained_variance_)
+        return X_transformed
+
+
+class MappedKMeans:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.n_clusters = arrays.manifest['kmeans_model']['n_clusters']
+
+    @property
+    def cluster_centers_(self):
+        return self.arrays['kmeans_centers']
+
+    def predict(self, X):
+        X = _dense(X)
+        centers = self.cluster_centers_
+        distances = (X * X).sum(axis=1)[:, None] - 2 * X @ centers.T + (centers * centers).sum(axis=1)[None, :]
+        return np.argmin(distances, axis=1).astype(np.int32)
+
+
+def load_arrays(directory, prefetch=True):
+    # Returns mapped stand-ins for the artifacts stored under <directory>/arrays/
+    arrays = MappedArrays(arrays_path(directory))
+    loaded = {}
+    if 'rf_model' in arrays.manifest:
+        loaded['rf_model'] = MappedForest(arrays)
+    if 'pca' in arrays.manifest:
+        loaded['pca'] = MappedPCA(arrays)
+    if 'kmeans_model' in arrays.manifest:
+        loaded['kmeans_model'] = MappedKMeans(arrays)
+    if 'preprocessing_pipeline' in arrays.manifest:
+        loaded['preprocessing_pipeline'] = MappedPreprocessor(arrays)
+    if prefetch:
+        arrays.prefetch()
+    return loaded
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+
+from model_artifacts import export_arrays, has_arrays, load_arrays
+from transformers import HealthPriorityTransformer
+
+logger = logging.getLogger(__name__)
+
+# --- Versioned model registry ---
+# Every trained bundle is written to models/versions/<version>/ and published
+# by atomically replacing the models/CURRENT pointer file. Serving processes
+# poll the pointer and hot-swap the whole bundle, so a request never sees
+# kmeans/pca/rf/pipeline from different generations.
+
+ARTIFACTS = ['kmeans_model', 'pca', 'rf_model', 'preprocessing_pipeline', 'cluster_analysis', 'categorical_cols']
+LEGACY_VERSION = 'legacy'
+
+
+class _ModelUnpickler(pickle.Unpickler):
+    # The original pipeline pickles were written from `python app.py`
+    def find_class(self, module, name):
+        if name == 'HealthPriorityTransformer' and module in ('__main__', 'app'):
+            return HealthPriorityTransformer
+        return super().find_class(module, name)
+
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return _ModelUnpickler(f).load()
+
+
+def _write_atomic(path, data):
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _fsync_dir(path):
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class ModelBundle(dict):
+    # The artifacts dict plus the version it was loaded from
+    def __init__(self, version, artifacts, manifest=None):
+        super().__init__(artifacts)
+        self.version = version
+        self.manifest = manifest or {}
+
+
+class ModelRegistry:
+    def __init__(self, root='models'):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self.pointer_path = os.path.join(root, 'CURRENT')
+        self.history_path = os.path.join(root, 'history.log')
+
+    @staticmethod
+    def new_version_id():
+        return time.strftime('v%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    # --- Publishing ---
+    def publish(self, artifacts, metadata=None, activate=True):
+        version = self.new_version_id()
+        os.makedirs(self.versions_dir, exist_ok=True)
+        staging = os.path.join(self.versions_dir, f'.staging-{version}')
+        os.makedirs(staging)
+        try:
+            for name, obj in artifacts.items():
+                with open(os.path.join(staging, f'{name}.pkl'), 'wb') as f:
+                    pickle.dump(obj, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+            manifest = {
+                'version': version,
+                'created_at': time.time(),
+                'artifacts': sorted(artifacts),
+                'metadata': metadata or {}
+            }
+            export_arrays(artifacts, staging)
+            _write_atomic(os.path.join(staging, 'manifest.json'), json.dumps(manifest, default=str, indent=2))
+            _fsync_dir(staging)
+            # The version only becomes visible once it is complete
+            os.rename(staging, self.version_dir(version))
+            _fsync_dir(self.versions_dir)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if activate:
+            self.activate(version)
+        return version
+
+    def is_version(self, version):
+        # Only published version directories (or the flat legacy pickles) can
+        # be activated; names are never resolved outside versions_dir
+        if version == LEGACY_VERSION:
+            return True
+        if not isinstance(version, str) or not version or version.startswith('.') or os.path.basename(version) != version:
+            return False
+        path = os.path.realpath(self.version_dir(version))
+        if os.path.dirname(path) != os.path.realpath(self.versions_dir):
+            return False
+        return os.path.isfile(os.path.join(path, 'manifest.json'))
+
+    def activate(self, version, rollback=False):
+        if not self.is_version(version):
+            raise ValueError(f'Unknown model version: {version}')
+        if self.current_version() is None and not self.history():
+            # Keep the flat pickles reachable through rollback
+            self._append_history(LEGACY_VERSION)
+        _write_atomic(self.pointer_path, version)
+        self._append_history(version, rollback)
+        return version
+
+    def _append_history(self, version, rollback=False):
+        entry = {'version': version, 'activated_at': time.time()}
+        if rollback:
+            entry['rollback'] = True
+        with open(self.history_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def _activation_stack(self):
+        # Replays the history: an activation pushes its version, a rollback
+        # pops back to the version it re-activated (or pushes it when it was
+        # not on the stack), so the entry below the top is what was active
+        # before the current version
+        stack = []
+        for entry in self.history():
+            version = entry['version']
+            if entry.get('rollback') and version in stack:
+                del stack[len(stack) - stack[::-1].index(version):]
+            else:
+                stack.append(version)
+        return stack
+
+    def rollback(self, version=None):
+        # Without an explicit version, go back to the one active before the
+        # current; repeated rollbacks keep going back (v2 -> v1 -> legacy)
+        if version is None:
+            current = self.current_version() or LEGACY_VERSION
+            stack = self._activation_stack()
+            while stack and stack[-1] == current:
+                stack.pop()
+            if not stack:
+                raise ValueError('No previous model version to roll back to')
+            version = stack[-1]
+        return self.activate(version, rollback=True)
+
+    # --- Reading ---
+    def current_version(self):
+        try:
+            with open(self.pointer_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def history(self):
+        try:
+            with open(self.history_path) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def list_versions(self):
+        versions = []
+        if os.path.isdir(self.versions_dir):
+            for version in sorted(os.listdir(self.versions_dir)):
+                if version.startswith('.'):
+                    continue
+                versions.append(self.manifest(version))
+        return versions
+
+    def manifest(self, version):
+        if version == LEGACY_VERSION:
+            return {'version': LEGACY_VERSION, 'artifacts': ARTIFACTS, 'metadata': {}}
+        if not self.is_version(version):
+            raise ValueError(f'Unknown model version: {version}')
+        with open(os.path.join(self.version_dir(version), 'manifest.json')) as f:
+            return json.load(f)
+
+    def load(self, version=None, mapped=True):
+        # mapped=True serves rf/pca/kmeans from memory-mapped arrays instead of
+        # unpickling them; training code asks for the sklearn objects instead
+        version = version or self.current_version() or LEGACY_VERSION
+        # Before the first publish the flat pickles in models/ are served as 'legacy'
+        directory = self.root if version == LEGACY_VERSION else self.version_dir(version)
+        manifest = self.manifest(version)
+        artifacts = load_arrays(directory) if mapped and has_arrays(directory) else {}
+        for name in manifest['artifacts']:
+            if name not in artifacts:
+                artifacts[name] = load_pickle(os.path.join(directory, f'{name}.pkl'))
+        if mapped and not has_arrays(directory):
+            # Versions written before the array format get converted once
+            try:
+                export_arrays(artifacts, directory)
+            except Exception as e:
+                logger.warning('Could not export model arrays for version %s: %s', version, e)
+        return ModelBundle(version, artifacts, manifest)
+
+
+class LiveModels:
+    # Holds the bundle a serving process uses and swaps it when CURRENT changes
+    def __init__(self, registry, check_interval=2.0):
+        self.registry = registry
+        self.check_interval = check_interval
+        self._bundle = None
+        self._pointer = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded_version(self):
+        # Version being served, or None before the first successful load
+        return self._bundle.version if self._bundle is not None else None
+
+    def get(self):
+        now = time.monotonic()
+        if self._bundle is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if self._bundle is None or now - self._checked_at >= self.check_interval:
+                    self._checked_at = now
+                    pointer = self.registry.current_version()
+                    if self._bundle is None or pointer != self._pointer:
+                        self._swap(pointer)
+        return self._bundle
+
+    def reload(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._swap(self.registry.current_version())
+        return self._bundle
+
+    def _swap(self, pointer):
+        try:
+            bundle = self.registry.load(pointer)
+        except Exception as e:
+            # Keep serving the bundle we have
+            logger.error('Error loading models (version %s): %s', pointer, e)
+            self._pointer = pointer
+            return
+        self._bundle = bundle
+        self._pointer = pointer
+        logger.info('Models loaded successfully (version %s)', bundle.version)
@@ -0,0 +1,255 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from meal_optimizer import NUTRIENTS
+
+# --- Vectorized meal plan analytics ---
+# Plans are flattened once into (days, slots, nutrients) arrays; one plan is
+# just a range of days, so the same reductions serve a single plan, a patient's
+# history or a dietitian's whole caseload.
+
+SLOTS = ['Breakfast', 'Morning Snack', 'Brunch', 'Lunch', 'Afternoon Snack', 'Dinner']
+# Stored diet plans (Backend DietPlan model) drop the spaces
+SLOT_ALIASES = {'MorningSnack': 'Morning Snack', 'AfternoonSnack': 'Afternoon Snack'}
+NON_SLOT_KEYS = {'_id', 'day_number', 'day_label'}
+MACROS = ['protein', 'carbs', 'fat']
+MACRO_ENERGY = np.array([4.0, 4.0, 9.0])
+
+
+class PlanArrays:
+    # nutrients: (days, slots, nutrients) float64, zero where no meal
+    # filled:    (days, slots) bool, a recipe was assigned
+    # present:   (days, slots) bool, the slot exists in the plan
+    # recipes:   (days, slots) int32 codes into `recipe_names`, -1 where empty
+    # offsets:   (plans + 1,) day offsets of each plan
+    def __init__(self, nutrients, filled, present, recipes, recipe_names, offsets, slots):
+        self.nutrients = nutrients
+        self.filled = filled
+        self.present = present
+        self.recipes = recipes
+        self.recipe_names = recipe_names
+        self.offsets = offsets
+        self.slots = slots
+
+    @property
+    def n_plans(self):
+        return len(self.offsets) - 1
+
+    @property
+    def days_per_plan(self):
+        return np.diff(self.offsets)
+
+    @property
+    def plan_ids(self):
+        # Plan index of every day row
+        return np.repeat(np.arange(self.n_plans), self.days_per_plan)
+
+    @classmethod
+    def from_plans(cls, plans):
+        # `plans` are generate_diet_plan dicts ({'Day 1': {'Breakfast': {...}}})
+        # or stored DietPlan documents/day lists ({'days': [{'Breakfast': {...}}]})
+        slots = list(SLOTS)
+        slot_index = {slot: i for i, slot in enumerate(slots)}
+        recipe_codes = {}
+        # Flat (day, slot) coordinate lists, scattered into the arrays at the end
+        present_days, present_slots = [], []
+        meal_days, meal_slots, meal_values, meal_recipes = [], [], [], []
+        offsets = [0]
+        n_days = 0
+        for plan in plans:
+            days = plan.get('days', []) if isinstance(plan, dict) and 'days' in plan else plan
+            days = days.values() if isinstance(days, dict) else days
+            for day in days:
+                for slot, meal in day.items():
+                    if slot in NON_SLOT_KEYS:
+                        continue
+                    slot = SLOT_ALIASES.get(slot, slot)
+                    s = slot_index.get(slot)
+                    if s is None:
+                        s = slot_index[slot] = len(slots)
+                        slots.append(slot)
+                    present_days.append(n_days)
+                    present_slots.append(s)
+                    if isinstance(meal, dict):
+                        meal_days.append(n_days)
+                        meal_slots.append(s)
+                        meal_values.append([meal.get(n, 0) or 0 for n in NUTRIENTS])
+                        name = meal.get('name')
+                        meal_recipes.append(-1 if name is None else recipe_codes.setdefault(name, len(recipe_codes)))
+                n_days += 1
+            offsets.append(n_days)
+
+        n_slots = len(slots)
+        nutrients = np.zeros((n_days, n_slots, len(NUTRIENTS)), dtype=np.float64)
+        filled = np.zeros((n_days, n_slots), dtype=bool)
+        present = np.zeros((n_days, n_slots), dtype=bool)
+        recipes = np.full((n_days, n_slots), -1, dtype=np.int32)
+        present[present_days, present_slots] = True
+        if meal_days:
+            filled[meal_days, meal_slots] = True
+            nutrients[meal_days, meal_slots] = np.array(meal_values, dtype=np.float64)
+            recipes[meal_days, meal_slots] = meal_recipes
+        return cls(nutrients, filled, present, recipes, list(recipe_codes), np.array(offsets, dtype=np.int64), slots)
+
+    @classmethod
+    def concatenate(cls, parts):
+        # Stacks already-encoded plans; slot axes are aligned by name
+        if not parts:
+            return cls.from_plans([])
+        slots = list(SLOTS)
+        for part in parts:
+            slots.extend(slot for slot in part.slots if slot not in slots)
+
+        def aligned(part, values, fill):
+            if part.slots == slots:
+                return values
+            out = np.full((values.shape[0], len(slots)) + values.shape[2:], fill, dtype=values.dtype)
+            out[:, [slots.index(slot) for slot in part.slots]] = values
+            return out
+
+        # Recipe codes are shifted so each part keeps its own name range
+        name_offsets = np.cumsum([0] + [len(part.recipe_names) for part in parts[:-1]])
+        day_counts = [len(part.nutrients) for part in parts]
+        recipes = np.concatenate([aligned(p, p.recipes, -1) for p in parts])
+        recipes = np.where(recipes >= 0, recipes + np.repeat(name_offsets, day_counts)[:, None], -1).astype(np.int32)
+        plan_days = np.concatenate([part.days_per_plan for part in parts])
+        return cls(
+            np.concatenate([aligned(p, p.nutrients, 0.0) for p in parts]),
+            np.concatenate([aligned(p, p.filled, False) for p in parts]),
+            np.concatenate([aligned(p, p.present, False) for p in parts]),
+            recipes,
+            [name for part in parts for name in part.recipe_names],
+            np.concatenate([[0], np.cumsum(plan_days)]).astype(np.int64),
+            slots
+        )
+
+
+class PlanArraysCache:
+    # Encoded plans keyed by (plan id, last update), so reloading a dashboard
+    # only re-encodes plans that changed since the last request
+    def __init__(self, max_plans=20000):
+        self.max_plans = max_plans
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, docs, key=lambda doc: (doc.get('_id'), doc.get('updatedAt'))):
+        parts = []
+        with self._lock:
+            for doc in docs:
+                k = key(doc)
+                part = self._entries.get(k)
+                if part is None:
+                    part = PlanArrays.from_plans([doc])
+                    self._entries[k] = part
+                else:
+                    self._entries.move_to_end(k)
+                parts.append(part)
+            while len(self._entries) > self.max_plans:
+                self._entries.popitem(last=False)
+        return PlanArrays.concatenate(parts)
+
+
+def _ratio(numerator, denominator, scale=1.0):
+    # numerator / denominator * scale, 0 where the denominator is 0
+    numerator = np.asarray(numerator, dtype=np.float64) * scale
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def plan_statistics(arrays, calorie_targets=None):
+    # One vectorized pass over all plans; returns a dict of per-plan arrays
+    days = arrays.days_per_plan
+    plan_ids = arrays.plan_ids
+    daily = arrays.nutrients.sum(axis=1)
+    sums = np.zeros((arrays.n_plans, daily.shape[1]), dtype=np.float64)
+    np.add.at(sums, plan_ids, daily)
+    with np.errstate(invalid='ignore'):
+        # Plans without days average to NaN, like np.mean([])
+        avg = sums / days[:, None]
+
+    energy = avg[:, 1:4] * MACRO_ENERGY
+    macro_pct = _ratio(energy, energy.sum(axis=1, keepdims=True), 100.0)
+
+    assigned = arrays.recipes >= 0
+    meal_plans = np.broadcast_to(plan_ids[:, None], arrays.recipes.shape)[assigned]
+    n_names = max(len(arrays.recipe_names), 1)
+    total_meals = np.bincount(meal_plans, minlength=arrays.n_plans)
+    unique_recipes = np.bincount(np.unique(meal_plans.astype(np.int64) * n_names + arrays.recipes[assigned]) // n_names,
+                                 minlength=arrays.n_plans)
+    variety = _ratio(unique_recipes, total_meals, 100.0)
+
+    slots_total = np.bincount(plan_ids, weights=arrays.present.sum(axis=1), minlength=arrays.n_plans)
+    slots_filled = np.bincount(plan_ids, weights=arrays.filled.sum(axis=1), minlength=arrays.n_plans)
+    coverage = _ratio(slots_filled, slots_total, 100.0)
+
+    stats = {
+        'days': days,
+        'avg_nutrition': avg,
+        'macro_percentages': macro_pct,
+        'unique_recipes': unique_recipes,
+        'total_meals': total_meals,
+        'variety_score': variety,
+        'meal_coverage': coverage
+    }
+    if calorie_targets is not None:
+        targets = np.broadcast_to(np.asarray(calorie_targets, dtype=np.float64), (arrays.n_plans,))
+        stats['calorie_target'] = targets
+        stats['calorie_deviation_pct'] = _ratio(avg[:, 0] - targets, targets, 100.0)
+    return stats
+
+
+def plan_analysis(stats, i):
+    # analyze_meal_plan-shaped dict for plan i
+    analysis = {
+        'avg_nutrition': {n: float(stats['avg_nutrition'][i, j]) for j, n in enumerate(NUTRIENTS)},
+        'macro_percentages': {f'{m}_pct': float(stats['macro_percentages'][i, j]) for j, m in enumerate(MACROS)},
+        'variety_metrics': {
+            'unique_recipes': int(stats['unique_recipes'][i]),
+            'total_meals': int(stats['total_meals'][i]),
+            'variety_score': float(stats['variety_score'][i])
+        },
+        'meal_coverage': float(stats['meal_coverage'][i])
+    }
+    if 'calorie_target' in stats and stats['calorie_target'][i]:
+        analysis['calorie_target'] = float(stats['calorie_target'][i])
+        analysis['calorie_deviation_pct'] = float(stats['calorie_deviation_pct'][i])
+    return analysis
+
+
+def summarize(stats, groups=None):
+    # Caseload/history aggregate: mean of the per-plan figures over plans that
+    # have days, overall or per group label (e.g. user id)
+    if groups is None:
+        labels, inverse = [None], np.zeros(len(stats['days']), dtype=np.int64)
+    else:
+        labels, inverse = np.unique(np.asarray(groups).astype(str), return_inverse=True)
+    k = len(labels)
+    valid = (stats['days'] > 0).astype(np.float64)
+    n_valid = np.bincount(inverse, weights=valid, minlength=k)
+
+    def group_mean(values):
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64).reshape(len(valid), -1)) * valid[:, None]
+        sums = np.stack([np.bincount(inverse, weights=col, minlength=k) for col in values.T], axis=1)
+        return _ratio(sums, n_valid[:, None])
+
+    avg = group_mean(stats['avg_nutrition'])
+    macro = group_mean(stats['macro_percentages'])
+    variety = group_mean(stats['variety_score'])[:, 0]
+    coverage = group_mean(stats['meal_coverage'])[:, 0]
+    plans = np.bincount(inverse, minlength=k)
+    days = np.bincount(inverse, weights=stats['days'], minlength=k)
+    summaries = []
+    for g, label in enumerate(labels):
+        summary = {
+            'plans': int(plans[g]),
+            'days': int(days[g]),
+            'avg_nutrition': {n: float(avg[g, j]) for j, n in enumerate(NUTRIENTS)},
+            'macro_percentages': {f'{m}_pct': float(macro[g, j]) for j, m in enumerate(MACROS)},
+            'variety_score': float(variety[g]),
+            'meal_coverage': float(coverage[g])
+        }
+        if label is not None:
+            summary['group'] = str(label)
+        summaries.append(summary)
+    return summaries[0] if groups is None else summaries
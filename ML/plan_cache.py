@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from user_features import CATEGORICAL_COLS, NUMERICAL_COLS, user_model_inputs
+
+logger = logging.getLogger(__name__)
+
+# --- Per-user cluster assignment and candidate pool cache ---
+# Plans are regenerated often with unchanged health parameters. The model
+# inputs of a request are canonicalized into a stable hash; the cluster it
+# maps to is memoized per model version and the candidate pool per
+# (cluster, restrictions) for a model + catalog version, so a repeat request
+# goes straight to the randomized selection. Cluster assignments can also be
+# kept in a SQLite file shared by the worker processes of a node; pools hold
+# catalog positions of one process's snapshot and stay in-process.
+
+
+class TTLCache:
+    # Bounded LRU whose entries also expire ttl seconds after being stored
+    def __init__(self, max_entries=10000, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedClusterStore:
+    # user key -> cluster for one model version, in a local SQLite file
+    def __init__(self, path, ttl=3600.0):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS clusters ('
+                         'key TEXT, model_version TEXT, cluster INTEGER, expires_at REAL, '
+                         'PRIMARY KEY (key, model_version))')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, model_version):
+        row = self._connect().execute(
+            'SELECT cluster FROM clusters WHERE key = ? AND model_version = ? AND expires_at > ?',
+            (key, model_version, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, model_version, cluster):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?)',
+                         (key, model_version, int(cluster), time.time() + self.ttl))
+
+    def purge(self, model_version):
+        # Drops assignments made by other model versions and expired ones
+        with self._connect() as conn:
+            conn.execute('DELETE FROM clusters WHERE model_version != ? OR expires_at <= ?',
+                         (model_version, time.time()))
+
+
+def user_key(user_params, categorical_cols=CATEGORICAL_COLS, numerical_cols=NUMERICAL_COLS):
+    # Stable hash of the model inputs only: key order, ints vs floats
+    # (70 / 70.0 / "70") and unrelated fields don't change it. Categoricals
+    # are filled as prepare_user_frame fills them.
+    numericals, categoricals = user_model_inputs(user_params, categorical_cols, numerical_cols)
+    canonical = {}
+    for col, value in zip(numerical_cols, numericals):
+        try:
+            value = float(value)
+            canonical[col] = None if math.isnan(value) else value
+        except (TypeError, ValueError):
+            canonical[col] = str(value)
+    canonical.update(zip(categorical_cols, categoricals))
+    payload = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class PlanCache:
+    def __init__(self, max_entries=10000, ttl=3600.0, shared_path=None, max_pools=512):
+        self.clusters = TTLCache(max_entries, ttl)
+        self.pools = TTLCache(max_pools, ttl)
+        self.shared = None
+        if shared_path:
+            try:
+                self.shared = SharedClusterStore(shared_path, ttl)
+            except sqlite3.Error as e:
+                logger.warning('Shared plan cache disabled (%s): %s', shared_path, e)
+        self._seen_versions = set()
+
+    def _check_version(self, model_version):
+        # Entries are keyed by version, so a hot swap needs no clearing here;
+        # the shared file drops other versions' rows once per new version
+        if model_version not in self._seen_versions:
+            self._seen_versions.add(model_version)
+            if self.shared is not None:
+                try:
+                    self.shared.purge(model_version)
+                except sqlite3.Error as e:
+                    logger.warning('Could not purge shared plan cache: %s', e)
+
+    def cached_cluster(self, key, model_version):
+        self._check_version(model_version)
+        cluster = self.clusters.get((model_version, key))
+        if cluster is None and self.shared is not None:
+            try:
+                cluster = self.shared.get(key, model_version)
+            except sqlite3.Error:
+                cluster = None
+            if cluster is not None:
+                self.clusters.put((model_version, key), cluster)
+        return cluster
+
+    def store_cluster(self, key, model_version, cluster):
+        self._check_version(model_version)
+        cluster = int(cluster)
+        self.clusters.put((model_version, key), cluster)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, model_version, cluster)
+            except sqlite3.Error as e:
+                logger.warning('Could not write shared plan cache: %s', e)
+        return cluster
+
+    def cluster(self, key, model_version, compute):
+        cluster = self.cached_cluster(key, model_version)
+        if cluster is None:
+            cluster = self.store_cluster(key, model_version, compute())
+        return cluster
+
+    def pool(self, cluster, rule_names, model_version, catalog_version, compute):
+        key = (model_version, catalog_version, int(cluster), tuple(sorted(set(rule_names))))
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = compute()
+            self.pools.put(key, pool)
+        return pool
+
+    def clear(self):
+        self.clusters.clear()
+        self.pools.clear()
+
+    def stats(self):
+        return {
+            'clusters': {'entries': len(self.clusters), 'hits': self.clusters.hits, 'misses': self.clusters.misses},
+            'pools': {'entries': len(self.pools), 'hits': self.pools.hits, 'misses': self.pools.misses},
+            'shared': self.shared.path if self.shared is not None else None
+        }
@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from scoring import build_recipe_features
+
+logger = logging.getLogger(__name__)
+
+# --- Process-wide recipe catalog ---
+# The recipes collection is scanned once and kept in memory as column arrays.
+# Later reads only pick up what changed, through a change stream when the
+# server supports one (replica sets) or an `updated_at` watermark poll otherwise.
+
+# Seeded watermarks start this far before the load so writes stamped by an
+# app server whose clock runs slightly behind ours are not skipped
+WATERMARK_SKEW = timedelta(minutes=5)
+
+
+def normalize_text(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return ' '.join(str(v) for v in value).lower()
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    return str(value).lower()
+
+
+class CatalogSnapshot:
+    # Immutable view of the catalog at one version; a refresh builds a new one
+    def __init__(self, version, recipes_df):
+        self.version = version
+        self.recipes_df = recipes_df
+        self.ids = recipes_df['_id'].to_numpy(dtype=object) if '_id' in recipes_df else np.arange(len(recipes_df)).astype(str).astype(object)
+        self.columns = {col: recipes_df[col].to_numpy() for col in recipes_df.columns}
+        self.features = build_recipe_features(recipes_df)
+        self.meal_types = recipes_df['meal_type'].fillna('').astype(str).str.lower().to_numpy(dtype=object) if 'meal_type' in recipes_df else np.full(len(recipes_df), '', dtype=object)
+        self.names_text = np.array([normalize_text(v) for v in self.columns.get('name', [''] * len(recipes_df))], dtype=object)
+        self.ingredients_text = np.array([normalize_text(v) for v in self.columns.get('ingredients', [''] * len(recipes_df))], dtype=object)
+        self.positions = {recipe_id: i for i, recipe_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.recipes_df)
+
+
+class RecipeCatalog:
+    def __init__(self, collection, refresh_interval=30, full_reload_interval=3600, watermark_field='updated_at'):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.watermark_field = watermark_field
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._snapshot = None
+        self._version = 0
+        self._stream = None
+        self._watermark = None
+        self._stale = True
+        self._last_refresh = 0.0
+        self._last_full_load = 0.0
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    @property
+    def size(self):
+        # Recipes in the loaded snapshot, without triggering a refresh
+        return len(self._snapshot) if self._snapshot is not None else 0
+
+    def rebind(self, collection):
+        # Points the catalog at another client's collection (a forked worker
+        # must not reuse the parent's connections). The loaded snapshot is
+        # kept; the parent's change stream is dropped without closing it, so
+        # refreshes poll until the next full load opens a stream again.
+        with self._lock:
+            self.collection = collection
+            self._stream = None
+
+    def invalidate(self):
+        # Forces a full reload on the next snapshot() call
+        self._stale = True
+
+    def snapshot(self):
+        now = time.monotonic()
+        if self._stale or self._snapshot is None or now - self._last_refresh >= self.refresh_interval:
+            with self._lock:
+                now = time.monotonic()
+                if self._stale or self._snapshot is None or now - self._last_full_load >= self.full_reload_interval:
+                    self._full_load()
+                elif now - self._last_refresh >= self.refresh_interval:
+                    self._refresh()
+        return self._snapshot
+
+    # --- Loading ---
+    def _full_load(self):
+        self._stale = False
+        self._close_stream()
+        # Open the stream before scanning so no change between the two is lost
+        self._stream = self._open_stream()
+        loaded_at = self._load_time()
+        docs = {}
+        for doc in self.collection.find({}):
+            doc = self._clean(doc)
+            docs[doc['_id']] = doc
+        self._docs = docs
+        # Documents stored before they carried a watermark field would leave
+        # nothing to poll from, so the watermark is at least the load time
+        latest = self._max_watermark(docs.values())
+        self._watermark = loaded_at if latest is None or (isinstance(latest, datetime) and latest < loaded_at) else latest
+        self._publish()
+        self._last_full_load = self._last_refresh = time.monotonic()
+        logger.info('Loaded %d recipes into catalog (version %d)', len(docs), self._version)
+
+    def _refresh(self):
+        if self._stream is not None:
+            changed = self._drain_stream()
+        else:
+            changed = self._poll()
+        self._last_refresh = time.monotonic()
+        if changed:
+            self._publish()
+
+    def _drain_stream(self):
+        changed = False
+        try:
+            while True:
+                change = self._stream.try_next()
+                if change is None:
+                    break
+                op = change.get('operationType')
+                doc_id = str(change.get('documentKey', {}).get('_id'))
+                if op == 'delete':
+                    changed = self._docs.pop(doc_id, None) is not None or changed
+                elif op in ('insert', 'update', 'replace') and change.get('fullDocument') is not None:
+                    doc = self._clean(change['fullDocument'])
+                    self._docs[doc['_id']] = doc
+                    changed = True
+                elif op in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                    self._stale = True
+                    break
+        except Exception as e:
+            logger.warning('Recipe change stream failed, falling back to full reload: %s', e)
+            self._close_stream()
+            self._stale = True
+        if self._stale:
+            self._full_load()
+            return False
+        return changed
+
+    def _poll(self):
+        changed = False
+        if self._watermark is not None:
+            updated = [self._clean(doc) for doc in self.collection.find({self.watermark_field: {'$gt': self._watermark}})]
+            for doc in updated:
+                self._docs[doc['_id']] = doc
+            if updated:
+                self._watermark = max(self._watermark, self._max_watermark(updated))
+                changed = True
+        # Deletes (and inserts without a watermark) only show up as a count change
+        if self.collection.count_documents({}) != len(self._docs):
+            self._full_load()
+            return False
+        return changed
+
+    def _publish(self):
+        self._version += 1
+        recipes_df = pd.DataFrame(list(self._docs.values()))
+        self._snapshot = CatalogSnapshot(self._version, recipes_df)
+
+    # --- Helpers ---
+    def _open_stream(self):
+        watch = getattr(self.collection, 'watch', None)
+        if watch is None:
+            return None
+        try:
+            return watch(full_document='updateLookup')
+        except Exception:
+            # Standalone servers and in-memory stand-ins have no change streams
+            return None
+
+    def _close_stream(self):
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+        self._stream = None
+
+    def _load_time(self):
+        # Same kind of datetime the driver returns (naive UTC unless tz_aware)
+        now = datetime.now(timezone.utc) - WATERMARK_SKEW
+        options = getattr(self.collection, 'codec_options', None)
+        return now if getattr(options, 'tz_aware', False) else now.replace(tzinfo=None)
+
+    def _max_watermark(self, docs):
+        values = [doc[self.watermark_field] for doc in docs if doc.get(self.watermark_field) is not None]
+        return max(values) if values else None
+
+    @staticmethod
+    def _clean(doc):
+        doc = dict(doc)
+        if '_id' in doc:
+            doc['_id'] = str(doc['_id'])
+        return doc
@@ -0,0 +1,105 @@
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from dietary_rules import TOKEN_RE
+from meal_optimizer import NUTRIENTS
+
+# --- Recipe similarity for meal swaps ---
+# Built once per catalog snapshot. Each recipe gets a standardized macro
+# profile (log calories, then protein/carbs/fat/sodium/fiber per 100 kcal, so
+# a swap that is re-portioned to the same calories keeps the same balance)
+# and a set of ingredient tokens in an inverted index. A query scores one
+# recipe against a candidate set with one small matrix-vector product for
+# the macro distance and one bincount over the query's postings for the
+# ingredient overlap (cosine of the token sets).
+
+# Tokens too common in ingredient lists to say anything about a recipe
+STOP_TOKENS = frozenset({'and', 'with', 'the', 'for', 'salt', 'pepper', 'water', 'oil', 'fresh', 'chopped',
+                         'sliced', 'diced', 'taste', 'cup', 'cups', 'tbsp', 'tsp', 'optional'})
+
+
+def ingredient_tokens(text):
+    return frozenset(t for t in TOKEN_RE.findall(text) if len(t) > 2 and t not in STOP_TOKENS)
+
+
+class SimilarityIndex:
+    def __init__(self, catalog):
+        self.version = catalog.version
+        n = len(catalog)
+        self.n = n
+        nutrients = np.zeros((n, len(NUTRIENTS)), dtype=np.float64)
+        for j, col in enumerate(NUTRIENTS):
+            if col in catalog.columns:
+                nutrients[:, j] = catalog.columns[col]
+        nutrients = np.maximum(np.nan_to_num(nutrients), 0.0)
+        calories = nutrients[:, 0]
+        per_100_kcal = nutrients[:, 1:] * (100.0 / np.where(calories > 0, calories, np.inf))[:, None]
+        profile = np.column_stack([np.log1p(calories), per_100_kcal])
+        std = profile.std(axis=0) if n else np.ones(profile.shape[1])
+        std[std == 0] = 1.0
+        # Scaled so the euclidean distance is the RMS of the per-nutrient z-score gaps
+        self.vectors = (profile - profile.mean(axis=0)) / std / np.sqrt(profile.shape[1]) if n else profile
+        self.sq_norms = (self.vectors * self.vectors).sum(axis=1)
+        self.tokens = [ingredient_tokens(text) for text in catalog.ingredients_text]
+        postings = defaultdict(list)
+        for pos, tokens in enumerate(self.tokens):
+            for token in tokens:
+                postings[token].append(pos)
+        self.postings = {token: np.array(positions, dtype=np.int64) for token, positions in postings.items()}
+        self.token_counts = np.array([len(tokens) for tokens in self.tokens], dtype=np.float64)
+        self.catalog_positions = catalog.positions
+        self.names = {}
+        for pos, name in enumerate(catalog.names_text):
+            self.names.setdefault(name.strip(), pos)
+
+    def find(self, recipe_id=None, name=None):
+        # Catalog position of a recipe by _id or (case-insensitive) name
+        if recipe_id is not None and str(recipe_id) in self.catalog_positions:
+            return self.catalog_positions[str(recipe_id)]
+        if isinstance(name, str):
+            return self.names.get(name.strip().lower())
+        return None
+
+    def similar(self, position, candidates, k=5, macro_weight=0.7):
+        # Ranks catalog positions `candidates` by similarity to `position`.
+        # Returns (indices into candidates, score, macro similarity,
+        # ingredient similarity), best first; the recipe itself is skipped.
+        candidates = np.asarray(candidates, dtype=np.int64)
+        keep = np.flatnonzero(candidates != position)
+        if len(keep) == 0 or k <= 0:
+            empty = np.zeros(0)
+            return keep, empty, empty, empty
+        rows = candidates[keep]
+        query = self.vectors[position]
+        d2 = self.sq_norms[rows] + self.sq_norms[position] - 2.0 * (self.vectors[rows] @ query)
+        macro = 1.0 / (1.0 + np.sqrt(np.maximum(d2, 0.0)))
+        query_tokens = self.tokens[position]
+        if query_tokens:
+            overlap = np.bincount(np.concatenate([self.postings[t] for t in query_tokens]), minlength=self.n)
+            ingredients = overlap[rows] / np.sqrt(len(query_tokens) * np.maximum(self.token_counts[rows], 1.0))
+        else:
+            ingredients = np.zeros(len(rows))
+        score = macro_weight * macro + (1.0 - macro_weight) * ingredients
+        top = np.argpartition(-score, k - 1)[:k] if len(score) > k else np.arange(len(score))
+        top = top[np.lexsort((rows[top], -score[top]))]
+        return keep[top], score[top], macro[top], ingredients[top]
+
+
+class RecipeSimilarity:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cached = None
+
+    def index_for(self, catalog):
+        # One index per catalog snapshot version
+        cached = self._cached
+        if cached is not None and cached.version == catalog.version:
+            return cached
+        with self._lock:
+            cached = self._cached
+            if cached is None or cached.version != catalog.version:
+                cached = SimilarityIndex(catalog)
+                self._cached = cached
+        return cached
@@ -0,0 +1,297 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# --- Background retraining jobs ---
+# Training runs in a separate worker process so the serving process keeps its
+# CPU for plan generation. The worker reports stage transitions over a queue
+# and the parent keeps the job records that /api/retrain_jobs/<id> serves.
+# With several serving processes the records are also written to a shared
+# store, so any of them can answer for a job another one started, and a
+# retrain is claimed in that store before it starts so only one process runs
+# it.
+
+ACTIVE_STATES = ('queued', 'running')
+# A claim whose record has not been written for this long belongs to a
+# process that died mid-job and may be taken over
+CLAIM_TTL = 4 * 3600
+
+_progress_queue = None
+
+
+def _init_worker(progress_queue, niceness):
+    global _progress_queue
+    _progress_queue = progress_queue
+    # Training yields the CPU to serving workers on the same node
+    if niceness and hasattr(os, 'nice'):
+        os.nice(niceness)
+
+
+def _run_job(job_id, target, args):
+    # Stage transitions are streamed to the parent for live progress and also
+    # returned with the result, which is the authoritative timeline
+    stages = []
+
+    def progress(stage):
+        at = time.time()
+        stages.append((stage, at))
+        _progress_queue.put((job_id, stage, at))
+
+    _progress_queue.put((job_id, 'started', time.time()))
+    result = target(*args, progress=progress)
+    stages.append((None, time.time()))
+    return result, stages
+
+
+class StageTimer:
+    # Progress callback that also keeps wall-clock seconds per stage, for the
+    # model_metrics record
+    def __init__(self, progress=None):
+        self.progress = progress or (lambda stage: None)
+        self._stages = []
+
+    def __call__(self, stage):
+        self._stages.append((stage, time.perf_counter()))
+        self.progress(stage)
+
+    def timings(self):
+        now = time.perf_counter()
+        ends = [at for _, at in self._stages[1:]] + [now]
+        timings = {}
+        for (stage, start), end in zip(self._stages, ends):
+            timings[stage] = round(timings.get(stage, 0.0) + end - start, 3)
+        return timings
+
+
+class RetrainJob:
+    def __init__(self, job_id, key):
+        self.id = job_id
+        self.key = key
+        self.status = 'queued'
+        self.stage = None
+        self.stages = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+
+    def enter_stage(self, stage, at):
+        if self.stages and self.stages[-1]['finished_at'] is None:
+            self.stages[-1]['finished_at'] = at
+            self.stages[-1]['seconds'] = round(at - self.stages[-1]['started_at'], 3)
+        if stage is not None:
+            self.stages.append({'stage': stage, 'started_at': at, 'finished_at': None, 'seconds': None})
+        self.stage = stage
+
+    @classmethod
+    def from_dict(cls, record):
+        job = cls(record['job_id'], None)
+        for field in ('status', 'stage', 'stages', 'created_at', 'started_at', 'finished_at', 'result', 'error'):
+            setattr(job, field, record.get(field))
+        return job
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': self.stages,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed_seconds': round((self.finished_at or time.time()) - (self.started_at or self.created_at), 3),
+            'result': self.result,
+            'error': self.error
+        }
+
+
+class MongoJobStore:
+    # Records of queued and running jobs carry `active_key`; a unique sparse
+    # index on it lets one process at a time hold a job for each key
+    def __init__(self, collection, claim_ttl=CLAIM_TTL):
+        self.collection = collection
+        self.claim_ttl = claim_ttl
+        self._indexed = False
+
+    def claim(self, record):
+        # Inserts record unless another process holds an active job for its
+        # active_key. Returns None when claimed, the holder's record otherwise.
+        if not self._indexed:
+            self.collection.create_index('active_key', unique=True, sparse=True)
+            self._indexed = True
+        for _ in range(3):
+            try:
+                self.collection.insert_one(dict(record))
+                return None
+            except DuplicateKeyError:
+                pass
+            holder = self.collection.find_one({'active_key': record['active_key']}, {'_id': 0})
+            if holder is None:
+                continue  # released in the meantime
+            if time.time() - holder.get('updated_at', holder['created_at']) < self.claim_ttl:
+                return holder
+            self.collection.update_one(
+                {'job_id': holder['job_id'], 'active_key': record['active_key']},
+                {'$set': {'status': 'failed', 'error': 'Abandoned by the process that ran it'},
+                 '$unset': {'active_key': ''}})
+        raise RuntimeError(f"Could not claim retrain job key {record['active_key']}")
+
+    def save(self, record):
+        self.collection.replace_one({'job_id': record['job_id']}, record, upsert=True)
+
+    def load(self, job_id):
+        return self.collection.find_one({'job_id': job_id}, {'_id': 0})
+
+    def recent(self, limit):
+        return list(self.collection.find({}, {'_id': 0}).sort('created_at', -1).limit(limit))
+
+
+class RetrainJobManager:
+    def __init__(self, max_workers=1, on_success=None, history=50, niceness=10, store=None):
+        self.max_workers = max_workers
+        self.niceness = niceness
+        self.on_success = on_success
+        self.history = history
+        self.store = store
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._queue = None
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            self._queue = multiprocessing.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(self._queue, self.niceness)
+            )
+            threading.Thread(target=self._drain_progress, daemon=True).start()
+
+    def submit(self, target, args=(), key=None):
+        # A retrain with the same key that is still queued or running, here or
+        # in another process sharing the store, is returned instead of
+        # starting a duplicate
+        with self._lock:
+            for job in self._jobs.values():
+                if job.key == key and job.status in ACTIVE_STATES:
+                    return job, True
+            job = RetrainJob(uuid.uuid4().hex, key)
+            holder = self._claim(job)
+            if holder is not None:
+                return RetrainJob.from_dict(holder), True
+            self._ensure_executor()
+            self._jobs[job.id] = job
+            self._prune()
+            future = self._executor.submit(_run_job, job.id, target, args)
+            self._persist(job)
+        future.add_done_callback(lambda f, job=job: self._finish(job, f))
+        return job, False
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            try:
+                record = self.store.load(job_id)
+            except Exception as e:
+                logger.warning('Could not read retrain job %s from the job store: %s', job_id, e)
+                record = None
+            job = RetrainJob.from_dict(record) if record else None
+        return job
+
+    def list(self):
+        jobs = dict(self._jobs)
+        if self.store is not None:
+            try:
+                for record in self.store.recent(self.history):
+                    jobs.setdefault(record['job_id'], RetrainJob.from_dict(record))
+            except Exception as e:
+                logger.warning('Could not list retrain jobs from the job store: %s', e)
+        return sorted(jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def _record(self, job):
+        # Store form of a job; active_key is dropped once it finishes, which
+        # releases the claim
+        record = job.to_dict()
+        record['updated_at'] = time.time()
+        if job.key is not None and job.status in ACTIVE_STATES:
+            record['active_key'] = json.dumps(job.key, default=str)
+        return record
+
+    def _claim(self, job):
+        if self.store is None or job.key is None:
+            return None
+        try:
+            return self.store.claim(self._record(job))
+        except Exception as e:
+            logger.warning('Could not claim retrain job %s in the job store, running it here: %s', job.id, e)
+            return None
+
+    def _persist(self, job):
+        if self.store is None:
+            return
+        try:
+            self.store.save(self._record(job))
+        except Exception as e:
+            logger.warning('Could not write retrain job %s to the job store: %s', job.id, e)
+
+    def _drain_progress(self):
+        while True:
+            try:
+                job_id, stage, at = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.status not in ACTIVE_STATES:
+                    continue
+                if stage == 'started':
+                    job.status = 'running'
+                    job.started_at = at
+                else:
+                    job.enter_stage(stage, at)
+                self._persist(job)
+
+    def _finish(self, job, future):
+        stages = None
+        try:
+            result, stages = future.result()
+            if self.on_success is not None:
+                result = self.on_success(job, result)
+            status, error = 'succeeded', None
+        except Exception as e:
+            logger.exception('Retrain job %s failed', job.id)
+            result, status, error = None, 'failed', str(e)
+        with self._lock:
+            now = time.time()
+            if stages is not None:
+                job.stages = []
+                for stage, at in stages:
+                    job.enter_stage(stage, at)
+            job.enter_stage(None, now)
+            job.result = result
+            job.error = error
+            job.status = status
+            job.finished_at = now
+            if job.started_at is None:
+                job.started_at = now
+            self._persist(job)
+
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if job.status not in ACTIVE_STATES),
+                          key=lambda job: job.created_at, reverse=True)
+        for job in finished[self.history:]:
+            del self._jobs[job.id]
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+# --- Recipe feature layout shared by training and serving ---
+# [calories, protein, carbs, fat, sodium, fiber, cluster, is_breakfast, is_lunch, is_dinner]
+NUTRIENT_COLS = ['calories', 'protein', 'carbs', 'fat', 'sodium', 'fiber']
+MEAL_TYPES = ['breakfast', 'lunch', 'dinner']
+CLUSTER_COL = len(NUTRIENT_COLS)
+N_FEATURES = len(NUTRIENT_COLS) + 1 + len(MEAL_TYPES)
+
+
+def meal_type_one_hot(meal_types):
+    meal_types = pd.Series(meal_types, dtype=object).fillna('').astype(str).str.lower().to_numpy()
+    return np.stack([(meal_types == mt) for mt in MEAL_TYPES], axis=1).astype(float)
+
+
+def build_recipe_features(recipes_df):
+    # Cluster-independent part of the feature matrix; the cluster column is left at 0
+    n = len(recipes_df)
+    features = np.zeros((n, N_FEATURES), dtype=float)
+    if n == 0:
+        return features
+    features[:, :CLUSTER_COL] = recipes_df[NUTRIENT_COLS].to_numpy(dtype=float)
+    meal_types = recipes_df['meal_type'] if 'meal_type' in recipes_df else [''] * n
+    features[:, CLUSTER_COL + 1:] = meal_type_one_hot(meal_types)
+    return features
+
+
+def cross_join_features(recipe_features, cluster_ids):
+    # Cluster-major stacking: all recipes for cluster_ids[0], then cluster_ids[1], ...
+    cluster_ids = np.asarray(cluster_ids)
+    features = np.tile(recipe_features, (len(cluster_ids), 1))
+    features[:, CLUSTER_COL] = np.repeat(cluster_ids, len(recipe_features))
+    return features
+
+
+def build_training_set(cluster_analysis, recipes_df, rule_index):
+    # Cross-join of cluster profiles and recipes; labels are the rule engine's
+    # allowed mask for each cluster profile
+    X = cross_join_features(build_recipe_features(recipes_df), cluster_analysis.index.to_numpy())
+    y = np.concatenate([rule_index.allowed_mask(profile).astype(int) for _, profile in cluster_analysis.iterrows()]) if len(cluster_analysis) else np.zeros(0, dtype=int)
+    return X, y
+
+
+def positive_class_index(rf_model):
+    return list(rf_model.classes_).index(1)
+
@@ -0,0 +1,46 @@
+import json
+import logging
+import os
+import sys
+import time
+
+# --- Structured logging for the ML service ---
+# One JSON object per line on stderr. Extra fields passed with
+# logger.info(..., extra={...}) are added to the object as they are, so
+# request timings and job ids can be filtered on without parsing messages.
+
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, json_format=None):
+    # LOG_LEVEL (default INFO) and LOG_FORMAT=json|text; json unless stderr is a terminal
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    if json_format is None:
+        json_format = os.environ.get('LOG_FORMAT', 'text' if sys.stderr.isatty() else 'json') == 'json'
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s')
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
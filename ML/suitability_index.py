@@ -0,0 +1,78 @@
+import logging
+import threading
+
+import numpy as np
+
+from instrumentation import count
+from scoring import cross_join_features, positive_class_index
+
+logger = logging.getLogger(__name__)
+
+# --- Precomputed cluster x recipe suitability ---
+# The RF output only depends on (cluster, recipe), so it is evaluated once per
+# catalog version for every cluster and served from arrays afterwards.
+
+
+class SuitabilityState:
+    def __init__(self, catalog_version, ids, features, probabilities, suitable):
+        self.catalog_version = catalog_version
+        self.ids = ids
+        self.features = features
+        self.probabilities = probabilities  # (clusters, recipes) float32
+        self.suitable = suitable  # (clusters, recipes) bool
+        self.positions = {recipe_id: i for i, recipe_id in enumerate(ids)}
+
+
+class SuitabilityIndex:
+    def __init__(self, rf_model, n_clusters):
+        self.rf_model = rf_model
+        self.n_clusters = n_clusters
+        self._state = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def sync(self, catalog):
+        state = self._state
+        if state is not None and state.catalog_version == catalog.version:
+            return state
+        with self._lock:
+            state = self._state
+            if state is None or state.catalog_version != catalog.version:
+                state = self._build(catalog, state)
+                self._state = state
+        return state
+
+    def _build(self, catalog, previous):
+        n = len(catalog)
+        probabilities = np.zeros((self.n_clusters, n), dtype=np.float32)
+        suitable = np.zeros((self.n_clusters, n), dtype=bool)
+        stale = np.ones(n, dtype=bool)
+        if previous is not None and n:
+            # Reuse columns of recipes whose features did not change
+            old_pos = np.array([previous.positions.get(recipe_id, -1) for recipe_id in catalog.ids], dtype=int)
+            known = old_pos >= 0
+            same = np.zeros(n, dtype=bool)
+            same[known] = (previous.features[old_pos[known]] == catalog.features[known]).all(axis=1)
+            probabilities[:, same] = previous.probabilities[:, old_pos[same]]
+            suitable[:, same] = previous.suitable[:, old_pos[same]]
+            stale = ~same
+        count('recipes_rescored', stale.sum())
+        count('rf_rows_scored', stale.sum() * self.n_clusters)
+        if stale.any():
+            probs, preds = self._score(catalog.features[stale])
+            probabilities[:, stale] = probs
+            suitable[:, stale] = preds
+        logger.info('Suitability index built for catalog version %s: %d of %d recipes scored', catalog.version, int(stale.sum()), n)
+        return SuitabilityState(catalog.version, catalog.ids, catalog.features, probabilities, suitable)
+
+    def _score(self, recipe_features):
+        # One predict_proba call over every (cluster, recipe) pair
+        m = len(recipe_features)
+        features = cross_join_features(recipe_features, np.arange(self.n_clusters))
+        proba = self.rf_model.predict_proba(features)
+        predictions = self.rf_model.classes_[np.argmax(proba, axis=1)] == 1
+        positive = proba[:, positive_class_index(self.rf_model)]
+        return positive.reshape(self.n_clusters, m), predictions.reshape(self.n_clusters, m)
@@ -0,0 +1,74 @@
+import hashlib
+import logging
+import os
+import pickle
+import uuid
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# --- Fitted preprocessing cache for retraining ---
+# Fitting the scaler/encoder and transforming every user row is repeated on
+# each retrain even when the user data hasn't changed (only recipes were
+# uploaded, or a retrain was re-run). The fitted pipeline and its output are
+# stored under the hash of the model input columns and reused on a match.
+
+CACHE_DIR = os.path.join('data', 'cache', 'preprocessing')
+
+
+def dataset_hash(df, columns, salt=''):
+    hasher = hashlib.sha1(salt.encode())
+    hasher.update(repr(list(columns)).encode())
+    hasher.update(pd.util.hash_pandas_object(df[list(columns)], index=False).to_numpy().tobytes())
+    return hasher.hexdigest()
+
+
+class PreprocessingCache:
+    def __init__(self, directory=CACHE_DIR, max_entries=3):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('Ignoring unreadable preprocessing cache entry %s: %s', key, e)
+            return None
+        os.utime(self._path(key))
+        return entry
+
+    def put(self, key, pipeline, output):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f'{self._path(key)}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((pipeline, output), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        self._prune()
+
+    def fit_transform(self, key, pipeline, df):
+        # Returns (fitted pipeline, transformed df, cache hit)
+        entry = self.get(key)
+        if entry is not None:
+            return entry[0], entry[1], True
+        output = pipeline.fit_transform(df)
+        try:
+            self.put(key, pipeline, output)
+        except OSError as e:
+            logger.warning('Could not write preprocessing cache entry %s: %s', key, e)
+        return pipeline, output, False
+
+    def _prune(self):
+        entries = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith('.pkl')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[self.max_entries:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,32 @@
+# --- Custom transformer class needed for loading the model ---
+# Pickles written before this module existed reference it as
+# __main__.HealthPriorityTransformer; model_registry maps that name here.
+# It implements the estimator protocol itself instead of deriving from
+# sklearn's base classes, so serving processes can import it without
+# loading scikit-learn.
+class HealthPriorityTransformer:
+    def __init__(self, high_cols=None, medium_cols=None, low_cols=None):
+        self.high_cols = high_cols or []
+        self.medium_cols = medium_cols or []
+        self.low_cols = low_cols or []
+    def get_params(self, deep=True):
+        return {'high_cols': self.high_cols, 'medium_cols': self.medium_cols, 'low_cols': self.low_cols}
+    def set_params(self, **params):
+        for name, value in params.items():
+            if name not in ('high_cols', 'medium_cols', 'low_cols'):
+                raise ValueError(f'Invalid parameter {name!r} for HealthPriorityTransformer')
+            setattr(self, name, value)
+        return self
+    def fit(self, X, y=None):
+        return self
+    def transform(self, X):
+        return X
+    def fit_transform(self, X, y=None, **fit_params):
+        return self.fit(X, y).transform(X)
+    def __sklearn_is_fitted__(self):
+        # Stateless: usable without fit, as Pipeline.transform requires of its last step
+        return True
+    def __sklearn_tags__(self):
+        # Only scikit-learn calls this, so importing it here costs nothing
+        from sklearn.utils import Tags, TargetTags, TransformerTags
+        return Tags(estimator_type=None, target_tags=TargetTags(required=False), transformer_tags=TransformerTags())
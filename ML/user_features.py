@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# --- User parameter preparation shared by training and serving ---
+
+# Model input columns of the user parameter CSVs
+CATEGORICAL_COLS = [
+    'Diabetes', 'Hypertension', 'Cardiovascular', 'Digestive Disorders',
+    'Food Allergies', 'BMI Category', 'Weight Change History', 'Exercise Type',
+    'Physical Job Activity Level', 'Work Schedule', 'Sleep Quality', 'Stress Level',
+    'Meal Timing Regularity', 'Cooking Skills', 'Food Budget', 'Alcohol Consumption',
+    'Smoking Status', 'Snacking Behavior', 'Travel Frequency', 'Diet Type',
+    'Meal Size Preference', 'Spice Tolerance', 'Cuisine Preferences',
+    'Food Texture Preferences', 'Portion Control Ability', 'Previous Diet Success History',
+    'Food Intolerances', 'Meal Complexity Preference', 'Seasonal Diet Preference'
+]
+
+NUMERICAL_COLS = [
+    'Height (cm)', 'Weight (kg)', 'Target Weight (kg)', 'Exercise Frequency',
+    'Exercise Duration (min)', 'Daily Steps Count', 'Sleep Duration (hrs)',
+    'Available Cooking Time (min)', 'Water Intake (cups)', 'Eating Out Frequency',
+    'Food Prep Time Availability (min)'
+]
+
+# Missing values mean "no condition" for these columns (same defaults the
+# training data is filled with)
+USER_DEFAULTS = {
+    'Diabetes': 'None',
+    'Digestive Disorders': 'None',
+    'Food Allergies': 'None',
+    'Food Intolerances': 'None',
+    'Exercise Type': 'Unknown',
+    'Alcohol Consumption': 'None',
+    'Hypertension': 'No',
+    'Cardiovascular': 'Absent'
+}
+
+
+def fill_user_defaults(user_df):
+    for col, default in USER_DEFAULTS.items():
+        if col in user_df.columns:
+            user_df[col] = user_df[col].fillna(default)
+    return user_df
+
+
+def prepare_user_frame(user_records, categorical_cols):
+    # One row per user; every categorical column present and a string
+    if isinstance(user_records, pd.DataFrame):
+        user_df = user_records.copy()
+    else:
+        user_df = pd.DataFrame(list(user_records))
+    fill_user_defaults(user_df)
+    for col in categorical_cols:
+        if col not in user_df.columns:
+            user_df[col] = 'Unknown'
+        else:
+            user_df[col] = user_df[col].fillna('Unknown').astype(str)
+    return user_df
+
+
+def user_model_inputs(user_params, categorical_cols=CATEGORICAL_COLS, numerical_cols=NUMERICAL_COLS):
+    # One user's model inputs without building a DataFrame, filled exactly as
+    # prepare_user_frame fills a single-row frame: a missing key becomes
+    # 'Unknown', an explicit null the USER_DEFAULTS value, anything else str()
+    categoricals = []
+    for col in categorical_cols:
+        if col not in user_params:
+            categoricals.append('Unknown')
+            continue
+        value = user_params[col]
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            value = USER_DEFAULTS.get(col, 'Unknown')
+        categoricals.append(str(value))
+    numericals = [user_params.get(col) for col in numerical_cols]
+    return numericals, categoricals
+
+
+def assign_clusters(user_df, preprocessing_pipeline, pca, kmeans_model):
+    user_features = preprocessing_pipeline.transform(user_df)
+    user_reduced = pca.transform(user_features)
+    return np.asarray(kmeans_model.predict(user_reduced))
@@ -78,17 +78,29 @@ const ModelRetrainingPage: React.FC = () => {
     setUploadMsg("");
     try {
       const res = await axios.post("/api/ml/retrain");
-      if (res.data.success) {
-        setUploadMsg("Retrain successful!");
-        // Update metrics with new values from response
-        if (res.data.metrics) {
-          setMetrics(res.data.metrics);
+      if (!res.data.success) {
+        setUploadMsg("Retrain failed: " + (res.data.error || "Unknown error"));
+      } else {
+        // Retraining runs as a background job; poll it until it finishes
+        let job = res.data;
+        while (job.status === "queued" || job.status === "running") {
+          setUploadMsg(
+            "Retraining" + (job.stage ? ` (${job.stage})` : "") + "..."
+          );
+          await new Promise((resolve) => setTimeout(resolve, 3000));
+          job = (await axios.get(`/api/ml/retrain_jobs/${res.data.job_id}`))
+            .data;
+        }
+        if (job.status === "succeeded") {
+          setUploadMsg("Retrain successful!");
+          if (job.result?.metrics) {
+            setMetrics(job.result.metrics);
+          } else {
+            fetchMetrics();
+          }
         } else {
-          // If metrics not in response, fetch them
-          fetchMetrics();
+          setUploadMsg("Retrain failed: " + (job.error || "Unknown error"));
         }
-      } else {
-        setUploadMsg("Retrain failed: " + (res.data.error || "Unknown error"));
       }
     } catch (err: any) {
       setUploadMsg(